@@ -0,0 +1,21 @@
+import datalake_stats_engine as engine
+import datalake_stats_benchmark as benchmark
+import pytest
+
+
+@pytest.fixture
+def local_engine(tmp_path, monkeypatch):
+    "Writes stats, anomaly state and checkpoints under tmp_path and restores the module settings afterwards"
+    monkeypatch.chdir(tmp_path)
+    for name in ['STATS_SINK', 'STATS_LOCAL_DIR', 'stats_writer', 'USE_ETL_CACHE', 'DETECT_ANOMALIES',
+                 'USE_CHECKPOINT', 'MAX_LS_CALLS_PER_SECOND', 'ls_rate_limiter', 'USE_ADAPTIVE_CONCURRENCY', 'FEED_TIMEOUT_SECONDS', 'FAILED_FEED_RETRY_PASSES']:
+        monkeypatch.setattr(engine, name, getattr(engine, name))
+    benchmark.configure_engine(str(tmp_path))
+    engine.feed_failure_log.reset()
+    return engine
+
+
+@pytest.fixture
+def synthetic_fs(local_engine):
+    "A small synthetic lake: one source with two feeds of three ETLs of two files each"
+    return local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=2, etls_per_feed=3, files_per_etl=2, seed=0)
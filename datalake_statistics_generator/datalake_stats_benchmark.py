@@ -0,0 +1,217 @@
+"""Benchmarks the feed statistics pipeline against a syntheticFileSystem lake.
+
+Runs process_feed_list, process_feed_list_threaded at several thread counts,
+process_feed_list_async at the same in-flight listing limits, process_etls_agg and the feed
+summary in compute_feed_stats over growing lake shapes, and writes the results as JSON so
+numbers can be compared between versions. Timings come from a pass without tracemalloc, which
+slows allocation-heavy code several times over; peak memory from a second, traced pass:
+
+    python datalake_stats_benchmark.py --latency 0.005 --output bench.json
+"""
+import datalake_stats_engine as engine
+import numpy as np
+import pandas as pd
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+CONCURRENCY_LEVELS = [1, 4, 16, 64]
+FEED_LIST_SHAPES = [
+    {'num_sources': 5, 'feeds_per_source': 10, 'etls_per_feed': 30, 'files_per_etl': 20},
+    {'num_sources': 10, 'feeds_per_source': 20, 'etls_per_feed': 90, 'files_per_etl': 50},
+]
+FILES_PER_ETL_LEVELS = [10, 1000, 10000]
+ETLS_PER_FEED_LEVELS = [10, 100, 1000]
+QUICK_FEED_LIST_SHAPES = FEED_LIST_SHAPES[:1]
+QUICK_CONCURRENCY_LEVELS = [1, 8]
+QUICK_FILES_PER_ETL_LEVELS = [10, 1000]
+QUICK_ETLS_PER_FEED_LEVELS = [10, 100]
+SEED = 0
+
+def configure_engine(output_dir):
+    """Points the engine at local, cache-free, unthrottled output with no anomaly or checkpoint state,
+    and lists without the adaptive concurrency limit, so only the crawl at each thread count is measured"""
+    engine.STATS_SINK = 'local'
+    engine.STATS_LOCAL_DIR = output_dir
+    engine.stats_writer = None
+    engine.USE_ETL_CACHE = False
+    engine.DETECT_ANOMALIES = False
+    engine.USE_CHECKPOINT = False
+    engine.MAX_LS_CALLS_PER_SECOND = 0
+    engine.USE_ADAPTIVE_CONCURRENCY = False
+
+def latency_percentiles(latencies):
+    if len(latencies) == 0: return {'p50': None, 'p99': None, 'max': None}
+    return {'p50': float(np.percentile(latencies, 50)),
+            'p99': float(np.percentile(latencies, 99)),
+            'max': float(max(latencies))}
+
+def measure(run):
+    """Runs run() once untraced for its result and elapsed seconds, then again under tracemalloc
+    for the peak traced bytes. Returns (result, elapsed seconds, peak traced bytes)"""
+    start_time = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start_time
+    tracemalloc.start()
+    try:
+        run()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak_bytes
+
+def bench_feed_list(shape, num_threads, latency_seconds, engine_mode='threaded'):
+    """Crawls every feed of a synthetic lake: sequentially (num_threads None), with the thread
+    pool, or with engine_mode 'async' and num_threads as the in-flight listing limit"""
+    feeds = engine.syntheticFileSystem(seed=SEED, **shape).get_feed_paths()
+    def run():
+        np.random.seed(SEED)
+        fs = engine.syntheticFileSystem(latency_seconds=latency_seconds, seed=SEED, **shape)
+        if num_threads is None:
+            feed_timings = engine.process_feed_list(feeds, adl=fs)
+        elif engine_mode == 'async':
+            feed_timings = engine.process_feed_list_async(feeds, adl=fs, max_in_flight=num_threads)
+        else:
+            feed_timings = engine.process_feed_list_threaded(feeds, num_threads=num_threads, adl=fs)
+        return feed_timings, fs.ls_calls
+    (feed_timings, listings), elapsed, peak_bytes = measure(run)
+    if num_threads is None: benchmark = 'process_feed_list'
+    elif engine_mode == 'async': benchmark = 'process_feed_list_async'
+    else: benchmark = 'process_feed_list_threaded'
+    result = {'benchmark': benchmark,
+              'shape': shape,
+              'latency_seconds': latency_seconds,
+              'num_threads': 1 if num_threads is None else num_threads,
+              'feeds': len(feeds),
+              'seconds': elapsed,
+              'feeds_per_second': len(feeds)/elapsed,
+              'listings': listings,
+              'listings_per_second': listings/elapsed,
+              'peak_memory_bytes': peak_bytes,
+              'feed_latency_seconds': latency_percentiles(list(feed_timings.values()))}
+    if benchmark == 'process_feed_list_async':
+        # one event loop thread, with num_threads listings in flight
+        result['num_threads'] = 1
+        result['max_in_flight'] = num_threads
+    return result
+
+def bench_etls_agg(files_per_etl, repeats=20):
+    "Summarises one ETL directory of files_per_etl files, repeated to get stable latencies"
+    fs = engine.syntheticFileSystem(num_sources=1, feeds_per_source=1, etls_per_feed=1, files_per_etl=files_per_etl, seed=SEED)
+    etl_path = fs.ls(fs.get_feed_paths()[0], detail=True)[0]['name']
+    fs.ls(etl_path, detail=True)
+    def run():
+        latencies = []
+        for repeat in range(repeats):
+            start_time = time.perf_counter()
+            engine.process_etls_agg(etl_path, fs)
+            latencies.append(time.perf_counter() - start_time)
+        return latencies
+    latencies, elapsed, peak_bytes = measure(run)
+    return {'benchmark': 'process_etls_agg',
+            'files_per_etl': files_per_etl,
+            'repeats': repeats,
+            'seconds': elapsed,
+            'files_per_second': files_per_etl*repeats/elapsed,
+            'peak_memory_bytes': peak_bytes,
+            'etl_latency_seconds': latency_percentiles(latencies)}
+
+def bench_feed_summary(etls_per_feed, repeats=5):
+    """Times compute_feed_stats for one feed with every ETL sampled, which isolates the
+    per-ETL aggregation and the summary statistics from sampling noise"""
+    fs = engine.syntheticFileSystem(num_sources=1, feeds_per_source=1, etls_per_feed=etls_per_feed, files_per_etl=5, seed=SEED)
+    feed_path = fs.get_feed_paths()[0]
+    sample_perc = engine.SAMPLE_PERC
+    engine.SAMPLE_PERC = 1.0
+    def run():
+        latencies = []
+        for repeat in range(repeats):
+            start_time = time.perf_counter()
+            engine.compute_feed_stats(feed_path, adl=fs)
+            latencies.append(time.perf_counter() - start_time)
+        return latencies
+    try:
+        latencies, elapsed, peak_bytes = measure(run)
+    finally:
+        engine.SAMPLE_PERC = sample_perc
+    return {'benchmark': 'compute_feed_stats',
+            'etls_per_feed': etls_per_feed,
+            'repeats': repeats,
+            'seconds': elapsed,
+            'etls_per_second': etls_per_feed*repeats/elapsed,
+            'peak_memory_bytes': peak_bytes,
+            'feed_latency_seconds': latency_percentiles(latencies)}
+
+def get_code_version():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def run_benchmarks(latency_seconds, quick=False):
+    shapes = QUICK_FEED_LIST_SHAPES if quick else FEED_LIST_SHAPES
+    concurrency_levels = QUICK_CONCURRENCY_LEVELS if quick else CONCURRENCY_LEVELS
+    results = []
+    for shape in shapes:
+        results.append(bench_feed_list(shape, None, latency_seconds))
+        for num_threads in concurrency_levels:
+            results.append(bench_feed_list(shape, num_threads, latency_seconds))
+        for max_in_flight in concurrency_levels:
+            results.append(bench_feed_list(shape, max_in_flight, latency_seconds, 'async'))
+    for files_per_etl in (QUICK_FILES_PER_ETL_LEVELS if quick else FILES_PER_ETL_LEVELS):
+        results.append(bench_etls_agg(files_per_etl))
+    for etls_per_feed in (QUICK_ETLS_PER_FEED_LEVELS if quick else ETLS_PER_FEED_LEVELS):
+        results.append(bench_feed_summary(etls_per_feed))
+    return results
+
+def print_results(results):
+    for result in results:
+        line = "{:<28}".format(result['benchmark'])
+        if 'max_in_flight' in result:
+            line += " feeds={} in_flight={} {:.1f} feeds/s {:.1f} listings/s p50={:.3f}s p99={:.3f}s".format(
+                result['feeds'], result['max_in_flight'], result['feeds_per_second'], result['listings_per_second'],
+                result['feed_latency_seconds']['p50'], result['feed_latency_seconds']['p99'])
+        elif 'feeds' in result:
+            line += " feeds={} threads={} {:.1f} feeds/s {:.1f} listings/s p50={:.3f}s p99={:.3f}s".format(
+                result['feeds'], result['num_threads'], result['feeds_per_second'], result['listings_per_second'],
+                result['feed_latency_seconds']['p50'], result['feed_latency_seconds']['p99'])
+        elif 'files_per_etl' in result:
+            line += " files={} p50={:.4f}s p99={:.4f}s".format(
+                result['files_per_etl'], result['etl_latency_seconds']['p50'], result['etl_latency_seconds']['p99'])
+        else:
+            line += " etls={} p50={:.4f}s p99={:.4f}s".format(
+                result['etls_per_feed'], result['feed_latency_seconds']['p50'], result['feed_latency_seconds']['p99'])
+        line += " peak={:.1f}MB".format(result['peak_memory_bytes']/1000000)
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the datalake feed statistics pipeline")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated seconds per directory listing")
+    parser.add_argument('--quick', action='store_true', help="run the small shapes only")
+    parser.add_argument('--output', default='benchmark_results_{}.json'.format(datetime.now().strftime('%Y%m%d_%H%M%S')))
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as output_dir:
+        configure_engine(output_dir)
+        results = run_benchmarks(args.latency, args.quick)
+    print_results(results)
+    report = {'created': datetime.now().isoformat(),
+              'code_version': get_code_version(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'numpy': np.__version__,
+              'platform': platform.platform(),
+              'results': results}
+    with open(args.output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print("Wrote {}".format(args.output))
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,44 @@
-from pyspark.shell import spark #this is necessary to run on the cluster
-from pyspark import SparkContext 
-from pyspark.sql.types import *
-import azure.datalake.store
-from azure.datalake.store import core, lib, multithread
-from azure.storage.blob import BlockBlobService
-from azure.storage.blob import AppendBlobService
+try:
+    from azure.datalake.store import core, lib, multithread
+    from azure.storage.blob import BlockBlobService
+    from azure.storage.blob import AppendBlobService
+except ImportError:
+    # the local and synthetic filesystem backends run without the Azure SDKs installed
+    core = lib = multithread = BlockBlobService = AppendBlobService = None
+try:
+    import aiohttp
+except ImportError:
+    # without aiohttp the async crawl engine runs blocking ls calls on a thread pool
+    aiohttp = None
+try:
+    import requests
+except ImportError:
+    requests = None
 import pandas as pd
 import numpy as np
 import sys
+import os
 import threading
+import queue
+import sched
+import time
 import re
 import json
 import traceback
-from datetime import date
+import io
+import random
+import zlib
+import math
+import itertools
+import contextlib
+import contextvars
+import cProfile
+from fnmatch import fnmatch
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from collections import OrderedDict
 
 
 SAMPLE_PERC = .10
@@ -30,26 +56,344 @@ purge_config_path = "adl://isrmanalyticsadlsdata01.azuredatalakestore.net/prod/c
 ADLS_ACCOUNT = "isrmanalyticsadlsdata01"
 current_date = date.today().isoformat()
 STATS_FILE_NAME = 'stats_'+current_date+'.json'
+NUM_CRAWLER_THREADS = 16
+FEED_QUEUE_SIZE = 64
+FEED_TIMEOUT_SECONDS = 60*30
+MAX_LS_CALLS_PER_SECOND = 50
+THROTTLE_BACKOFF_SECONDS = 5
+NUM_SLOWEST_FEEDS_REPORTED = 10
+ADLS_TOKEN_REFRESH_SECONDS = 60*45
+USE_ETL_CACHE = True
+ETL_CACHE_PATH = 'etl_listing_cache.json'
+ETL_CACHE_MAX_ENTRIES = 500000
+STATS_SINK = 'blob'
+STATS_OUTPUT_FORMAT = 'json'
+STATS_LOCAL_DIR = '.'
+STATS_FLUSH_BYTES = 1024*1024
+BLOB_MAX_BLOCK_BYTES = 4*1024*1024
+EXECUTION_MODE = 'threaded'
+SPARK_FEEDS_PER_PARTITION = 20
+SPARK_ETLS_PER_PARTITION = 200
+FILESYSTEM_BACKEND = 'adls'
+LOCAL_FS_ROOT = '.'
+ASYNC_MAX_IN_FLIGHT = 512
+ASYNC_EXECUTOR_THREADS = 32
+ASYNC_MAX_CONCURRENT_FEEDS = 64
+ADLS_LIST_PAGE_SIZE = 4000
+SAMPLING_MODE = 'fraction'
+ETL_LISTING_BUDGET = 30
+SAMPLING_STRATA = 5
+MIN_ETL_SAMPLES = 5
+CI_Z_SCORE = 1.96
+CI_RELATIVE_HALF_WIDTH = 0.10
+CONFIG_INCLUDE_SOURCES = None
+CONFIG_EXCLUDE_SOURCES = None
+CONFIG_INCLUDE_FEEDS = None
+CONFIG_EXCLUDE_FEEDS = None
+SAVE_HISTORY = False
+DETECT_ANOMALIES = True
+ANOMALY_STATE_PATH = 'feed_anomaly_state.json'
+ANOMALY_METRICS = ['LatestETLMB', 'Last24HrsETLMB']
+ANOMALY_EWMA_ALPHA = 0.1
+ANOMALY_Z_THRESHOLD = 4.0
+ANOMALY_MIN_RUNS = 7
+ANOMALY_MIN_RELATIVE_STD = 0.05
+ANOMALY_EXPECTED_ARRIVAL_RATE = 0.8
+COLLECT_METRICS = True
+METRICS_FORMAT = 'json'
+METRICS_FILE_NAME = 'run_metrics_'+current_date
+PROFILE_SLOWEST_FEEDS = 0
+PROFILE_DIR = 'profiles'
+USE_CHECKPOINT = True
+CHECKPOINT_PATH = 'stats_checkpoint_'+current_date+'.ndjson'
+MAX_CALL_RETRIES = 5
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30
+USE_ADAPTIVE_CONCURRENCY = True
+ADAPTIVE_MIN_CONCURRENCY = 1
+ADAPTIVE_MAX_CONCURRENCY = 64
+CIRCUIT_FAILURE_THRESHOLD = 20
+CIRCUIT_RESET_SECONDS = 60
+FAILED_FEED_RETRY_PASSES = 1
+HISTORY_ROOT = 'feed_stats_history'
+adls_url_prefix_re = re.compile(re.escape("adl://isrmanalyticsadlsdata01.azuredatalakestore.net/"))
+
+current_feed_path = contextvars.ContextVar('current_feed_path', default=None)
+
+class runMetrics:
+    """Timers and counters for one run, broken down by phase and by feed. A phase's time is
+    attributed to the feed being crawled in the current thread or asyncio task (set with
+    feed_context), so nested phases are inclusive: process_feeds_agg contains that feed's ls and
+    process_etls_agg time. Safe to share between crawler threads"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.phases = {}
+            self.counters = {}
+            self.feed_phases = {}
+    @contextlib.contextmanager
+    def timer(self, phase):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start_time)
+    def record(self, phase, seconds):
+        if not COLLECT_METRICS: return
+        feed_path = current_feed_path.get()
+        with self.lock:
+            phase_totals = self.phases.setdefault(phase, [0, 0.0, 0.0])
+            phase_totals[0] += 1
+            phase_totals[1] += seconds
+            phase_totals[2] = max(phase_totals[2], seconds)
+            if feed_path is not None:
+                feed_totals = self.feed_phases.setdefault(feed_path, {}).setdefault(phase, [0, 0.0])
+                feed_totals[0] += 1
+                feed_totals[1] += seconds
+    def increment(self, counter, amount=1):
+        if not COLLECT_METRICS: return
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+    def to_dict(self, num_feeds=None):
+        """Per-phase count, total and max seconds, counters, and the per-phase breakdown of the
+        num_feeds (default NUM_SLOWEST_FEEDS_REPORTED) feeds with the most process_feeds_agg time"""
+        if num_feeds is None: num_feeds = NUM_SLOWEST_FEEDS_REPORTED
+        with self.lock:
+            phases = {phase: {'count': totals[0], 'seconds': totals[1], 'max_seconds': totals[2]}
+                      for phase, totals in self.phases.items()}
+            feed_items = list(self.feed_phases.items())
+            counters = dict(self.counters)
+        slowest = sorted(feed_items, key=lambda item: item[1].get('process_feeds_agg', [0, 0.0])[1], reverse=True)[:num_feeds]
+        return {'ProcessDate': current_date,
+                'run_seconds': time.time() - self.started_at,
+                'phases': phases,
+                'counters': counters,
+                'feeds_timed': len(feed_items),
+                'slowest_feeds': [{'feed': feed_path,
+                                   'phases': {phase: {'count': totals[0], 'seconds': totals[1]} for phase, totals in feed_phases.items()}}
+                                  for feed_path, feed_phases in slowest]}
+    def to_prometheus(self):
+        "The per-phase totals and counters in the Prometheus text exposition format"
+        metrics = self.to_dict(0)
+        lines = []
+        for metric_name, metric_type, key in [('phase_seconds_total', 'counter', 'seconds'),
+                                              ('phase_calls_total', 'counter', 'count'),
+                                              ('phase_max_seconds', 'gauge', 'max_seconds')]:
+            lines.append('# TYPE datalake_stats_{} {}'.format(metric_name, metric_type))
+            for phase, totals in sorted(metrics['phases'].items()):
+                lines.append('datalake_stats_{}{{phase="{}"}} {}'.format(metric_name, phase, totals[key]))
+        for counter, value in sorted(metrics['counters'].items()):
+            lines.append('# TYPE datalake_stats_{}_total counter'.format(counter))
+            lines.append('datalake_stats_{}_total {}'.format(counter, value))
+        lines.append('# TYPE datalake_stats_run_seconds gauge')
+        lines.append('datalake_stats_run_seconds {}'.format(metrics['run_seconds']))
+        return '\n'.join(lines) + '\n'
+    def dump(self, file_name=None, output_format=None):
+        "Writes the metrics as METRICS_FORMAT ('json' or 'prometheus') and returns the file path"
+        if file_name is None: file_name = METRICS_FILE_NAME
+        if output_format is None: output_format = METRICS_FORMAT
+        if output_format == 'prometheus':
+            file_path, text = file_name + '.prom', self.to_prometheus()
+        else:
+            file_path, text = file_name + '.json', json.dumps(self.to_dict(), indent=2, default=json_default)
+        with open(file_path, 'w') as metrics_file:
+            metrics_file.write(text)
+        return file_path
+
+run_metrics = runMetrics()
+
+@contextlib.contextmanager
+def feed_context(feed_path):
+    "Attributes the metrics recorded inside the block to feed_path"
+    token = current_feed_path.set(feed_path)
+    try:
+        yield
+    finally:
+        current_feed_path.reset(token)
+
+class adlsClientPool:
+    """Hands out one AzureDLFileSystem for the whole run instead of authenticating per call.
+    The client keeps a requests session per thread, so each crawler thread reuses its
+    connections. The token is refreshed in place once it is older than ADLS_TOKEN_REFRESH_SECONDS"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.credential = None
+        self.adl = None
+        self.acquired_at = 0
+    def get_client(self):
+        with self.lock:
+            if self.adl is None:
+                with run_metrics.timer('auth'):
+                    self.credential = lib.auth(tenant_id=TENANT_ID, client_secret=CLIENT_SECRET,
+                                    client_id=CLIENT_ID, resource = 'https://datalake.azure.net/')
+                self.adl = core.AzureDLFileSystem(self.credential, store_name=ADLS_ACCOUNT)
+                self.acquired_at = time.time()
+            elif time.time() - self.acquired_at > ADLS_TOKEN_REFRESH_SECONDS:
+                with run_metrics.timer('auth_refresh'):
+                    self.credential.refresh_token()
+                self.acquired_at = time.time()
+            return self.adl
+
+adls_client_pool = adlsClientPool()
+
+def get_adls_client():
+    "Returns the shared, thread-safe ADLS client for this process"
+    return adls_client_pool.get_client()
+
+def make_listing_entry(name, entry_type, length, modification_time):
+    "A listing entry with the keys the crawler reads from AzureDLFileSystem.ls(detail=True)"
+    return {'name':name, 'type':entry_type, 'length':length, 'modificationTime':modification_time}
+
+class localFileSystem:
+    """Serves ls/open from a directory tree on local disk, so a copy of part of the lake
+    (prod/feeds/<source>/<feed>/etldate=<date>/<files>) can be crawled offline"""
+    def __init__(self, root=LOCAL_FS_ROOT):
+        self.root = root
+    def local_path(self, path):
+        return os.path.join(self.root, path.strip('/'))
+    def ls(self, path, detail=False):
+        entries = []
+        with os.scandir(self.local_path(path)) as directory:
+            for entry in directory:
+                entry_stat = entry.stat()
+                is_dir = entry.is_dir()
+                entries.append(make_listing_entry(path.rstrip('/') + '/' + entry.name,
+                                                  'DIRECTORY' if is_dir else 'FILE',
+                                                  0 if is_dir else entry_stat.st_size,
+                                                  int(entry_stat.st_mtime*1000)))
+        entries.sort(key=lambda k: k['name'])
+        return entries if detail else [entry['name'] for entry in entries]
+    def open(self, path, mode='rb'):
+        return open(self.local_path(path), mode)
+
+class syntheticFileSystem:
+    """In-memory stand-in for the lake: num_sources x feeds_per_source feeds under root, each with
+    etls_per_feed daily etldate= partitions holding files_per_etl part files and a _SUCCESS marker.
+    Listings are generated deterministically from the path and seed, so runs are reproducible,
+    and every ls sleeps latency_seconds to stand in for the ADLS round trip.
+    open() serves a purge config listing every feed"""
+    def __init__(self, num_sources=10, feeds_per_source=10, etls_per_feed=30, files_per_etl=20,
+                 latency_seconds=0.0, root='prod/feeds', seed=0):
+        self.num_sources = num_sources
+        self.feeds_per_source = feeds_per_source
+        self.etls_per_feed = etls_per_feed
+        self.files_per_etl = files_per_etl
+        self.latency_seconds = latency_seconds
+        self.root = root.strip('/')
+        self.seed = seed
+        self.today = date.today()
+        self.now_ms = int(time.time()*1000)
+        self.lock = threading.Lock()
+        self.ls_calls = 0
+    def get_feed_paths(self):
+        return ['{}/source{:03d}/feed{:03d}'.format(self.root, source_num, feed_num)
+                for source_num in range(self.num_sources) for feed_num in range(self.feeds_per_source)]
+    def path_random(self, path):
+        return random.Random(zlib.crc32(path.encode()) + self.seed)
+    def ls(self, path, detail=False):
+        with self.lock:
+            self.ls_calls += 1
+        if self.latency_seconds > 0: time.sleep(self.latency_seconds)
+        return self.list_entries(path, detail)
+    async def als(self, path, detail=False):
+        "Coroutine version of ls, used by the async crawl engine"
+        with self.lock:
+            self.ls_calls += 1
+        if self.latency_seconds > 0: await asyncio.sleep(self.latency_seconds)
+        return self.list_entries(path, detail)
+    def list_entries(self, path, detail):
+        path = path.strip('/')
+        if path != self.root and not path.startswith(self.root + '/'):
+            raise FileNotFoundError(path)
+        parts = [part for part in path[len(self.root):].split('/') if part != '']
+        if len(parts) == 0:
+            entries = [make_listing_entry('{}/source{:03d}'.format(path, source_num), 'DIRECTORY', 0, self.now_ms)
+                       for source_num in range(self.num_sources)]
+        elif len(parts) == 1:
+            entries = [make_listing_entry('{}/feed{:03d}'.format(path, feed_num), 'DIRECTORY', 0, self.now_ms)
+                       for feed_num in range(self.feeds_per_source)]
+        elif len(parts) == 2:
+            entries = []
+            for etl_num in range(self.etls_per_feed):
+                etl_date = self.today - timedelta(days=etl_num)
+                modification_time = self.now_ms - etl_num*86400000 - self.path_random(path + str(etl_num)).randint(0, 3600000)
+                entries.append(make_listing_entry('{}/etldate={}'.format(path, etl_date.isoformat()), 'DIRECTORY', 0, modification_time))
+        elif len(parts) == 3:
+            feed_scale = self.path_random(path.rsplit('/', 1)[0]).randint(1, 1000)
+            etl_random = self.path_random(path)
+            modification_time = self.now_ms - (self.today - date.fromisoformat(extract_date(parts[2]))).days*86400000
+            entries = [make_listing_entry(path + '/_SUCCESS', 'FILE', 0, modification_time)]
+            for file_num in range(self.files_per_etl):
+                entries.append(make_listing_entry('{}/part-{:05d}.parquet'.format(path, file_num), 'FILE',
+                                                  etl_random.randint(feed_scale*1000, feed_scale*100000), modification_time))
+        else:
+            raise FileNotFoundError(path)
+        return entries if detail else [entry['name'] for entry in entries]
+    def open(self, path, mode='rb'):
+        if path.strip('/') != purge_config_path_short:
+            raise FileNotFoundError(path)
+        config_lines = ['Path,RetentionDays']
+        for feed_path in self.get_feed_paths():
+            config_lines.append('adl://{}.azuredatalakestore.net/{},30'.format(ADLS_ACCOUNT, feed_path))
+        return io.BytesIO(('\n'.join(config_lines) + '\n').encode('utf-8'))
+
+filesystem = None
+filesystem_lock = threading.Lock()
+
+def get_filesystem():
+    "Returns the filesystem the crawler lists, as selected by FILESYSTEM_BACKEND"
+    global filesystem
+    with filesystem_lock:
+        if filesystem is None:
+            if FILESYSTEM_BACKEND == 'local':
+                filesystem = localFileSystem(LOCAL_FS_ROOT)
+            elif FILESYSTEM_BACKEND == 'synthetic':
+                filesystem = syntheticFileSystem()
+        if filesystem is not None: return filesystem
+    return get_adls_client()
+
+def set_filesystem(new_filesystem):
+    "Makes every crawl in this process list new_filesystem, e.g. a syntheticFileSystem for benchmarks"
+    global filesystem
+    with filesystem_lock:
+        filesystem = new_filesystem
 
-def get_feed_list_from_config():
+def get_feed_list_from_config(adl=None, include_sources=None, exclude_sources=None, include_feeds=None, exclude_feeds=None):
     "Returns a list of Data Platform feeds from the purgeconfig file."
-    adlCreds = lib.auth(tenant_id=TENANT_ID, client_secret=CLIENT_SECRET,
-                    client_id=CLIENT_ID, resource = 'https://datalake.azure.net/')
-    adl = core.AzureDLFileSystem(adlCreds, store_name=ADLS_ACCOUNT)
-    string = "adl://isrmanalyticsadlsdata01.azuredatalakestore.net/"
-    re_string = re.escape(string)
-    feed_list = []
+    return list(iter_feed_list_from_config(adl, include_sources, exclude_sources, include_feeds, exclude_feeds))
+
+def iter_feed_list_from_config(adl=None, include_sources=None, exclude_sources=None, include_feeds=None, exclude_feeds=None):
+    """Yields feed paths from the purgeconfig file line by line as it is read, so crawling can
+    start before the whole file is parsed. wasbs entries and repeated paths are skipped.
+    The include/exclude arguments are lists of source or feed names (fnmatch patterns allowed)
+    and default to the CONFIG_INCLUDE_*/CONFIG_EXCLUDE_* settings; None there means no filter"""
+    if adl is None: adl = get_filesystem()
+    if include_sources is None: include_sources = CONFIG_INCLUDE_SOURCES
+    if exclude_sources is None: exclude_sources = CONFIG_EXCLUDE_SOURCES
+    if include_feeds is None: include_feeds = CONFIG_INCLUDE_FEEDS
+    if exclude_feeds is None: exclude_feeds = CONFIG_EXCLUDE_FEEDS
+    seen_paths = set()
     with adl.open(purge_config_path_short, 'rb') as purge_config_file:
         purge_config_file.readline()
-        file_contents = purge_config_file.readlines()
-        line_num = 0
-        for line in file_contents:
-            #if line_num >= 5: break
-            if "wasbs" not in line.decode("utf-8"):
-                clean_contents = re.sub(re_string,"",line.decode("utf-8").split(",")[0])
-                feed_list.append(clean_contents)
-                line_num += 1
-    return feed_list
+        while True:
+            raw_line = purge_config_file.readline()
+            if not raw_line: break
+            line = raw_line.decode("utf-8")
+            if "wasbs" in line: continue
+            feed_path = adls_url_prefix_re.sub("", line.split(",")[0]).strip()
+            if feed_path == "" or feed_path in seen_paths: continue
+            seen_paths.add(feed_path)
+            if not name_passes_filters(get_feed_source(feed_path), include_sources, exclude_sources): continue
+            if not name_passes_filters(get_path_suffix(feed_path), include_feeds, exclude_feeds): continue
+            yield feed_path
+
+def name_passes_filters(name, include_patterns=None, exclude_patterns=None):
+    if include_patterns is not None and not any(fnmatch(name, pattern) for pattern in include_patterns): return False
+    if exclude_patterns is not None and any(fnmatch(name, pattern) for pattern in exclude_patterns): return False
+    return True
 
 def parse_adls_path(path,level='file'):
     """Parse a feed path at the file level 
@@ -93,56 +437,681 @@ def extract_date(etlstamp):
         #print("Could not extract date from etl time stamp")
         return "1970-01-01"
 
-def get_adls_file_dataframe(beginning_path):
-    """returns a data frame with detailed system information using a adls file system client"""
-    adlCreds = lib.auth(tenant_id=TENANT_ID, client_secret=CLIENT_SECRET,
-                    client_id=CLIENT_ID, resource = 'https://datalake.azure.net/')
-    adl = core.AzureDLFileSystem(adlCreds, store_name=ADLS_ACCOUNT)
-    return pd.DataFrame(adl.ls(beginning_path,detail=True))
+class requestRateLimiter:
+    """Spaces out calls so that at most `rate` calls per second are started across all threads.
+    pause() pushes the next free slot back, which is used to back off when ADLS throttles us"""
+    def __init__(self, rate):
+        self.interval = 1.0/rate if rate > 0 else 0
+        self.next_slot = time.time()
+        self.lock = threading.Lock()
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+    def pause(self, seconds):
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.time() + seconds)
+
+ls_rate_limiter = None
+
+def reset_ls_rate_limiter():
+    "Starts a crawl with a fresh ls rate limiter at the current MAX_LS_CALLS_PER_SECOND"
+    global ls_rate_limiter
+    ls_rate_limiter = requestRateLimiter(MAX_LS_CALLS_PER_SECOND)
+    return ls_rate_limiter
+
+def get_ls_rate_limiter():
+    "Returns the ls rate limiter of the current crawl, creating one for calls made outside a crawl"
+    if ls_rate_limiter is None: return reset_ls_rate_limiter()
+    return ls_rate_limiter
+
+THROTTLING_STATUSES = (429, 503)
+
+class httpStatusError(IOError):
+    "A failed HTTP call, raised with its status by clients that do not carry one on their own errors"
+    def __init__(self, message, status_code):
+        IOError.__init__(self, message)
+        self.status_code = status_code
+
+def get_error_status(error):
+    """The HTTP status of a failed call, or None: status_code on azure-storage and httpStatusError
+    errors, status on aiohttp's, or the status of the response attached to azure-datalake-store
+    and requests exceptions. Paths in the error text are never read as a status"""
+    for holder in (error, getattr(error, 'response', None)):
+        for attribute in ('status_code', 'status'):
+            status = getattr(holder, attribute, None)
+            if isinstance(status, int): return status
+    return None
+
+def is_throttling_error(error):
+    "ADLS reports throttling as HTTP 429 / 503"
+    return get_error_status(error) in THROTTLING_STATUSES
+
+class circuitOpenError(Exception):
+    "Raised instead of calling a service whose circuitBreaker is open"
+    pass
+
+TRANSIENT_ERROR_STATUSES = (408, 429, 500, 502, 503, 504)
+# timeouts and dropped connections of the HTTP clients the SDKs use, which are not builtin ConnectionErrors
+TRANSIENT_ERROR_TYPES = (circuitOpenError, TimeoutError, asyncio.TimeoutError, ConnectionError)
+if requests is not None: TRANSIENT_ERROR_TYPES += (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+if aiohttp is not None: TRANSIENT_ERROR_TYPES += (aiohttp.ClientConnectionError,)
+
+def is_transient_error(error):
+    """True for failures worth retrying: throttling, timeouts, dropped connections, server errors
+    and an open circuit, judged by the exception type and HTTP status (get_error_status).
+    Missing paths, permission errors and anything else are not retried"""
+    if isinstance(error, TRANSIENT_ERROR_TYPES): return True
+    return get_error_status(error) in TRANSIENT_ERROR_STATUSES
+
+def retry_delay_seconds(attempt):
+    "Full-jitter exponential backoff: uniform in [0, RETRY_BASE_SECONDS * 2**attempt], capped"
+    return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2**attempt))
 
-def get_adls_file_list(beginning_path):
+class adaptiveConcurrencyLimiter:
+    """Caps the number of calls in flight and adapts the cap AIMD-style: it grows by one after
+    each cap's worth of successful calls and halves when the service throttles (at most once
+    per second, so a burst of 429s from one overload only halves it once)"""
+    def __init__(self, initial, minimum=None, maximum=None):
+        if minimum is None: minimum = ADAPTIVE_MIN_CONCURRENCY
+        if maximum is None: maximum = ADAPTIVE_MAX_CONCURRENCY
+        self.limit = max(minimum, min(maximum, initial))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+    def on_success(self):
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit:
+                self.successes = 0
+                if self.limit < self.maximum:
+                    self.limit += 1
+                    self.condition.notify()
+    def on_throttle(self):
+        with self.condition:
+            if time.time() - self.last_decrease < 1: return
+            self.last_decrease = time.time()
+            self.successes = 0
+            self.limit = max(self.minimum, self.limit//2)
+            if LOGGING: print("Throttled, concurrency limit now {}".format(self.limit))
+
+class circuitBreaker:
+    """Stops calling a service after failure_threshold consecutive transient failures. While open,
+    calls raise circuitOpenError; after reset_seconds one probe call is let through and its
+    result closes the circuit again or reopens it. A non-transient error (e.g. a missing path)
+    shows the service is answering, so callers report it with on_success"""
+    def __init__(self, name, failure_threshold=None, reset_seconds=None):
+        if failure_threshold is None: failure_threshold = CIRCUIT_FAILURE_THRESHOLD
+        if reset_seconds is None: reset_seconds = CIRCUIT_RESET_SECONDS
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+    def before_call(self):
+        "Raises circuitOpenError while the circuit is open; returns True if this call is the probe"
+        with self.lock:
+            if self.opened_at is None: return False
+            if self.probing or time.time() - self.opened_at < self.reset_seconds:
+                raise circuitOpenError("{} circuit open after {} consecutive failures".format(self.name, self.consecutive_failures))
+            self.probing = True
+            return True
+    def end_probe(self):
+        "Called when a probe call ends; lets another probe through if it ended without a result, e.g. cancelled"
+        with self.lock:
+            self.probing = False
+    def on_success(self):
+        with self.lock:
+            if self.opened_at is not None: print("{} circuit closed".format(self.name))
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probing = False
+    def on_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.probing or (self.opened_at is None and self.consecutive_failures >= self.failure_threshold):
+                if self.opened_at is None: print("{} circuit opened after {} consecutive failures".format(self.name, self.consecutive_failures))
+                self.opened_at = time.time()
+                self.probing = False
+                run_metrics.increment(self.name + '_circuit_opened')
+    def wait_seconds(self):
+        "Time left before the open circuit lets a probe through"
+        with self.lock:
+            if self.opened_at is None: return 0
+            return max(0, self.opened_at + self.reset_seconds - time.time())
+
+class resilientCaller:
+    """Runs calls to one service through its circuitBreaker and (optionally) an
+    adaptiveConcurrencyLimiter, retrying transient failures up to MAX_CALL_RETRIES times with
+    retry_delay_seconds backoff. A call with a deadline (time.time() value, e.g. the feed's
+    timeout) stops retrying and re-raises rather than wait past it for a backoff or an open
+    circuit. Each crawl builds its own (see new_adls_caller), shared by all of its crawler
+    threads, so breaker state does not carry over from one run to the next"""
+    def __init__(self, name, breaker, limiter=None):
+        self.name = name
+        self.breaker = breaker
+        self.limiter = limiter
+    def call(self, func, description='', deadline=None):
+        for attempt in range(MAX_CALL_RETRIES + 1):
+            is_probe = False
+            try:
+                is_probe = self.breaker.before_call()
+                if self.limiter is not None: self.limiter.acquire()
+                try:
+                    result = func()
+                finally:
+                    if self.limiter is not None: self.limiter.release()
+            except Exception as e:
+                if not isinstance(e, circuitOpenError): self.on_failure(e)
+                if not is_transient_error(e) or attempt == MAX_CALL_RETRIES: raise
+                delay = max(retry_delay_seconds(attempt), self.breaker.wait_seconds())
+                if deadline is not None and time.time() + delay > deadline:
+                    run_metrics.increment(self.name + '_retries_past_deadline')
+                    raise
+                run_metrics.increment(self.name + '_retries')
+                if LOGGING: print("Retrying {} {} in {:.1f}s after: {}".format(self.name, description, delay, e))
+                time.sleep(delay)
+                continue
+            else:
+                self.on_success()
+                return result
+            finally:
+                if is_probe: self.breaker.end_probe()
+    def on_success(self):
+        self.breaker.on_success()
+        if self.limiter is not None: self.limiter.on_success()
+    def on_failure(self, error):
+        if not is_transient_error(error):
+            # the service answered, so this does not count towards opening the circuit
+            self.breaker.on_success()
+            return
+        self.breaker.on_failure()
+        if is_throttling_error(error) and self.limiter is not None: self.limiter.on_throttle()
+
+def new_adls_caller(num_threads=None):
+    """A caller for one crawl's ADLS listings with the current CIRCUIT_* settings and, with
+    USE_ADAPTIVE_CONCURRENCY, an adaptive limit starting at num_threads (default NUM_CRAWLER_THREADS)"""
+    if num_threads is None: num_threads = NUM_CRAWLER_THREADS
+    limiter = adaptiveConcurrencyLimiter(num_threads) if USE_ADAPTIVE_CONCURRENCY else None
+    return resilientCaller('adls', circuitBreaker('adls'), limiter)
+
+def new_blob_caller():
+    "A caller for the stats document's blob calls with the current CIRCUIT_* settings"
+    return resilientCaller('blob', circuitBreaker('blob'))
+
+def get_adls_file_dataframe(beginning_path, adl=None, caller=None, deadline=None):
+    """returns a data frame with detailed system information using a adls file system client.
+    Transient failures are retried through caller, the crawl's new_adls_caller(), until deadline"""
+    if adl is None: adl = get_filesystem()
+    if caller is None: caller = new_adls_caller()
+    rate_limiter = get_ls_rate_limiter()
+    def list_directory():
+        with run_metrics.timer('ls_rate_limit_wait'):
+            rate_limiter.wait()
+        run_metrics.increment('ls_calls')
+        try:
+            with run_metrics.timer('ls'):
+                return adl.ls(beginning_path,detail=True)
+        except Exception as e:
+            run_metrics.increment('ls_errors')
+            if is_throttling_error(e):
+                run_metrics.increment('ls_throttled')
+                print("ADLS throttled listing {}, pausing new requests for {}s".format(beginning_path,THROTTLE_BACKOFF_SECONDS))
+                rate_limiter.pause(THROTTLE_BACKOFF_SECONDS)
+            raise
+    return pd.DataFrame(caller.call(list_directory, beginning_path, deadline))
+
+def get_adls_file_list(beginning_path, adl=None):
     """returns a data frame with detailed system information using a adls file system client"""
-    adlCreds = lib.auth(tenant_id=TENANT_ID, client_secret=CLIENT_SECRET,
-                    client_id=CLIENT_ID, resource = 'https://datalake.azure.net/')
-    adl = core.AzureDLFileSystem(adlCreds, store_name=ADLS_ACCOUNT)
+    if adl is None: adl = get_filesystem()
     return pd.DataFrame(adl.ls(beginning_path))
 
+class blobStatsSink:
+    """Writes the stats document to an append blob in the stats container. Each block is
+    appended at the expected offset, so an append retried after a lost response cannot add the
+    same block twice. Azure rejects blocks over 4 MiB, so statsWriter appends at most
+    max_block_bytes (default BLOB_MAX_BLOCK_BYTES) per call"""
+    def __init__(self, blob_name=None, max_block_bytes=None):
+        if blob_name is None: blob_name = STATS_FILE_NAME
+        if max_block_bytes is None: max_block_bytes = BLOB_MAX_BLOCK_BYTES
+        self.blob_name = blob_name
+        self.max_block_bytes = max_block_bytes
+        self.append_blob_service = AppendBlobService(STORAGE_ACCT_NAME, BLOB_KEY)
+        self.offset = 0
+    def create(self):
+        # create_blob replaces an existing blob, so a rerun on the same day starts a fresh document
+        self.append_blob_service.create_blob(BLOB_CONTAINER, self.blob_name)
+        self.offset = 0
+    def append(self, data):
+        try:
+            self.append_blob_service.append_block(BLOB_CONTAINER, self.blob_name, data, appendpos_condition=self.offset)
+        except Exception as e:
+            # 412 AppendPositionConditionNotMet: an earlier attempt of this append already landed
+            if getattr(e, 'status_code', None) != 412: raise
+        self.offset += len(data)
+
+class localFileStatsSink:
+    "Writes the stats document to a local file, for offline runs and benchmarks"
+    max_block_bytes = None
+    def __init__(self, file_name=None, directory=None):
+        if file_name is None: file_name = STATS_FILE_NAME
+        if directory is None: directory = STATS_LOCAL_DIR
+        self.file_path = os.path.join(directory, file_name)
+    def create(self):
+        open(self.file_path, 'wb').close()
+    def append(self, data):
+        with open(self.file_path, 'ab') as stats_file:
+            stats_file.write(data)
+
+def json_default(value):
+    "Lets json.dumps serialise the numpy scalars that pandas aggregations return"
+    if isinstance(value, np.generic): return value.item()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+def finite_or_none(value):
+    "NaN and infinite statistics (e.g. the std of a single ETL) become None, i.e. null in the stats document"
+    return value if math.isfinite(value) else None
+
+class statsWriter:
+    """Buffers feed stats records in memory and appends them to the sink in blocks of about
+    flush_bytes, so a run makes a handful of append calls instead of one per feed.
+    'json' output is a single object keyed by SourceName/FeedName (feed names repeat across
+    sources) after the ProcessDate header;
+    'ndjson' output is one feed record per line. Records are dumped with allow_nan=False, so a
+    NaN that would make the document invalid JSON fails the write instead. The feed records of
+    the current document are kept in records for end-of-run consumers such as the history store.
+    Each document's blob calls go through a new_blob_caller() made when it is opened.
+    Safe to share between crawler threads"""
+    def __init__(self, sink, output_format=STATS_OUTPUT_FORMAT, flush_bytes=STATS_FLUSH_BYTES):
+        self.sink = sink
+        self.output_format = output_format
+        self.flush_bytes = flush_bytes
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.records_written = 0
+        self.records = []
+        self.blob_caller = new_blob_caller()
+    def open(self):
+        with self.lock, run_metrics.timer('stats_create'):
+            self.blob_caller = new_blob_caller()
+            self.blob_caller.call(self.sink.create, 'create')
+            self.buffer = []
+            self.buffered_bytes = 0
+            self.records_written = 0
+            self.records = []
+            if self.output_format == 'json':
+                self._add('{"ProcessDate": ' + json.dumps(current_date))
+    def write(self, feed_stats_dict):
+        if self.output_format == 'json':
+            feed_key = feed_stats_dict['SourceName'] + '/' + feed_stats_dict['FeedName']
+            record = ',' + json.dumps(feed_key) + ':' + json.dumps(feed_stats_dict, default=json_default, allow_nan=False)
+        else:
+            record = json.dumps(feed_stats_dict, default=json_default, allow_nan=False) + '\n'
+        if LOGGING: print("Writing to stats: {}".format(record))
+        with self.lock:
+            self._add(record)
+            self.records.append(feed_stats_dict)
+            self.records_written += 1
+            if self.buffered_bytes >= self.flush_bytes:
+                try:
+                    self._flush()
+                except:
+                    # the buffer is kept and goes out with the next flush
+                    print("Could not append to stats document, will retry: {}".format(sys.exc_info()[1]))
+    def write_section(self, key, value):
+        "Adds a top-level key other than a feed to the document, e.g. MissingFeeds"
+        if self.output_format == 'json':
+            record = ',' + json.dumps(key) + ':' + json.dumps(value, default=json_default, allow_nan=False)
+        else:
+            record = json.dumps({key: value}, default=json_default, allow_nan=False) + '\n'
+        with self.lock:
+            self._add(record)
+    def close(self):
+        with self.lock:
+            if self.output_format == 'json': self._add('}')
+            self._flush()
+    def _add(self, text):
+        self.buffer.append(text)
+        self.buffered_bytes += len(text)
+    def _flush(self):
+        if len(self.buffer) == 0: return
+        data = ''.join(self.buffer).encode()
+        block_bytes = self.sink.max_block_bytes or len(data)
+        with run_metrics.timer('stats_append'):
+            for block_start in range(0, len(data), block_bytes):
+                block = data[block_start:block_start+block_bytes]
+                try:
+                    self.blob_caller.call(lambda: self.sink.append(block), 'append')
+                except:
+                    # keep only the blocks that have not been appended
+                    self.buffer = [data[block_start:].decode()]
+                    self.buffered_bytes = len(data) - block_start
+                    raise
+        self.buffer = []
+        self.buffered_bytes = 0
+
+stats_writer = None
+
+def get_stats_writer():
+    "Returns the writer for today's stats document, creating it for the configured STATS_SINK"
+    global stats_writer
+    if stats_writer is None:
+        sink = localFileStatsSink(STATS_FILE_NAME, STATS_LOCAL_DIR) if STATS_SINK == 'local' else blobStatsSink(STATS_FILE_NAME)
+        stats_writer = statsWriter(sink, STATS_OUTPUT_FORMAT, STATS_FLUSH_BYTES)
+    return stats_writer
+
+class feedFailureLog:
+    """Why each feed that produced no statistics this run failed, and how many times it was
+    tried. A feed is removed once a retry succeeds; what is left goes in the FailedFeeds
+    section of the stats document"""
+    def __init__(self):
+        self.failures = OrderedDict()
+        self.lock = threading.Lock()
+    def reset(self):
+        with self.lock:
+            self.failures = OrderedDict()
+    def record(self, feed_path, reason):
+        with self.lock:
+            attempts = self.failures[feed_path]['Attempts'] + 1 if feed_path in self.failures else 1
+            self.failures[feed_path] = {'SourceName': get_feed_source(feed_path), 'FeedName': get_path_suffix(feed_path),
+                                        'Reason': reason, 'Attempts': attempts}
+    def clear(self, feed_path):
+        with self.lock:
+            self.failures.pop(feed_path, None)
+    def failed_feeds(self):
+        with self.lock:
+            return list(self.failures.keys())
+    def to_list(self):
+        with self.lock:
+            return list(self.failures.values())
+
+feed_failure_log = feedFailureLog()
+
+def describe_failure(error):
+    return "{}: {}".format(type(error).__name__, str(error)[:300])
+
 def open_stats_blob_json():
-    append_blob_service = AppendBlobService(STORAGE_ACCT_NAME, BLOB_KEY)
-    file_contents = "{"+"\"ProcessDate\": \"{}\",".format(current_date)
-    #file_contents = "{"
-    try:
-        append_blob_service.create_blob(
-            BLOB_CONTAINER,
-            STATS_FILE_NAME,
-            if_none_match='*'
-        )
-    except:
-        print("Tried to Create Existing Blob")
+    feed_failure_log.reset()
+    get_stats_writer().open()
 
-    append_blob_service.append_blob_from_bytes(
-        BLOB_CONTAINER,
-        STATS_FILE_NAME,
-        file_contents.encode()
-    )
-    
-def close_stats_blob_json():
-    append_blob_service = AppendBlobService(STORAGE_ACCT_NAME, BLOB_KEY)
-    append_blob_service.append_blob_from_bytes(
-        BLOB_CONTAINER,
-        STATS_FILE_NAME,
-        "}".encode()
-    )
+def close_stats_blob_json(attempted_feeds=None):
+    """Finishes the stats document. attempted_feeds (the feed paths crawled this run) lets the
+    anomaly detector list feeds with a baseline that produced no statistics under MissingFeeds"""
+    anomaly_detector = get_anomaly_detector()
+    if anomaly_detector is not None:
+        if attempted_feeds is not None:
+            get_stats_writer().write_section('MissingFeeds', anomaly_detector.missing_feeds(attempted_feeds))
+        anomaly_detector.save()
+    get_stats_writer().write_section('FailedFeeds', feed_failure_log.to_list())
+    get_stats_writer().close()
 
 def output_stats_to_json_blob(feed_stats_dict):
-    append_blob_service = AppendBlobService(STORAGE_ACCT_NAME, BLOB_KEY)
-    json_string = '"'+feed_stats_dict['FeedName']+'":'+json.dumps(feed_stats_dict)+','
-    if LOGGING: print("Writing to blob: {}".format(json_string))
-    append_blob_service.append_blob_from_bytes(
-        BLOB_CONTAINER,
-        STATS_FILE_NAME,
-        json_string.encode()
-    )
+    anomaly_detector = get_anomaly_detector()
+    if anomaly_detector is not None:
+        feed_stats_dict['Anomalies'] = anomaly_detector.observe(feed_stats_dict)
+    get_stats_writer().write(feed_stats_dict)
+
+def save_run_to_history(feed_records=None, history_root=None):
+    """Appends this run's feed records (default: those written to the stats document) to the
+    Parquet history store in history_root (default HISTORY_ROOT). Needs pyarrow"""
+    from feed_stats_history import feedStatsHistory
+    if history_root is None: history_root = HISTORY_ROOT
+    if feed_records is None: feed_records = get_stats_writer().records
+    num_rows = feedStatsHistory(history_root).append(feed_records)
+    if LOGGING: print("Saved {} feeds to history {}".format(num_rows, history_root))
+    return num_rows
+
+class etlListingCache:
+    """Local index of ETL directories that have already been summarised, keyed by path.
+    A cached summary is only reused while the directory's modificationTime is unchanged, so
+    historical etldate= partitions are listed once and new ones, or ones with files added,
+    removed or renamed, are listed again. A file overwritten in place does not change its
+    directory's modificationTime, so that change is missed until the entry is evicted or the
+    cache file deleted.
+    Entries are kept in least-recently-used order and the oldest are evicted past max_entries"""
+    def __init__(self, cache_path=ETL_CACHE_PATH, max_entries=ETL_CACHE_MAX_ENTRIES):
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    def load(self):
+        if not os.path.exists(self.cache_path): return
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                for path, modification_time, summary in json.load(cache_file):
+                    self.entries[path] = (modification_time, summary)
+        except:
+            print("Could not read ETL listing cache {}, starting empty".format(self.cache_path))
+            self.entries = OrderedDict()
+    def save(self):
+        with self.lock:
+            rows = [[path, entry[0], entry[1]] for path, entry in self.entries.items()]
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'w') as cache_file:
+            json.dump(rows, cache_file)
+        os.replace(temp_path, self.cache_path)
+        if LOGGING: print("ETL listing cache: {} entries, {} hits, {} misses".format(len(rows), self.hits, self.misses))
+    def get(self, path, modification_time):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != modification_time:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+    def put(self, path, modification_time, summary):
+        with self.lock:
+            self.entries[path] = (modification_time, summary)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+etl_listing_cache = None
+
+def get_etl_cache():
+    "Returns the loaded module ETL listing cache, or None when caching is switched off"
+    global etl_listing_cache
+    if not USE_ETL_CACHE: return None
+    if etl_listing_cache is None:
+        etl_listing_cache = etlListingCache(ETL_CACHE_PATH, ETL_CACHE_MAX_ENTRIES)
+        etl_listing_cache.load()
+    return etl_listing_cache
+
+class feedAnomalyDetector:
+    """Keeps an exponentially weighted mean and variance of each feed's ANOMALY_METRICS and of how
+    often a new ETL partition arrives, persisted as JSON so each run costs O(feeds) without
+    rereading old stats documents. observe() returns the anomalies for a feed record:
+    'SizeDeviation' when a metric is more than ANOMALY_Z_THRESHOLD standard deviations from its
+    mean, and 'MissingPartition' when a feed that normally gets a new ETL every run did not.
+    A feed's observation is only folded into its baseline on the next ProcessDate, so rerunning
+    a day compares against the same baseline instead of counting the day twice.
+    This is the online check whose flags go into each run's stats document. Looking back at
+    other days is left to feedStatsHistory.anomalies in feed_stats_history, which recomputes a
+    median/MAD baseline from the saved history for any date and metric"""
+    def __init__(self, state_path=ANOMALY_STATE_PATH, alpha=ANOMALY_EWMA_ALPHA):
+        self.state_path = state_path
+        self.alpha = alpha
+        self.feeds = {}
+        self.lock = threading.Lock()
+    def load(self):
+        if not os.path.exists(self.state_path): return
+        try:
+            with open(self.state_path, 'r') as state_file:
+                self.feeds = json.load(state_file)
+        except:
+            print("Could not read feed anomaly state {}, starting empty".format(self.state_path))
+            self.feeds = {}
+    def save(self):
+        with self.lock:
+            state = json.dumps(self.feeds, default=json_default)
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            state_file.write(state)
+        os.replace(temp_path, self.state_path)
+    def new_baseline(self):
+        return {'Runs': 0, 'Metrics': {}, 'ArrivalRate': None, 'LastUpdated': None}
+    def fold(self, baseline, observation):
+        "EWMA update of baseline with one day's observation"
+        baseline['Runs'] += 1
+        for metric, value in observation['Metrics'].items():
+            if value is None: continue
+            if metric not in baseline['Metrics']:
+                baseline['Metrics'][metric] = [value, 0.0]
+                continue
+            mean, variance = baseline['Metrics'][metric]
+            difference = value - mean
+            increment = self.alpha*difference
+            baseline['Metrics'][metric] = [mean + increment, (1 - self.alpha)*(variance + difference*increment)]
+        if observation['NewPartition'] is not None:
+            arrived = 1.0 if observation['NewPartition'] else 0.0
+            if baseline['ArrivalRate'] is None: baseline['ArrivalRate'] = arrived
+            else: baseline['ArrivalRate'] += self.alpha*(arrived - baseline['ArrivalRate'])
+        baseline['LastUpdated'] = observation['LastUpdated']
+    def observe(self, feed_stats_dict):
+        summary = feed_stats_dict['SummaryStatistics']
+        feed_key = feed_stats_dict['SourceName'] + '/' + feed_stats_dict['FeedName']
+        metrics = {}
+        for metric in ANOMALY_METRICS:
+            value = summary.get(metric)
+            metrics[metric] = None if value is None or np.isnan(value) else float(value)
+        with self.lock:
+            entry = self.feeds.get(feed_key)
+            if entry is None:
+                entry = {'Baseline': self.new_baseline(), 'ObservedDate': None, 'Observation': None}
+                self.feeds[feed_key] = entry
+            if entry['Observation'] is not None and entry['ObservedDate'] != summary['ProcessDate']:
+                self.fold(entry['Baseline'], entry['Observation'])
+            baseline = entry['Baseline']
+            new_partition = None
+            if baseline['LastUpdated'] is not None:
+                new_partition = summary['LastUpdated'] != baseline['LastUpdated']
+            entry['ObservedDate'] = summary['ProcessDate']
+            entry['Observation'] = {'Metrics': metrics, 'LastUpdated': summary['LastUpdated'], 'NewPartition': new_partition}
+            return self.compare(baseline, metrics, new_partition, summary['LastUpdated'])
+    def compare(self, baseline, metrics, new_partition, last_updated):
+        anomalies = []
+        if baseline['Runs'] < ANOMALY_MIN_RUNS: return anomalies
+        for metric, value in metrics.items():
+            if value is None or metric not in baseline['Metrics']: continue
+            mean, variance = baseline['Metrics'][metric]
+            std_dev = max(math.sqrt(variance), ANOMALY_MIN_RELATIVE_STD*abs(mean))
+            if std_dev == 0: continue
+            z_score = (value - mean)/std_dev
+            if abs(z_score) > ANOMALY_Z_THRESHOLD:
+                anomalies.append({'Type': 'SizeDeviation', 'Metric': metric, 'Value': value,
+                                  'BaselineMean': mean, 'BaselineStdDev': std_dev, 'ZScore': z_score})
+        if new_partition is False and baseline['ArrivalRate'] is not None and baseline['ArrivalRate'] >= ANOMALY_EXPECTED_ARRIVAL_RATE:
+            anomalies.append({'Type': 'MissingPartition', 'LastUpdated': last_updated,
+                              'ArrivalRate': baseline['ArrivalRate']})
+        return anomalies
+    def missing_feeds(self, attempted_feeds):
+        """Feeds crawled this run that have a baseline but were not observed on current_date,
+        i.e. whose directory was empty, timed out or failed"""
+        missing = []
+        with self.lock:
+            for feed_path in attempted_feeds:
+                entry = self.feeds.get(get_feed_source(feed_path) + '/' + get_path_suffix(feed_path))
+                if entry is not None and entry['ObservedDate'] != current_date:
+                    missing.append({'SourceName': get_feed_source(feed_path), 'FeedName': get_path_suffix(feed_path),
+                                    'LastObserved': entry['ObservedDate']})
+        return missing
+
+anomaly_detector = None
+
+def get_anomaly_detector():
+    "Returns the loaded module feed anomaly detector, or None when detection is switched off"
+    global anomaly_detector
+    if not DETECT_ANOMALIES: return None
+    if anomaly_detector is None:
+        anomaly_detector = feedAnomalyDetector(ANOMALY_STATE_PATH, ANOMALY_EWMA_ALPHA)
+        anomaly_detector.load()
+    return anomaly_detector
+
+class runCheckpoint:
+    """Durable record of the feeds finished in today's run, so a run restarted after a crash does
+    not crawl them again. Each finished feed is appended to an NDJSON file as
+    {"FeedPath": ..., "Record": feed summary dict or null} and fsynced before the next one; a
+    line torn by the crash is ignored on load. The file is named for current_date, so a new day
+    starts a new checkpoint, and is removed once the stats document is complete"""
+    def __init__(self, checkpoint_path=CHECKPOINT_PATH):
+        self.checkpoint_path = checkpoint_path
+        self.completed = OrderedDict()
+        self.lock = threading.Lock()
+        self.checkpoint_file = None
+    def load(self):
+        self.completed = OrderedDict()
+        if not os.path.exists(self.checkpoint_path): return
+        with open(self.checkpoint_path, 'r') as checkpoint_file:
+            for line in checkpoint_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                self.completed[entry['FeedPath']] = entry['Record']
+        print("Resuming from checkpoint {}: {} feeds already done".format(self.checkpoint_path, len(self.completed)))
+    def record(self, feed_path, feed_info_dict):
+        line = json.dumps({'FeedPath': feed_path, 'Record': feed_info_dict}, default=json_default) + '\n'
+        with self.lock:
+            if self.checkpoint_file is None:
+                self.checkpoint_file = open(self.checkpoint_path, 'a')
+                # a torn last line from the crash would otherwise swallow the first new entry
+                self.checkpoint_file.write('\n')
+            self.checkpoint_file.write(line)
+            self.checkpoint_file.flush()
+            os.fsync(self.checkpoint_file.fileno())
+            self.completed[feed_path] = feed_info_dict
+    def finish(self):
+        "Closes and removes the checkpoint once the stats document has been closed"
+        with self.lock:
+            if self.checkpoint_file is not None:
+                self.checkpoint_file.close()
+                self.checkpoint_file = None
+            if os.path.exists(self.checkpoint_path): os.remove(self.checkpoint_path)
+            self.completed = OrderedDict()
+
+def get_checkpoint():
+    "Returns today's run checkpoint, loaded from disk, or None when checkpointing is switched off"
+    if not USE_CHECKPOINT: return None
+    checkpoint = runCheckpoint(CHECKPOINT_PATH)
+    checkpoint.load()
+    return checkpoint
+
+def open_stats_with_checkpoint(checkpoint):
+    """Starts the stats document and writes the feed records already in the checkpoint into it.
+    Returns the set of feed paths the run can skip"""
+    open_stats_blob_json()
+    if checkpoint is None: return set()
+    for feed_path, feed_info_dict in checkpoint.completed.items():
+        if feed_info_dict is not None:
+            output_stats_to_json_blob(feed_info_dict)
+    return set(checkpoint.completed.keys())
+
+def close_stats_with_checkpoint(checkpoint, attempted_feeds):
+    done_feeds = list(attempted_feeds)
+    if checkpoint is not None:
+        done_feeds = list(checkpoint.completed.keys()) + [feed_path for feed_path in done_feeds if feed_path not in checkpoint.completed]
+    close_stats_blob_json(done_feeds)
+    if checkpoint is not None: checkpoint.finish()
 
 def get_path_suffix(path):
     path_parts = path.split('/')
@@ -154,28 +1123,88 @@ def get_feed_source(path):
     last = path_parts[-2]
     return last
 
-def process_feed_list_threaded(all_vdc_feeds):
-    if len(all_vdc_feeds) == 0: return
-    open_stats_blob_json()
-    num_threads = 0
+def process_feed_list_threaded(all_vdc_feeds, num_threads=None, adl=None):
+    """Crawls the feeds with a fixed pool of worker threads fed from a bounded queue.
+    The queue blocks the producer once FEED_QUEUE_SIZE feeds are waiting, so the number of
+    feeds in flight never exceeds the pool size. all_vdc_feeds can be any iterable, e.g.
+    iter_feed_list_from_config(), and is consumed as the workers free up.
+    Finished feeds are checkpointed, so a restarted run skips them (see runCheckpoint), and
+    feeds that failed are queued again up to FAILED_FEED_RETRY_PASSES times at the end.
+    num_threads defaults to NUM_CRAWLER_THREADS. Returns a dict of feed path -> wall time in seconds"""
+    if num_threads is None: num_threads = NUM_CRAWLER_THREADS
+    feed_iter = iter(all_vdc_feeds)
+    first_feed = next(feed_iter, None)
+    if first_feed is None: return {}
+    if adl is None: adl = get_filesystem()
+    reset_ls_rate_limiter()
+    caller = new_adls_caller(num_threads)
+    etl_cache = get_etl_cache()
+    checkpoint = get_checkpoint()
+    completed_feeds = open_stats_with_checkpoint(checkpoint)
+    feed_queue = queue.Queue(maxsize=FEED_QUEUE_SIZE)
+    feed_timings = {}
+    timings_lock = threading.Lock()
     threads = []
-    for element in all_vdc_feeds:
-        newThread = threadedCrawler(num_threads,element,num_threads)
+    for thread_num in range(num_threads):
+        newThread = threadedCrawler(thread_num, feed_queue, feed_timings, timings_lock, adl, etl_cache, checkpoint, caller)
         newThread.start()
         threads.append(newThread)
-        num_threads = num_threads+1
-    for t in threads:
-        t.join()
-    close_stats_blob_json()
-    return
+    try:
+        for element in itertools.chain([first_feed], feed_iter):
+            if element in completed_feeds: continue
+            feed_queue.put(element)
+        for retry_pass in range(FAILED_FEED_RETRY_PASSES):
+            feed_queue.join()
+            failed_feeds = feed_failure_log.failed_feeds()
+            if len(failed_feeds) == 0: break
+            print("Retrying {} failed feeds".format(len(failed_feeds)))
+            for element in failed_feeds:
+                feed_queue.put(element)
+    finally:
+        # also reached when reading the feed list fails part way, so the workers finish the
+        # queued feeds and exit instead of blocking on the queue forever
+        for t in threads:
+            feed_queue.put(None)
+        for t in threads:
+            t.join()
+    close_stats_with_checkpoint(checkpoint, feed_timings.keys())
+    if etl_cache is not None: etl_cache.save()
+    report_feed_timings(feed_timings)
+    return feed_timings
 
-def process_feed_list(all_vdc_feeds):
-    if len(all_vdc_feeds) == 0: return
-    open_stats_blob_json()
+def report_feed_timings(feed_timings):
+    if len(feed_timings) == 0: return
+    total_seconds = sum(feed_timings.values())
+    print("Processed {} feeds, {:.1f} feed-seconds total, {:.2f}s average".format(
+        len(feed_timings), total_seconds, total_seconds/len(feed_timings)))
+    slowest = sorted(feed_timings.items(), key=lambda k: k[1], reverse=True)[:NUM_SLOWEST_FEEDS_REPORTED]
+    for feed_path, seconds in slowest:
+        print("  {:.2f}s {}".format(seconds, feed_path))
+
+def process_feed_list(all_vdc_feeds, adl=None):
+    "Crawls the feeds one after another. Returns a dict of feed path -> wall time in seconds"
+    all_vdc_feeds = list(all_vdc_feeds)
+    if len(all_vdc_feeds) == 0: return {}
+    if adl is None: adl = get_filesystem()
+    reset_ls_rate_limiter()
+    caller = new_adls_caller(1)
+    etl_cache = get_etl_cache()
+    checkpoint = get_checkpoint()
+    completed_feeds = open_stats_with_checkpoint(checkpoint)
+    feed_timings = {}
     for element in all_vdc_feeds:
-            process_feeds_agg(element)
-    close_stats_blob_json()
-    return    
+            if element in completed_feeds: continue
+            start_time = time.time()
+            process_feeds_agg(element, adl=adl, etl_cache=etl_cache, checkpoint=checkpoint, caller=caller)
+            feed_timings[element] = time.time() - start_time
+    for retry_pass in range(FAILED_FEED_RETRY_PASSES):
+        for element in feed_failure_log.failed_feeds():
+            start_time = time.time()
+            process_feeds_agg(element, adl=adl, etl_cache=etl_cache, checkpoint=checkpoint, caller=caller)
+            feed_timings[element] += time.time() - start_time
+    close_stats_with_checkpoint(checkpoint, feed_timings.keys())
+    if etl_cache is not None: etl_cache.save()
+    return feed_timings
       
 def copy_latest_to_sampled_df(full_df, sampled_df):
     """This method tries to ensure that ETLs from the last 24 hours are present in the sampled DF
@@ -197,14 +1226,9 @@ def copy_latest_to_sampled_df(full_df, sampled_df):
     if(num_latest_full == 0 or num_latest_sampled > 0):
         return sampled_df
     else:
-        sampled_df = sampled_df.append(filtered_full_df)
+        sampled_df = pd.concat([sampled_df, filtered_full_df])
         return sampled_df
         
-def get_total_bytes_latest_etl(df):
-    """Todo: Add some windowing """
-    df.sort_values(by='ETL', ascending=False, inplace=True)
-    return df.iloc[0]['FileSize']
-
 def get_total_bytes_today_etl(df):
     """Todo: Add some windowing """   
     if len(df[df['ETL'].str.contains(date.today().isoformat())]) == 0:
@@ -213,116 +1237,643 @@ def get_total_bytes_today_etl(df):
         today_df = df[df['ETL'].str.contains(date.today().isoformat())]
         return today_df.iloc[0]['FileSize']
     
-def get_total_bytes_24hrs(df):
-    current_time_ms = time.time()*1000
-    minus_24hrs_ms = (time.time()*1000)-86400000
-    cond1 = df.ModificationTime < current_time_ms
-    cond2 = df.ModificationTime > minus_24hrs_ms
-    window_df = df[np.logical_and(cond1,cond2)]
-    if len(window_df) == 0:
-        return 0
-    else:
-        return window_df.iloc[0]['FileSize']
-    
-def process_feeds_agg(path):
-    if LOGGING: print("Process Feed {}".format(path))
+def process_feeds_agg(path, deadline=None, adl=None, etl_cache=None, checkpoint=None, caller=None):
+    """Computes the summary statistics for one feed and writes them to the stats document.
+    A failure or timeout is recorded in feed_failure_log; otherwise the feed is added to checkpoint"""
+    current_element_name = get_path_suffix(path)
     try:
-        current_element_name = get_path_suffix(path)
-        sub_elements_df = get_adls_file_dataframe(path)
-        #If this directory is empty -- just return
-        if len(sub_elements_df) == 0: return
-        # Get subdirectories for this one
-        # Because we are in the feed directory, this gives a list of ETLs
-        sampled_elements_df = sub_elements_df.sample(frac=SAMPLE_PERC)
-        sampled_elements_df = copy_latest_to_sampled_df(sub_elements_df,sampled_elements_df)
-        feed_file_stats_df = pd.DataFrame(columns=['ETL','FileSize','SourceName','FeedName','ModificationTime'])
-        for element in sampled_elements_df['name']:
-        #for element in sub_elements_df['name']:
-            element_df = sub_elements_df[sub_elements_df['name'] == element]
-            element_type = element_df['type'].values[0]
-            #Ensure that a subelement to the feed directory is a directory type
-            if element_type == 'DIRECTORY':
-                etl_stats_dict = process_etls_agg(element)
-                if len(etl_stats_dict) > 0:
-                    feed_file_stats_df.loc[len(feed_file_stats_df)] = etl_stats_dict
-        df_length = len(feed_file_stats_df)
-        if df_length > 0:
-            if LOGGING:
-                print("*** Feed Stats *** Length: {}".format(df_length))
-                print(feed_file_stats_df)
-            feed_info_dict  = {'FeedName':current_element_name,
-                               'SourceName': get_feed_source(path),
-                               'SummaryStatistics':{
-                                    'TotalETLsProcessed':len(feed_file_stats_df['FileSize']),
-                                    'AvgETLBytes':feed_file_stats_df['FileSize'].mean(),
-                                    'AvgETLMB':feed_file_stats_df['FileSize'].mean()/1000000,
-                                    'StdDevETLMB':feed_file_stats_df['FileSize'].std()/1000000,
-                                    'MaxETLMB':feed_file_stats_df['FileSize'].max()/1000000,
-                                    'MinETLMB':feed_file_stats_df['FileSize'].min()/1000000,
-                                    'LastUpdated': feed_file_stats_df['ETL'].max(),
-                                    'LatestETLMB': get_total_bytes_latest_etl(feed_file_stats_df)/1000000,
-                                    'Last24HrsETLMB': get_total_bytes_24hrs(feed_file_stats_df)/1000000,
-                                    'ProcessDate': current_date
-                                }
-                              }
-            if LOGGING:
-                print('Finished Creating Dict in Feed')
-                print(json.dumps(feed_info_dict))
+        with feed_context(path), run_metrics.timer('process_feeds_agg'):
+            feed_info_dict = compute_feed_stats(path, deadline, adl, etl_cache, caller)
+        if feed_info_dict is not None:
             output_stats_to_json_blob(feed_info_dict)
-    except:
+            run_metrics.increment('feeds_reported')
+        if feed_info_dict is None and deadline is not None and time.time() > deadline:
+            feed_failure_log.record(path, "Timed out after {}s".format(FEED_TIMEOUT_SECONDS))
+            return
+        feed_failure_log.clear(path)
+        if checkpoint is not None: checkpoint.record(path, feed_info_dict)
+    except Exception as e:
+        feed_failure_log.record(path, describe_failure(e))
+        run_metrics.increment('feed_errors')
         print("Unexpected error processing Feed: {} Error: {}".format(current_element_name,sys.exc_info()[0]))
         print(traceback.format_exc())
     return
 
-def process_etls_agg(path):
+def compute_feed_stats(path, deadline=None, adl=None, etl_cache=None, caller=None):
+    """Returns the feed summary dict for a feed directory, or None if it has no ETLs to report.
+    deadline is an optional time.time() value - once passed, no further ETLs are listed
+    and the feed is dropped from this run; listing retries that would wait past it give up.
+    adl defaults to the configured filesystem and caller, which retries the listings, to a
+    new_adls_caller(). With an etl_cache, sampled ETL directories summarised on an earlier run
+    are taken from it instead of being listed again"""
+    if LOGGING: print("Process Feed {}".format(path))
+    if adl is None: adl = get_filesystem()
+    if caller is None: caller = new_adls_caller()
+    sub_elements_df = get_adls_file_dataframe(path, adl, caller, deadline)
+    #If this directory is empty -- just return
+    if len(sub_elements_df) == 0: return None
+    sampled_etls, num_etls_in_feed = select_etl_directories(sub_elements_df, etl_cache)
+    feed_stats = feedStatsAccumulator()
+    for element, modification_time, etl_stats_dict in sampled_etls:
+        if etl_sample_is_sufficient(feed_stats, num_etls_in_feed): break
+        if etl_stats_dict is None:
+            if deadline is not None and time.time() > deadline:
+                print("Timed out processing Feed: {} after {}s".format(get_path_suffix(path),FEED_TIMEOUT_SECONDS))
+                run_metrics.increment('feed_timeouts')
+                return None
+            etl_stats_dict = process_etls_agg(element, adl, caller, deadline)
+            if len(etl_stats_dict) > 0 and etl_cache is not None: etl_cache.put(element, modification_time, to_json_safe(etl_stats_dict))
+        if len(etl_stats_dict) > 0: feed_stats.add(etl_stats_dict)
+    return build_feed_info_dict(path, feed_stats, num_etls_in_feed)
+
+def select_etl_directories(sub_elements_df, etl_cache=None):
+    """Picks the ETL directories to summarise from a feed listing. In 'fraction' SAMPLING_MODE this
+    is a SAMPLE_PERC sample plus the ETLs of the last 24 hours; in 'stratified' mode it is the
+    first ETL_LISTING_BUDGET ETLs of the order_etls_stratified order. The cache only saves
+    listings within that sample, so what is summarised does not depend on what earlier runs
+    cached. Returns the sample in order as (path, modificationTime, cached summary or None)
+    and the number of ETLs in the feed"""
+    #Ensure that a subelement to the feed directory is a directory type
+    is_etl_dir = sub_elements_df['type'] == 'DIRECTORY'
+    num_etls_in_feed = int(is_etl_dir.sum())
+    if SAMPLING_MODE == 'stratified':
+        sampled_elements_df = order_etls_stratified(sub_elements_df[is_etl_dir]).iloc[:ETL_LISTING_BUDGET]
+    else:
+        # Because we are in the feed directory, this gives a list of ETLs
+        sampled_elements_df = sub_elements_df.sample(frac=SAMPLE_PERC)
+        sampled_elements_df = copy_latest_to_sampled_df(sub_elements_df,sampled_elements_df)
+    sampled_etls = []
+    sampled_dirs_df = sampled_elements_df[sampled_elements_df['type'] == 'DIRECTORY']
+    for element, modification_time in zip(sampled_dirs_df['name'].values, sampled_dirs_df['modificationTime'].values):
+        cached_stats_dict = etl_cache.get(element, int(modification_time)) if etl_cache is not None else None
+        sampled_etls.append((element, int(modification_time), cached_stats_dict))
+    return sampled_etls, num_etls_in_feed
+
+def order_etls_stratified(etl_dirs_df):
+    """Orders a feed's ETL directories for sequential sampling: the ETLs of the last 24 hours first
+    (they are always reported), then round-robin over SAMPLING_STRATA equal-sized modificationTime
+    strata, in random order within each stratum. Any prefix of the order is therefore spread
+    evenly over the feed's history, which lets sampling stop early without a time bias"""
+    minus_24hrs_ms = (time.time()*1000)-86400000
+    is_latest = etl_dirs_df['modificationTime'].values > minus_24hrs_ms
+    history_df = etl_dirs_df[~is_latest].sort_values(by='modificationTime')
+    if len(history_df) == 0: return etl_dirs_df[is_latest]
+    strata = [np.random.permutation(stratum) for stratum in np.array_split(np.arange(len(history_df)), min(SAMPLING_STRATA, len(history_df)))]
+    history_order = [stratum[position] for position in range(len(strata[0])) for stratum in strata if position < len(stratum)]
+    return pd.concat([etl_dirs_df[is_latest], history_df.iloc[history_order]])
+
+class feedStatsAccumulator:
+    """One-pass summary of a feed's ETL sizes, fed ETL summaries as they arrive instead of keeping
+    them in a DataFrame: count, Welford running mean and sum of squared deviations, min/max, the
+    newest ETL and its size, and the total size of ETLs modified in the 24 hours before it was
+    created. merge() folds in another accumulator (Chan et al. pairwise update), so partial
+    results from threads or executors can be combined without the underlying rows"""
+    def __init__(self, now_ms=None):
+        if now_ms is None: now_ms = time.time()*1000
+        self.window_end_ms = now_ms
+        self.window_start_ms = now_ms - 86400000
+        self.count = 0
+        self.mean = 0.0
+        self.sum_squared_deviations = 0.0
+        self.min_size = None
+        self.max_size = None
+        self.latest_etl = None
+        self.latest_etl_size = 0.0
+        self.last_24hrs_size = 0.0
+    def add(self, etl_stats_dict):
+        size = float(etl_stats_dict['FileSize'])
+        self.count += 1
+        delta = size - self.mean
+        self.mean += delta/self.count
+        self.sum_squared_deviations += delta*(size - self.mean)
+        if self.min_size is None or size < self.min_size: self.min_size = size
+        if self.max_size is None or size > self.max_size: self.max_size = size
+        etl_stamp = etl_stats_dict['ETL']
+        if self.latest_etl is None or etl_stamp > self.latest_etl:
+            self.latest_etl = etl_stamp
+            self.latest_etl_size = size
+        modification_time = etl_stats_dict['ModificationTime']
+        if modification_time is not None and self.window_start_ms < modification_time < self.window_end_ms:
+            self.last_24hrs_size += size
+    def merge(self, other):
+        if other.count == 0: return self
+        if self.count == 0:
+            self.__dict__.update(other.__dict__)
+            return self
+        total_count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta*other.count/total_count
+        self.sum_squared_deviations += other.sum_squared_deviations + delta*delta*self.count*other.count/total_count
+        self.count = total_count
+        self.min_size = min(self.min_size, other.min_size)
+        self.max_size = max(self.max_size, other.max_size)
+        if other.latest_etl > self.latest_etl:
+            self.latest_etl = other.latest_etl
+            self.latest_etl_size = other.latest_etl_size
+        self.last_24hrs_size += other.last_24hrs_size
+        return self
+    def std(self):
+        "Sample standard deviation, NaN below 2 ETLs (as pandas .std())"
+        if self.count < 2: return float('nan')
+        return math.sqrt(self.sum_squared_deviations/(self.count - 1))
+    def mean_confidence_interval(self, population_size=None):
+        """Normal-approximation confidence interval (CI_Z_SCORE) for the mean ETL size, with the
+        finite population correction when the feed's ETL count is known. NaN below 2 ETLs"""
+        if self.count < 2: return (float('nan'), float('nan'))
+        standard_error = self.std()/math.sqrt(self.count)
+        if population_size is not None and population_size > 1 and self.count <= population_size:
+            standard_error *= math.sqrt((population_size - self.count)/(population_size - 1))
+        return (self.mean - CI_Z_SCORE*standard_error, self.mean + CI_Z_SCORE*standard_error)
+    def to_summary_dict(self, num_etls_in_feed=None):
+        "The SummaryStatistics of the feed; StdDevETLMB and the CI bounds are None below 2 ETLs"
+        ci_lower, ci_upper = self.mean_confidence_interval(num_etls_in_feed)
+        return {'TotalETLsProcessed':self.count,
+                'AvgETLBytes':self.mean,
+                'AvgETLMB':self.mean/1000000,
+                'AvgETLMBLower':finite_or_none(ci_lower/1000000),
+                'AvgETLMBUpper':finite_or_none(ci_upper/1000000),
+                'ETLsInFeed':num_etls_in_feed,
+                'SamplingMode':SAMPLING_MODE,
+                'StdDevETLMB':finite_or_none(self.std()/1000000),
+                'MaxETLMB':self.max_size/1000000,
+                'MinETLMB':self.min_size/1000000,
+                'LastUpdated': self.latest_etl,
+                'LatestETLMB': self.latest_etl_size/1000000,
+                'Last24HrsETLMB': self.last_24hrs_size/1000000,
+                'ProcessDate': current_date
+               }
+
+def etl_sample_is_sufficient(feed_stats, num_etls_in_feed):
+    """In 'stratified' SAMPLING_MODE, True once MIN_ETL_SAMPLES ETLs are summarised and the
+    confidence interval on the mean ETL size is within CI_RELATIVE_HALF_WIDTH of the mean"""
+    if SAMPLING_MODE != 'stratified' or feed_stats.count < MIN_ETL_SAMPLES: return False
+    lower, upper = feed_stats.mean_confidence_interval(num_etls_in_feed)
+    return feed_stats.mean > 0 and (upper - lower)/2 <= CI_RELATIVE_HALF_WIDTH*feed_stats.mean
+
+def build_feed_info_dict(path, feed_stats, num_etls_in_feed=None):
+    """Builds the feed summary dict from its feedStatsAccumulator, or returns None if no ETLs were
+    added. AvgETLMBLower/AvgETLMBUpper bound the feed's true mean ETL size given the sample"""
+    if feed_stats.count == 0: return None
+    feed_info_dict  = {'FeedName':get_path_suffix(path),
+                       'SourceName': get_feed_source(path),
+                       'SummaryStatistics':feed_stats.to_summary_dict(num_etls_in_feed)
+                      }
+    if LOGGING:
+        print('Finished Creating Dict in Feed')
+        print(json.dumps(feed_info_dict, default=json_default))
+    return feed_info_dict
+
+def to_json_safe(stats_dict):
+    "Converts numpy scalars in a summary dict to plain python values so it can be persisted"
+    return {key: value.item() if isinstance(value, np.generic) else value for key, value in stats_dict.items()}
+
+def process_etls_agg(path, adl=None, caller=None, deadline=None):
+    """Summarises the files of one ETL directory in a single vectorized pass over the listing:
+    total size and latest modification time of the files larger than 200 bytes"""
     if LOGGING: print("Process ETL {}".format(path))
-    current_element_name = get_path_suffix(path)
-    sub_elements_df = get_adls_file_dataframe(path)
-    etl_stats_df = pd.DataFrame(columns=['ETL','FileSize','FileName','SourceName','FeedName','ModificationTime'])
-    if len(sub_elements_df) == 0: return etl_stats_df
+    with run_metrics.timer('process_etls_agg'):
+        return summarise_etl_listing(path, get_adls_file_dataframe(path, adl, caller, deadline))
+
+def summarise_etl_listing(path, sub_elements_df):
+    "Summarises an ETL directory listing (as returned by ls with detail=True) into an ETL stats dict"
+    with run_metrics.timer('summarise_etl_listing'):
+        return summarise_etl_listing_df(path, sub_elements_df)
+
+def summarise_etl_listing_df(path, sub_elements_df):
+    if len(sub_elements_df) == 0: return pd.DataFrame(columns=['ETL','FileSize','FileName','SourceName','FeedName','ModificationTime'])
     etl_stamp, feed_name, source_name = parse_adls_path(path,'etl')
-    for element in sub_elements_df['name']:
-        if LOGGING: print("Process File {}".format(element))
-        file_name = get_path_suffix(element)
-        element_df = sub_elements_df[sub_elements_df['name'] == element]
-        element_type = element_df['type'].values[0]
-        element_size = element_df['length'].values[0]
-        if element_type == 'FILE' and element_size>200:         
-            if LOGGING: print("Source: {}, Feed: {}, ETL: {}, File: {}".format(source_name,feed_name,etl_stamp,file_name))
-            file_info_dict  = {'ETL':etl_stamp,
-                               'FileSize':element_size,
-                               'FileName':file_name,
-                               'SourceName':source_name,
-                               'FeedName':feed_name,
-                               'ModificationTime':element_df['modificationTime'].values[0]
-                              }
-            etl_stats_df.loc[len(etl_stats_df)] = file_info_dict
-            if LOGGING: print('Finished ETL Parsing') 
-    etl_summ_dict = {'ETL':etl_stamp,'FileSize':etl_stats_df['FileSize'].sum(),'SourceName':source_name,'FeedName':feed_name,'ModificationTime':etl_stats_df['ModificationTime'].max()}
-    #etl_summ_df = pd.DataFrame.from_dict(etl_summ_dict)
+    file_sizes = sub_elements_df['length'].values
+    is_data_file = (sub_elements_df['type'].values == 'FILE') & (file_sizes > 200)
+    data_file_mod_times = sub_elements_df['modificationTime'].values[is_data_file]
+    if LOGGING: print("Source: {}, Feed: {}, ETL: {}, Files: {}".format(source_name,feed_name,etl_stamp,is_data_file.sum()))
+    etl_summ_dict = {'ETL':etl_stamp,
+                     'FileSize':file_sizes[is_data_file].sum(),
+                     'SourceName':source_name,
+                     'FeedName':feed_name,
+                     'ModificationTime':data_file_mod_times.max() if len(data_file_mod_times) > 0 else np.nan}
     return etl_summ_dict
 
 class threadedCrawler(threading.Thread):
-    def __init__(self, threadID, name, counter):
+    """Worker that takes feed paths off the shared queue until it receives None"""
+    def __init__(self, threadID, feed_queue, feed_timings, timings_lock, adl, etl_cache=None, checkpoint=None, caller=None):
       threading.Thread.__init__(self)
       self.threadID = threadID
-      self.name = name
-      self.counter = counter
+      self.name = "crawler-{}".format(threadID)
+      self.feed_queue = feed_queue
+      self.feed_timings = feed_timings
+      self.timings_lock = timings_lock
+      self.adl = adl
+      self.etl_cache = etl_cache
+      self.checkpoint = checkpoint
+      self.caller = caller
     def run(self):
       if LOGGING: print("Starting " + self.name)
-      process_feeds_agg(self.name)
+      while True:
+        feed_path = self.feed_queue.get()
+        if feed_path is None:
+          self.feed_queue.task_done()
+          break
+        start_time = time.time()
+        process_feeds_agg(feed_path, deadline=start_time+FEED_TIMEOUT_SECONDS, adl=self.adl, etl_cache=self.etl_cache, checkpoint=self.checkpoint, caller=self.caller)
+        elapsed = time.time() - start_time
+        with self.timings_lock:
+          self.feed_timings[feed_path] = self.feed_timings.get(feed_path, 0) + elapsed
+        self.feed_queue.task_done()
+        if LOGGING: print("{} finished {} in {:.2f}s".format(self.name, feed_path, elapsed))
       if LOGGING: print("Exiting " + self.name)
-            
-import time
+
+def get_spark_session():
+    "Returns the running Spark session (or starts one); only the Spark execution mode needs it"
+    from pyspark.sql import SparkSession
+    return SparkSession.builder.getOrCreate()
+
+def get_summary_statistics_schema():
+    "Spark schema matching the feed dicts produced by compute_feed_stats"
+    from pyspark.sql.types import StructType, StructField, StringType, LongType, DoubleType
+    summary_fields = [StructField("TotalETLsProcessed", LongType(), True),
+                      StructField("AvgETLBytes", DoubleType(), True),
+                      StructField("AvgETLMB", DoubleType(), True),
+                      StructField("AvgETLMBLower", DoubleType(), True),
+                      StructField("AvgETLMBUpper", DoubleType(), True),
+                      StructField("ETLsInFeed", LongType(), True),
+                      StructField("SamplingMode", StringType(), True),
+                      StructField("StdDevETLMB", DoubleType(), True),
+                      StructField("MaxETLMB", DoubleType(), True),
+                      StructField("MinETLMB", DoubleType(), True),
+                      StructField("LastUpdated", StringType(), True),
+                      StructField("LatestETLMB", DoubleType(), True),
+                      StructField("Last24HrsETLMB", DoubleType(), True),
+                      StructField("ProcessDate", StringType(), True),
+                     ]
+    fields = [StructField("SourceName", StringType(), True),
+              StructField("FeedName", StringType(), True),
+              StructField("SummaryStatistics", StructType(summary_fields), True),
+             ]
+    return StructType(fields)
+
+def feed_stats_to_spark_dataframe(feed_stats, spark_session=None):
+    "Builds a Spark DataFrame with the SummaryStatistics schema from a list of feed dicts"
+    if spark_session is None: spark_session = get_spark_session()
+    schema = get_summary_statistics_schema()
+    summary_fields = schema["SummaryStatistics"].dataType.fieldNames()
+    rows = []
+    for feed_info_dict in feed_stats:
+        summary = to_json_safe(feed_info_dict['SummaryStatistics'])
+        rows.append((feed_info_dict['SourceName'], feed_info_dict['FeedName'],
+                     tuple(summary.get(field) for field in summary_fields)))
+    return spark_session.createDataFrame(rows, schema)
+
+def list_feed_partition(feed_paths, adl_factory=None):
+    """First mapPartitions stage of the Spark mode, run on the executors: lists every feed in the
+    partition with one executor-local client and picks its ETL sample. Yields
+    {'FeedPath', 'ETLsInFeed', 'ETLPaths'} for each feed with ETLs, and a
+    {'FailedFeed': feed path, 'Reason': ...} record for each feed that failed. The driver's ETL
+    listing cache is not shared with the executors, and in 'stratified' SAMPLING_MODE the whole
+    ETL_LISTING_BUDGET is listed, as the sample is summarised in parallel"""
+    adl = adl_factory() if adl_factory is not None else get_filesystem()
+    reset_ls_rate_limiter()
+    caller = new_adls_caller(1)
+    for feed_path in feed_paths:
+        try:
+            sub_elements_df = get_adls_file_dataframe(feed_path, adl, caller, time.time()+FEED_TIMEOUT_SECONDS)
+            if len(sub_elements_df) == 0: continue
+            sampled_etls, num_etls_in_feed = select_etl_directories(sub_elements_df)
+        except Exception as e:
+            print("Unexpected error processing Feed: {} Error: {}".format(feed_path,sys.exc_info()[0]))
+            print(traceback.format_exc())
+            yield {'FailedFeed': feed_path, 'Reason': describe_failure(e)}
+            continue
+        yield {'FeedPath': feed_path, 'ETLsInFeed': int(num_etls_in_feed),
+               'ETLPaths': [element for element, modification_time, etl_stats_dict in sampled_etls]}
+
+def summarise_etl_partition(etl_tasks, adl_factory=None, now_ms=None):
+    """Second mapPartitions stage of the Spark mode: summarises the (feed path, ETL path) pairs of
+    the partition into one feedStatsAccumulator per feed. Yields {'FeedPath', 'FeedStats'} for
+    each feed, to be merged on the driver with that feed's accumulators from other partitions,
+    and a FailedFeed record for each feed with an ETL directory that could not be listed"""
+    adl = adl_factory() if adl_factory is not None else get_filesystem()
+    reset_ls_rate_limiter()
+    caller = new_adls_caller(1)
+    partial_stats = OrderedDict()
+    failed_feeds = set()
+    for feed_path, etl_path in etl_tasks:
+        if feed_path in failed_feeds: continue
+        try:
+            etl_stats_dict = process_etls_agg(etl_path, adl, caller, time.time()+FEED_TIMEOUT_SECONDS)
+        except Exception as e:
+            print("Unexpected error processing Feed: {} Error: {}".format(feed_path,sys.exc_info()[0]))
+            print(traceback.format_exc())
+            failed_feeds.add(feed_path)
+            partial_stats.pop(feed_path, None)
+            yield {'FailedFeed': feed_path, 'Reason': describe_failure(e)}
+            continue
+        if len(etl_stats_dict) > 0:
+            if feed_path not in partial_stats: partial_stats[feed_path] = feedStatsAccumulator(now_ms)
+            partial_stats[feed_path].add(etl_stats_dict)
+    for feed_path, feed_stats in partial_stats.items():
+        yield {'FeedPath': feed_path, 'FeedStats': feed_stats}
+
+def merge_feed_partials(feed_listings, partial_results, now_ms=None):
+    """Driver side of the Spark mode: merges each feed's partial accumulators into its feed
+    summary dict. A feed that failed in either stage is left out. Returns the feed summaries,
+    in feed list order, and an OrderedDict of failed feed path -> reason"""
+    failed_feeds = OrderedDict()
+    for result in list(feed_listings) + list(partial_results):
+        if 'FailedFeed' in result and result['FailedFeed'] not in failed_feeds:
+            failed_feeds[result['FailedFeed']] = result['Reason']
+    merged_stats = {}
+    for result in partial_results:
+        if 'FeedStats' not in result: continue
+        if result['FeedPath'] not in merged_stats: merged_stats[result['FeedPath']] = feedStatsAccumulator(now_ms)
+        merged_stats[result['FeedPath']].merge(result['FeedStats'])
+    feed_stats = []
+    for listing in feed_listings:
+        if 'FailedFeed' in listing or listing['FeedPath'] in failed_feeds: continue
+        feed_info_dict = build_feed_info_dict(listing['FeedPath'], merged_stats.get(listing['FeedPath'], feedStatsAccumulator(now_ms)),
+                                              listing['ETLsInFeed'])
+        if feed_info_dict is not None:
+            feed_info_dict['SummaryStatistics'] = to_json_safe(feed_info_dict['SummaryStatistics'])
+            feed_stats.append(feed_info_dict)
+    return feed_stats, failed_feeds
+
+def run_on_executor(function_name, *args):
+    # Imported by name on the executor (the file is shipped with addPyFile) so that the module's
+    # locks and clients are created there rather than pickled from the driver
+    import datalake_stats_engine
+    return getattr(datalake_stats_engine, function_name)(*args)
+
+def process_feed_list_spark(all_vdc_feeds, spark_session=None, adl_factory=None, num_partitions=None):
+    """Spreads the crawl across the Spark executors in two mapPartitions stages: the feed
+    directories are listed and sampled in num_partitions partitions, then the sampled ETL
+    directories are summarised SPARK_ETLS_PER_PARTITION to a partition, so a large feed is
+    spread over several executors. Only the per-partition feed accumulators and failure records
+    are collected back to the driver, where each feed's accumulators are merged and the feeds
+    written to the stats document (failures under FailedFeeds).
+    adl_factory is a picklable callable returning the filesystem client to use on each executor,
+    defaulting to the configured FILESYSTEM_BACKEND. Returns the feed summaries as a Spark
+    DataFrame with the SummaryStatistics schema"""
+    all_vdc_feeds = list(all_vdc_feeds)
+    if spark_session is None: spark_session = get_spark_session()
+    if len(all_vdc_feeds) == 0: return feed_stats_to_spark_dataframe([], spark_session)
+    if num_partitions is None: num_partitions = max(1, len(all_vdc_feeds) // SPARK_FEEDS_PER_PARTITION)
+    spark_session.sparkContext.addPyFile(os.path.abspath(__file__))
+    feed_rdd = spark_session.sparkContext.parallelize(all_vdc_feeds, num_partitions)
+    listing_rdd = feed_rdd.mapPartitions(lambda feed_paths: run_on_executor('list_feed_partition', feed_paths, adl_factory)).cache()
+    feed_listings = listing_rdd.map(lambda listing: {key: (len(value) if key == 'ETLPaths' else value) for key, value in listing.items()}).collect()
+    num_etl_tasks = sum(listing.get('ETLPaths', 0) for listing in feed_listings)
+    etl_rdd = listing_rdd.flatMap(lambda listing: [(listing['FeedPath'], etl_path) for etl_path in listing.get('ETLPaths', [])])
+    etl_rdd = etl_rdd.repartition(max(1, num_etl_tasks // SPARK_ETLS_PER_PARTITION))
+    partial_results = etl_rdd.mapPartitions(lambda etl_tasks: run_on_executor('summarise_etl_partition', etl_tasks, adl_factory)).collect()
+    listing_rdd.unpersist()
+    feed_stats, failed_feeds = merge_feed_partials(feed_listings, partial_results)
+    open_stats_blob_json()
+    for feed_path, reason in failed_feeds.items():
+        feed_failure_log.record(feed_path, reason)
+        run_metrics.increment('feed_errors')
+    for feed_info_dict in feed_stats:
+        output_stats_to_json_blob(feed_info_dict)
+    close_stats_blob_json(all_vdc_feeds)
+    return feed_stats_to_spark_dataframe(feed_stats, spark_session)
+
+class asyncAdlsFileSystem:
+    """Lists ADLS directories with the WebHDFS LISTSTATUS call over one aiohttp session, using the
+    pooled client's credential, so thousands of listings can be in flight from a single thread.
+    Must be used inside a running event loop; call close() when the crawl is done"""
+    def __init__(self, max_connections=ASYNC_MAX_IN_FLIGHT):
+        self.max_connections = max_connections
+        self.session = None
+    async def als(self, path, detail=False):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        get_adls_client()
+        access_token = adls_client_pool.credential.token['access_token']
+        url = 'https://{}.azuredatalakestore.net/webhdfs/v1/{}'.format(ADLS_ACCOUNT, path.strip('/'))
+        entries = []
+        list_after = None
+        while True:
+            params = {'op': 'LISTSTATUS', 'listSize': str(ADLS_LIST_PAGE_SIZE)}
+            if list_after is not None: params['listAfter'] = list_after
+            async with self.session.get(url, params=params, headers={'Authorization': 'Bearer ' + access_token}) as response:
+                if response.status in THROTTLING_STATUSES:
+                    raise httpStatusError("ADLS throttled listing {} with HTTP {}".format(path, response.status), response.status)
+                if response.status == 404:
+                    raise FileNotFoundError(path)
+                response.raise_for_status()
+                statuses = (await response.json())['FileStatuses']['FileStatus']
+            for status in statuses:
+                entries.append(make_listing_entry(path.rstrip('/') + '/' + status['pathSuffix'], status['type'],
+                                                  status['length'], status['modificationTime']))
+            if len(statuses) < ADLS_LIST_PAGE_SIZE: break
+            list_after = statuses[-1]['pathSuffix']
+        return entries if detail else [entry['name'] for entry in entries]
+    async def close(self):
+        if self.session is not None: await self.session.close()
+        self.session = None
+
+async def async_ls(adl, path, in_flight, executor, caller):
+    """Lists path once a slot under the global in-flight limit is free. Transient failures are
+    retried with retry_delay_seconds backoff and counted by the crawl's adls circuitBreaker
+    (the in-flight semaphore takes the place of the adaptive limit here). Filesystems with an als() coroutine are awaited directly,
+    blocking clients run on the executor"""
+    for attempt in range(MAX_CALL_RETRIES + 1):
+        async with in_flight:
+            run_metrics.increment('ls_calls')
+            is_probe = False
+            try:
+                is_probe = caller.breaker.before_call()
+                with run_metrics.timer('ls'):
+                    if hasattr(adl, 'als'):
+                        listing = await adl.als(path, detail=True)
+                    else:
+                        listing = await asyncio.get_running_loop().run_in_executor(executor, functools.partial(adl.ls, path, detail=True))
+                caller.breaker.on_success()
+                return listing
+            except Exception as e:
+                run_metrics.increment('ls_errors')
+                if is_throttling_error(e): run_metrics.increment('ls_throttled')
+                if is_transient_error(e):
+                    if not isinstance(e, circuitOpenError): caller.breaker.on_failure()
+                else:
+                    caller.breaker.on_success()
+                if not is_transient_error(e) or attempt == MAX_CALL_RETRIES: raise
+            finally:
+                # also reached when wait_for cancels the feed mid-probe
+                if is_probe: caller.breaker.end_probe()
+        run_metrics.increment('adls_retries')
+        await asyncio.sleep(max(retry_delay_seconds(attempt), caller.breaker.wait_seconds()))
+
+async def crawl_feed_async(path, adl, in_flight, executor, caller, etl_cache=None):
+    """Async counterpart of compute_feed_stats: lists the feed, then lists its sampled ETL
+    directories concurrently - all at once in 'fraction' SAMPLING_MODE, in waves of
+    MIN_ETL_SAMPLES in 'stratified' mode so sampling can stop early. Returns the same feed
+    summary dict, or None"""
+    if LOGGING: print("Process Feed {}".format(path))
+    sub_elements_df = pd.DataFrame(await async_ls(adl, path, in_flight, executor, caller))
+    if len(sub_elements_df) == 0: return None
+    sampled_etls, num_etls_in_feed = select_etl_directories(sub_elements_df, etl_cache)
+    feed_stats = feedStatsAccumulator()
+    wave_size = MIN_ETL_SAMPLES if SAMPLING_MODE == 'stratified' else max(1, len(sampled_etls))
+    for wave_start in range(0, len(sampled_etls), wave_size):
+        if etl_sample_is_sufficient(feed_stats, num_etls_in_feed): break
+        wave = sampled_etls[wave_start:wave_start+wave_size]
+        etl_listings = await asyncio.gather(*[async_ls(adl, element, in_flight, executor, caller)
+                                              for element, modification_time, cached_stats_dict in wave if cached_stats_dict is None])
+        etl_listings = iter(etl_listings)
+        for element, modification_time, etl_stats_dict in wave:
+            if etl_stats_dict is None:
+                etl_stats_dict = summarise_etl_listing(element, pd.DataFrame(next(etl_listings)))
+                if len(etl_stats_dict) > 0 and etl_cache is not None: etl_cache.put(element, modification_time, to_json_safe(etl_stats_dict))
+            if len(etl_stats_dict) > 0: feed_stats.add(etl_stats_dict)
+    return build_feed_info_dict(path, feed_stats, num_etls_in_feed)
+
+async def crawl_feeds_async(all_vdc_feeds, adl, max_in_flight, etl_cache=None, checkpoint=None, max_concurrent_feeds=None, caller=None):
+    """Crawls the feeds with max_concurrent_feeds worker tasks (at most max_in_flight, so each
+    feed being crawled can get a listing slot). A feed's timeout and wall time start when a
+    worker picks it up, not while it waits for one. Only caller's circuitBreaker is used"""
+    if max_concurrent_feeds is None: max_concurrent_feeds = ASYNC_MAX_CONCURRENT_FEEDS
+    if caller is None: caller = new_adls_caller()
+    in_flight = asyncio.Semaphore(max_in_flight)
+    executor = ThreadPoolExecutor(max_workers=min(max_in_flight, ASYNC_EXECUTOR_THREADS))
+    feed_timings = {}
+    async def crawl_one(feed_path):
+        start_time = time.time()
+        try:
+            with feed_context(feed_path), run_metrics.timer('process_feeds_agg'):
+                feed_info_dict = await asyncio.wait_for(crawl_feed_async(feed_path, adl, in_flight, executor, caller, etl_cache), FEED_TIMEOUT_SECONDS)
+            if feed_info_dict is not None:
+                output_stats_to_json_blob(feed_info_dict)
+                run_metrics.increment('feeds_reported')
+            feed_failure_log.clear(feed_path)
+            if checkpoint is not None: checkpoint.record(feed_path, feed_info_dict)
+        except asyncio.TimeoutError:
+            print("Timed out processing Feed: {} after {}s".format(get_path_suffix(feed_path),FEED_TIMEOUT_SECONDS))
+            feed_failure_log.record(feed_path, "Timed out after {}s".format(FEED_TIMEOUT_SECONDS))
+            run_metrics.increment('feed_timeouts')
+        except Exception as e:
+            feed_failure_log.record(feed_path, describe_failure(e))
+            run_metrics.increment('feed_errors')
+            print("Unexpected error processing Feed: {} Error: {}".format(get_path_suffix(feed_path),sys.exc_info()[0]))
+            print(traceback.format_exc())
+        feed_timings[feed_path] = feed_timings.get(feed_path, 0) + time.time() - start_time
+    feed_iter = iter(all_vdc_feeds)
+    async def feed_worker():
+        for feed_path in feed_iter:
+            await crawl_one(feed_path)
+    num_workers = max(1, min(max_concurrent_feeds, max_in_flight, len(all_vdc_feeds)))
+    try:
+        await asyncio.gather(*[feed_worker() for worker_num in range(num_workers)])
+    finally:
+        executor.shutdown(wait=False)
+        if isinstance(adl, asyncAdlsFileSystem): await adl.close()
+    return feed_timings
+
+def process_feed_list_async(all_vdc_feeds, adl=None, max_in_flight=None, max_concurrent_feeds=None):
+    """Crawls the feeds with the asyncio engine: up to max_concurrent_feeds feeds are crawled at
+    once, each issuing its sampled ETL listings concurrently, with at most max_in_flight
+    listings outstanding across the whole run.
+    With the adls backend and aiohttp installed, listings use the native async REST client.
+    The limits default to ASYNC_MAX_IN_FLIGHT and ASYNC_MAX_CONCURRENT_FEEDS.
+    Returns a dict of feed path -> wall time in seconds"""
+    if max_in_flight is None: max_in_flight = ASYNC_MAX_IN_FLIGHT
+    all_vdc_feeds = list(all_vdc_feeds)
+    if len(all_vdc_feeds) == 0: return {}
+    if adl is None:
+        if FILESYSTEM_BACKEND == 'adls' and aiohttp is not None:
+            adl = asyncAdlsFileSystem(max_in_flight)
+        else:
+            adl = get_filesystem()
+    caller = new_adls_caller()
+    etl_cache = get_etl_cache()
+    checkpoint = get_checkpoint()
+    completed_feeds = open_stats_with_checkpoint(checkpoint)
+    all_vdc_feeds = [feed_path for feed_path in all_vdc_feeds if feed_path not in completed_feeds]
+    feed_timings = asyncio.run(crawl_feeds_async(all_vdc_feeds, adl, max_in_flight, etl_cache, checkpoint, max_concurrent_feeds, caller))
+    for retry_pass in range(FAILED_FEED_RETRY_PASSES):
+        failed_feeds = feed_failure_log.failed_feeds()
+        if len(failed_feeds) == 0: break
+        print("Retrying {} failed feeds".format(len(failed_feeds)))
+        retry_timings = asyncio.run(crawl_feeds_async(failed_feeds, adl, max_in_flight, etl_cache, checkpoint, max_concurrent_feeds, caller))
+        for feed_path, seconds in retry_timings.items():
+            feed_timings[feed_path] = feed_timings.get(feed_path, 0) + seconds
+    close_stats_with_checkpoint(checkpoint, feed_timings.keys())
+    if etl_cache is not None: etl_cache.save()
+    report_feed_timings(feed_timings)
+    return feed_timings
+
+def write_run_metrics(feed_timings=None, adl=None):
+    """Dumps run_metrics (with the ETL listing cache hit counts) next to the stats document and,
+    with PROFILE_SLOWEST_FEEDS set, profiles the slowest feeds of feed_timings"""
+    etl_cache = get_etl_cache()
+    if etl_cache is not None:
+        run_metrics.counters['etl_cache_hits'] = etl_cache.hits
+        run_metrics.counters['etl_cache_misses'] = etl_cache.misses
+    metrics_path = run_metrics.dump()
+    print("Wrote run metrics to {}".format(metrics_path))
+    if PROFILE_SLOWEST_FEEDS > 0 and feed_timings:
+        profile_slowest_feeds(feed_timings, PROFILE_SLOWEST_FEEDS, adl)
+
+def profile_slowest_feeds(feed_timings, num_feeds=None, adl=None, profile_dir=None):
+    """Recomputes the num_feeds slowest feeds of a run one at a time under cProfile, without the
+    ETL listing cache or writing stats, and saves a .prof file per feed (view with pstats or
+    snakeviz). Profiling afterwards keeps the profiler off the crawler threads during the run"""
+    if num_feeds is None: num_feeds = PROFILE_SLOWEST_FEEDS
+    if profile_dir is None: profile_dir = PROFILE_DIR
+    if adl is None: adl = get_filesystem()
+    caller = new_adls_caller(1)
+    os.makedirs(profile_dir, exist_ok=True)
+    slowest = sorted(feed_timings.items(), key=lambda k: k[1], reverse=True)[:num_feeds]
+    profile_paths = []
+    for feed_path, seconds in slowest:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            compute_feed_stats(feed_path, adl=adl, caller=caller)
+        except:
+            print("Unexpected error profiling Feed: {} Error: {}".format(get_path_suffix(feed_path),sys.exc_info()[0]))
+        finally:
+            profiler.disable()
+        profile_path = os.path.join(profile_dir, '{}_{}_{}.prof'.format(current_date, get_feed_source(feed_path), get_path_suffix(feed_path)))
+        profiler.dump_stats(profile_path)
+        profile_paths.append(profile_path)
+        print("Profiled {} ({:.2f}s in the run) to {}".format(feed_path, seconds, profile_path))
+    return profile_paths
 
 scheduler = sched.scheduler(time.time, time.sleep)
 schedule_time_seconds = 60*60*24
 
+def refresh_run_date():
+    """Sets current_date (the ProcessDate of the run and of the anomaly observations) to today and
+    renames the stats document, metrics file and checkpoint for it, since MAIN reschedules itself
+    in the same process every day. The stats writer is recreated so its sink writes the new
+    document instead of replacing yesterday's"""
+    global current_date, STATS_FILE_NAME, METRICS_FILE_NAME, CHECKPOINT_PATH, stats_writer
+    current_date = date.today().isoformat()
+    STATS_FILE_NAME = 'stats_'+current_date+'.json'
+    METRICS_FILE_NAME = 'run_metrics_'+current_date
+    CHECKPOINT_PATH = 'stats_checkpoint_'+current_date+'.ndjson'
+    stats_writer = None
+
 def MAIN():
     start_time = time.time()
-    process_feed_list_threaded(get_feed_list_from_config())
+    refresh_run_date()
+    run_metrics.reset()
+    feed_timings = None
+    if EXECUTION_MODE == 'spark':
+        process_feed_list_spark(get_feed_list_from_config())
+    elif EXECUTION_MODE == 'async':
+        feed_timings = process_feed_list_async(get_feed_list_from_config())
+    else:
+        feed_timings = process_feed_list_threaded(iter_feed_list_from_config())
+    if COLLECT_METRICS: write_run_metrics(feed_timings)
+    if SAVE_HISTORY:
+        try:
+            save_run_to_history()
+        except:
+            print("Unexpected error saving feed stats history: {}".format(sys.exc_info()[0]))
+            print(traceback.format_exc())
     print("--- %s seconds ---" % (time.time() - start_time))
     scheduler.enter(schedule_time_seconds, 1, MAIN,"")
 
-scheduler.enter(2, 1, MAIN,"")
-scheduler.run()
+if __name__ == "__main__":
+    scheduler.enter(2, 1, MAIN,"")
+    scheduler.run()
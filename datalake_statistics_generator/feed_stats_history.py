@@ -0,0 +1,186 @@
+"""Append-only history of the daily feed summaries, so trends can be queried without downloading
+and parsing every stats_<date>.json document.
+
+The store is a Parquet dataset partitioned by ProcessDate (ProcessDate=YYYY-MM-DD directories).
+Each run adds one file to its day's partition with one row per feed: SourceName, FeedName and the
+SummaryStatistics fields, sorted by SourceName and FeedName so row group statistics let source and
+feed filters skip data. Queries only open the partitions in their date range and read only the
+columns they use:
+
+    history = feedStatsHistory('feed_stats_history')
+    history.append(feed_records)
+    history.growth_rates('2026-09-01', '2026-10-01')
+
+anomalies() is the retrospective counterpart of the engine's feedAnomalyDetector: the detector
+flags each run as it happens from a running EWMA baseline and needs no history, while anomalies()
+judges any saved day and metric against a median/MAD baseline recomputed from the store, e.g. to
+investigate a feed or to backfill flags for days run before detection was switched on.
+"""
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pandas as pd
+import numpy as np
+import os
+import time
+import uuid
+from datetime import date, timedelta
+
+HISTORY_ROOT = 'feed_stats_history'
+KEY_COLUMNS = ['SourceName', 'FeedName', 'ProcessDate']
+SUMMARY_FIELDS = [('TotalETLsProcessed', pa.int64()),
+                  ('AvgETLBytes', pa.float64()),
+                  ('AvgETLMB', pa.float64()),
+                  ('AvgETLMBLower', pa.float64()),
+                  ('AvgETLMBUpper', pa.float64()),
+                  ('ETLsInFeed', pa.int64()),
+                  ('SamplingMode', pa.string()),
+                  ('StdDevETLMB', pa.float64()),
+                  ('MaxETLMB', pa.float64()),
+                  ('MinETLMB', pa.float64()),
+                  ('LastUpdated', pa.string()),
+                  ('LatestETLMB', pa.float64()),
+                  ('Last24HrsETLMB', pa.float64()),
+                 ]
+# Rows written by a later run of the same day supersede earlier ones in queries
+RUN_TIMESTAMP_COLUMN = 'RunTimestamp'
+FILE_SCHEMA = pa.schema([('SourceName', pa.string()), ('FeedName', pa.string())] + SUMMARY_FIELDS +
+                        [(RUN_TIMESTAMP_COLUMN, pa.int64())])
+PARTITIONING = ds.partitioning(pa.schema([('ProcessDate', pa.string())]), flavor='hive')
+MAD_TO_STD = 1.4826
+ANOMALY_LOOKBACK_DAYS = 30
+ANOMALY_THRESHOLD = 3.5
+MIN_BASELINE_DAYS = 5
+
+def to_date_string(value):
+    if value is None or isinstance(value, str): return value
+    return value.isoformat()
+
+class feedStatsHistory:
+    "Parquet history of feed summary records under root_path, partitioned by ProcessDate"
+    def __init__(self, root_path=HISTORY_ROOT):
+        self.root_path = root_path
+
+    def append(self, feed_records, process_date=None):
+        """Adds one run's feed summary dicts (as written to the stats document) to the store as a
+        new file in the ProcessDate partition. process_date defaults to the records' ProcessDate.
+        Returns the number of rows written"""
+        feed_records = [record for record in feed_records if record is not None]
+        if len(feed_records) == 0: return 0
+        if process_date is None: process_date = feed_records[0]['SummaryStatistics']['ProcessDate']
+        run_timestamp = int(time.time()*1000)
+        columns = {'SourceName': [], 'FeedName': []}
+        for field_name, field_type in SUMMARY_FIELDS:
+            columns[field_name] = []
+        for record in sorted(feed_records, key=lambda record: (record['SourceName'], record['FeedName'])):
+            columns['SourceName'].append(record['SourceName'])
+            columns['FeedName'].append(record['FeedName'])
+            summary = record['SummaryStatistics']
+            for field_name, field_type in SUMMARY_FIELDS:
+                value = summary.get(field_name)
+                if isinstance(value, np.generic): value = value.item()
+                if isinstance(value, float) and np.isnan(value): value = None
+                columns[field_name].append(value)
+        columns[RUN_TIMESTAMP_COLUMN] = [run_timestamp]*len(feed_records)
+        table = pa.Table.from_pydict(columns, schema=FILE_SCHEMA)
+        partition_dir = os.path.join(self.root_path, 'ProcessDate={}'.format(to_date_string(process_date)))
+        os.makedirs(partition_dir, exist_ok=True)
+        file_name = 'part-{}-{}.parquet'.format(run_timestamp, uuid.uuid4().hex[:8])
+        temp_path = os.path.join(partition_dir, '.' + file_name + '.tmp')
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, os.path.join(partition_dir, file_name))
+        return len(feed_records)
+
+    def dataset(self):
+        if not os.path.isdir(self.root_path): return None
+        return ds.dataset(self.root_path, format='parquet', partitioning=PARTITIONING,
+                          exclude_invalid_files=True, ignore_prefixes=['.', '_'])
+
+    def scan(self, start_date=None, end_date=None, columns=None, sources=None, feeds=None, latest_only=True):
+        """Returns the history rows with start_date <= ProcessDate <= end_date (both optional,
+        dates or ISO strings) as a DataFrame of the key columns plus columns (default: every
+        summary field). sources and feeds restrict the rows to those names. With latest_only,
+        a feed reported by several runs on the same day keeps only the last run's row"""
+        if columns is None: columns = [field_name for field_name, field_type in SUMMARY_FIELDS]
+        read_columns = KEY_COLUMNS + [column for column in columns if column not in KEY_COLUMNS]
+        if latest_only and RUN_TIMESTAMP_COLUMN not in read_columns: read_columns.append(RUN_TIMESTAMP_COLUMN)
+        dataset = self.dataset()
+        if dataset is None: return pd.DataFrame(columns=read_columns)
+        row_filter = None
+        conditions = []
+        if start_date is not None: conditions.append(ds.field('ProcessDate') >= to_date_string(start_date))
+        if end_date is not None: conditions.append(ds.field('ProcessDate') <= to_date_string(end_date))
+        if sources is not None: conditions.append(ds.field('SourceName').isin(list(sources)))
+        if feeds is not None: conditions.append(ds.field('FeedName').isin(list(feeds)))
+        for condition in conditions:
+            row_filter = condition if row_filter is None else row_filter & condition
+        history_df = dataset.to_table(columns=read_columns, filter=row_filter).to_pandas()
+        if latest_only and len(history_df) > 0:
+            history_df = history_df.sort_values(RUN_TIMESTAMP_COLUMN).drop_duplicates(KEY_COLUMNS, keep='last')
+        if RUN_TIMESTAMP_COLUMN not in columns: history_df = history_df.drop(columns=[RUN_TIMESTAMP_COLUMN], errors='ignore')
+        return history_df.sort_values(KEY_COLUMNS).reset_index(drop=True)
+
+    def feed_series(self, source_name, feed_name, metric='AvgETLMB', start_date=None, end_date=None):
+        "Returns one feed's metric by ProcessDate as a Series"
+        history_df = self.scan(start_date, end_date, [metric], sources=[source_name], feeds=[feed_name])
+        return history_df.set_index('ProcessDate')[metric]
+
+    def growth_rates(self, start_date=None, end_date=None, metric='AvgETLMB', sources=None, feeds=None):
+        """Per-feed growth of metric over the date range: first and last reported values, the
+        absolute and relative change between them, and the least-squares slope in metric units
+        per day. Feeds reported on fewer than 2 days get a NaN slope"""
+        history_df = self.scan(start_date, end_date, [metric], sources, feeds)
+        result_columns = ['SourceName', 'FeedName', 'Days', 'FirstDate', 'LastDate', 'FirstValue', 'LastValue',
+                          'Change', 'RelativeChange', 'SlopePerDay']
+        if len(history_df) == 0: return pd.DataFrame(columns=result_columns)
+        history_df['Day'] = (pd.to_datetime(history_df['ProcessDate']) - pd.Timestamp('1970-01-01')).dt.days
+        feed_groups = history_df.groupby(['SourceName', 'FeedName'])
+        history_df['DayDelta'] = history_df['Day'] - feed_groups['Day'].transform('mean')
+        history_df['ValueDelta'] = history_df[metric] - feed_groups[metric].transform('mean')
+        history_df['Covariance'] = history_df['DayDelta']*history_df['ValueDelta']
+        history_df['DayVariance'] = history_df['DayDelta']**2
+        growth_df = history_df.groupby(['SourceName', 'FeedName']).agg(
+            Days=('ProcessDate', 'count'),
+            FirstDate=('ProcessDate', 'first'),
+            LastDate=('ProcessDate', 'last'),
+            FirstValue=(metric, 'first'),
+            LastValue=(metric, 'last'),
+            Covariance=('Covariance', 'sum'),
+            DayVariance=('DayVariance', 'sum')).reset_index()
+        growth_df['Change'] = growth_df['LastValue'] - growth_df['FirstValue']
+        growth_df['RelativeChange'] = growth_df['Change']/growth_df['FirstValue'].replace(0, np.nan)
+        growth_df['SlopePerDay'] = growth_df['Covariance']/growth_df['DayVariance'].replace(0, np.nan)
+        return growth_df[result_columns]
+
+    def anomalies(self, process_date=None, metric='LatestETLMB', lookback_days=ANOMALY_LOOKBACK_DAYS,
+                  threshold=ANOMALY_THRESHOLD, sources=None, feeds=None):
+        """Feeds whose metric on process_date (default today) is more than threshold robust
+        standard deviations (median absolute deviation) from their own previous lookback_days.
+        Feeds with fewer than MIN_BASELINE_DAYS of history are not judged. Returns a DataFrame
+        with the value, the baseline median and the robust z-score, largest deviations first"""
+        if process_date is None: process_date = date.today()
+        process_date = pd.Timestamp(to_date_string(process_date)).date()
+        start_date = process_date - timedelta(days=lookback_days)
+        history_df = self.scan(start_date, process_date, [metric], sources, feeds)
+        result_columns = ['SourceName', 'FeedName', 'ProcessDate', 'Value', 'BaselineMedian', 'BaselineDays', 'RobustZ']
+        if len(history_df) == 0: return pd.DataFrame(columns=result_columns)
+        is_current = history_df['ProcessDate'] == process_date.isoformat()
+        baseline_df = history_df[~is_current].groupby(['SourceName', 'FeedName'])[metric]
+        baseline_median = baseline_df.median().rename('BaselineMedian')
+        baseline_days = baseline_df.count().rename('BaselineDays')
+        deviations = history_df[~is_current].join(baseline_median, on=['SourceName', 'FeedName'])
+        deviations['AbsDeviation'] = (deviations[metric] - deviations['BaselineMedian']).abs()
+        baseline_mad = deviations.groupby(['SourceName', 'FeedName'])['AbsDeviation'].median().rename('BaselineMAD')
+        current_df = history_df[is_current].rename(columns={metric: 'Value'})
+        current_df = current_df.join(baseline_median, on=['SourceName', 'FeedName'])
+        current_df = current_df.join(baseline_days, on=['SourceName', 'FeedName'])
+        current_df = current_df.join(baseline_mad, on=['SourceName', 'FeedName'])
+        current_df = current_df[current_df['BaselineDays'] >= MIN_BASELINE_DAYS]
+        deviation = current_df['Value'] - current_df['BaselineMedian']
+        scale = MAD_TO_STD*current_df['BaselineMAD']
+        # A flat baseline has no spread: any change from it is anomalous, no change is not
+        current_df['RobustZ'] = np.where(scale > 0, deviation/scale.where(scale > 0, 1.0),
+                                         np.where(deviation == 0, 0.0, np.sign(deviation)*np.inf))
+        anomalies_df = current_df[current_df['RobustZ'].abs() > threshold]
+        anomalies_df = anomalies_df.reindex(anomalies_df['RobustZ'].abs().sort_values(ascending=False).index)
+        return anomalies_df[result_columns].reset_index(drop=True)
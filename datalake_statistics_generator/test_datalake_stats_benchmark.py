@@ -0,0 +1,24 @@
+import tracemalloc
+import datalake_stats_benchmark as benchmark
+
+
+def test_measure_times_the_untraced_pass(local_engine):
+    tracing = []
+    def run():
+        tracing.append(tracemalloc.is_tracing())
+        return [0]*100000
+    result, elapsed, peak_bytes = benchmark.measure(run)
+    assert tracing == [False, True]
+    assert len(result) == 100000 and peak_bytes >= 800000
+
+
+def test_benchmark_matrix_covers_every_crawl_engine(local_engine, monkeypatch):
+    monkeypatch.setattr(benchmark, 'QUICK_FEED_LIST_SHAPES', [{'num_sources': 1, 'feeds_per_source': 4, 'etls_per_feed': 5, 'files_per_etl': 3}])
+    monkeypatch.setattr(benchmark, 'QUICK_CONCURRENCY_LEVELS', [2])
+    monkeypatch.setattr(benchmark, 'QUICK_FILES_PER_ETL_LEVELS', [10])
+    monkeypatch.setattr(benchmark, 'QUICK_ETLS_PER_FEED_LEVELS', [10])
+    results = benchmark.run_benchmarks(0.0, quick=True)
+    feed_list_results = [result for result in results if 'feeds' in result]
+    assert [result['benchmark'] for result in feed_list_results] == ['process_feed_list', 'process_feed_list_threaded', 'process_feed_list_async']
+    assert feed_list_results[-1]['max_in_flight'] == 2
+    assert all(result['feeds'] == 4 and result['listings'] > 4 for result in feed_list_results)
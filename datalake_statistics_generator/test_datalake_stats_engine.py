@@ -0,0 +1,471 @@
+import asyncio
+import datetime
+import functools
+import json
+import threading
+import time
+import pytest
+
+
+def test_async_feed_timeout_excludes_queue_wait(local_engine):
+    local_engine.FEED_TIMEOUT_SECONDS = 1
+    local_engine.FAILED_FEED_RETRY_PASSES = 0
+    fs = local_engine.syntheticFileSystem(num_sources=4, feeds_per_source=10, etls_per_feed=30, files_per_etl=3,
+                                          latency_seconds=0.05, seed=0)
+    feed_timings = local_engine.process_feed_list_async(fs.get_feed_paths(), adl=fs, max_in_flight=2)
+    assert local_engine.feed_failure_log.to_list() == []
+    assert len(feed_timings) == 40
+    assert max(feed_timings.values()) < 1
+
+
+def open_breaker(breaker):
+    for failure in range(breaker.failure_threshold):
+        breaker.on_failure()
+    breaker.opened_at -= breaker.reset_seconds
+
+
+def test_breaker_closes_after_non_transient_probe_failure(local_engine):
+    breaker = local_engine.circuitBreaker('test', failure_threshold=2, reset_seconds=60)
+    caller = local_engine.resilientCaller('test', breaker)
+    open_breaker(breaker)
+    def missing_path():
+        raise FileNotFoundError('prod/feeds/missing')
+    with pytest.raises(FileNotFoundError):
+        caller.call(missing_path)
+    assert caller.call(lambda: 'listed') == 'listed'
+    assert breaker.opened_at is None
+
+
+def test_breaker_reopens_after_transient_probe_failure(local_engine, monkeypatch):
+    monkeypatch.setattr(local_engine, 'MAX_CALL_RETRIES', 0)
+    breaker = local_engine.circuitBreaker('test', failure_threshold=2, reset_seconds=60)
+    caller = local_engine.resilientCaller('test', breaker)
+    open_breaker(breaker)
+    def throttled():
+        raise local_engine.httpStatusError('HTTP 429 Throttled', 429)
+    with pytest.raises(IOError):
+        caller.call(throttled)
+    with pytest.raises(local_engine.circuitOpenError):
+        caller.call(lambda: 'listed')
+
+
+def test_cancelled_async_probe_releases_breaker(local_engine):
+    class slowFileSystem:
+        async def als(self, path, detail=False):
+            await asyncio.sleep(10)
+
+    breaker = local_engine.circuitBreaker('adls', failure_threshold=2, reset_seconds=60)
+    caller = local_engine.resilientCaller('adls', breaker)
+    open_breaker(breaker)
+    async def probe():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(local_engine.async_ls(slowFileSystem(), 'prod/feeds', asyncio.Semaphore(1), None, caller), 0.05)
+    asyncio.run(probe())
+    assert breaker.before_call() is True
+
+
+class recordingSink:
+    "Stands in for blobStatsSink, failing the appends listed in fail_appends"
+    max_block_bytes = 10
+    def __init__(self, fail_appends=()):
+        self.blocks = []
+        self.appends = 0
+        self.fail_appends = fail_appends
+    def create(self):
+        self.blocks = []
+    def append(self, data):
+        self.appends += 1
+        if self.appends in self.fail_appends: raise ValueError('append rejected')
+        self.blocks.append(data)
+
+
+def test_stats_writer_appends_blocks_of_at_most_max_block_bytes(local_engine):
+    sink = recordingSink(fail_appends=[3])
+    writer = local_engine.statsWriter(sink, output_format='ndjson', flush_bytes=25)
+    writer.open()
+    writer.write({'FeedName': 'feed000', 'SourceName': 'source000'})
+    writer.write({'FeedName': 'feed001', 'SourceName': 'source000'})
+    writer.close()
+    assert max(len(block) for block in sink.blocks) <= sink.max_block_bytes
+    lines = b''.join(sink.blocks).decode().splitlines()
+    assert [json.loads(line)['FeedName'] for line in lines] == ['feed000', 'feed001']
+
+
+def test_split_accumulators_merge_to_a_single_pass(local_engine):
+    now_ms = 1600000000000
+    etl_rows = [{'FileSize': size, 'ETL': '2020-09-{:02d}'.format(day), 'ModificationTime': now_ms - day*3600000*9}
+                for day, size in enumerate([5e6, 1.2e7, 3e6, 8.5e6, 4.4e7, 7e5, 9.1e6], 1)]
+    single_pass = local_engine.feedStatsAccumulator(now_ms)
+    for etl_stats_dict in etl_rows:
+        single_pass.add(etl_stats_dict)
+    merged = local_engine.feedStatsAccumulator(now_ms)
+    for part in [etl_rows[:3], [], etl_rows[3:4], etl_rows[4:]]:
+        partial = local_engine.feedStatsAccumulator(now_ms)
+        for etl_stats_dict in part:
+            partial.add(etl_stats_dict)
+        merged.merge(partial)
+    assert merged.count == single_pass.count
+    assert merged.mean == pytest.approx(single_pass.mean)
+    assert merged.std() == pytest.approx(single_pass.std())
+    assert (merged.min_size, merged.max_size) == (single_pass.min_size, single_pass.max_size)
+    assert (merged.latest_etl, merged.latest_etl_size) == (single_pass.latest_etl, single_pass.latest_etl_size)
+    assert merged.last_24hrs_size == pytest.approx(single_pass.last_24hrs_size)
+
+
+def test_spark_stages_merge_feeds_split_across_partitions(local_engine, monkeypatch):
+    monkeypatch.setattr(local_engine, 'SAMPLE_PERC', 1)
+    fs = local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=2, etls_per_feed=5, files_per_etl=2, seed=0)
+    feed_paths = fs.get_feed_paths() + ['other/source000/feed000']
+    feed_listings = list(local_engine.list_feed_partition(feed_paths, adl_factory=lambda: fs))
+    etl_tasks = [(listing['FeedPath'], etl_path) for listing in feed_listings for etl_path in listing.get('ETLPaths', [])]
+    partial_results = []
+    for start in range(0, len(etl_tasks), 3):
+        partial_results.extend(local_engine.summarise_etl_partition(etl_tasks[start:start+3], adl_factory=lambda: fs))
+    feed_stats, failed_feeds = local_engine.merge_feed_partials(feed_listings, partial_results)
+
+    assert list(failed_feeds) == ['other/source000/feed000']
+    assert failed_feeds['other/source000/feed000'].startswith('FileNotFoundError')
+    assert [feed_info['FeedName'] for feed_info in feed_stats] == ['feed000', 'feed001']
+    for feed_path, feed_info in zip(fs.get_feed_paths(), feed_stats):
+        expected = local_engine.compute_feed_stats(feed_path, adl=fs)['SummaryStatistics']
+        assert feed_info['SummaryStatistics'] == pytest.approx(expected)
+
+
+def test_local_spark_mode_matches_the_threaded_engine(local_engine, tmp_path):
+    pytest.importorskip('pyspark')
+    from pyspark.sql import SparkSession
+    # The executors import the module with its default SAMPLE_PERC, which samples no ETL of a
+    # 3-ETL feed, so both engines summarise exactly the latest ETL of each feed
+    fs_factory = functools.partial(local_engine.syntheticFileSystem, num_sources=2, feeds_per_source=3, etls_per_feed=3, files_per_etl=2, seed=0)
+    feed_paths = fs_factory().get_feed_paths()
+    spark_session = SparkSession.builder.master('local[*]').getOrCreate()
+    try:
+        spark_rows = local_engine.process_feed_list_spark(feed_paths, spark_session, adl_factory=fs_factory, num_partitions=3).collect()
+    finally:
+        spark_session.stop()
+    local_engine.process_feed_list_threaded(feed_paths, num_threads=2, adl=fs_factory())
+    with open(tmp_path / local_engine.STATS_FILE_NAME) as stats_file:
+        document = json.load(stats_file)
+    threaded_stats = {key: feed_info for key, feed_info in document.items() if '/' in key}
+    assert len(spark_rows) == len(threaded_stats) == 6
+    for row in spark_rows:
+        feed_info = row.asDict(recursive=True)
+        expected = threaded_stats[feed_info['SourceName'] + '/' + feed_info['FeedName']]
+        assert feed_info['SummaryStatistics'] == pytest.approx(expected['SummaryStatistics'])
+
+
+def run_on_day(engine_module, monkeypatch, day, feed_paths, fs):
+    class fixedDate(datetime.date):
+        @classmethod
+        def today(cls):
+            return cls.fromisoformat(day)
+    monkeypatch.setattr(engine_module, 'date', fixedDate)
+    engine_module.refresh_run_date()
+    engine_module.process_feed_list(feed_paths, adl=fs)
+
+
+def test_anomaly_baseline_advances_across_scheduled_days(local_engine, synthetic_fs, monkeypatch):
+    for name in ['date', 'current_date', 'STATS_FILE_NAME', 'METRICS_FILE_NAME', 'CHECKPOINT_PATH', 'anomaly_detector']:
+        monkeypatch.setattr(local_engine, name, getattr(local_engine, name))
+    local_engine.DETECT_ANOMALIES = True
+    local_engine.anomaly_detector = None
+    for day in ['2026-10-01', '2026-10-02', '2026-10-03']:
+        run_on_day(local_engine, monkeypatch, day, synthetic_fs.get_feed_paths(), synthetic_fs)
+    baseline = local_engine.get_anomaly_detector().feeds['source000/feed000']
+    assert baseline['ObservedDate'] == '2026-10-03'
+    assert baseline['Baseline']['Runs'] == 2
+
+
+def test_each_scheduled_day_writes_its_own_stats_document(local_engine, synthetic_fs, monkeypatch, tmp_path):
+    for name in ['date', 'current_date', 'STATS_FILE_NAME', 'METRICS_FILE_NAME', 'CHECKPOINT_PATH']:
+        monkeypatch.setattr(local_engine, name, getattr(local_engine, name))
+    for day in ['2026-10-01', '2026-10-02']:
+        run_on_day(local_engine, monkeypatch, day, synthetic_fs.get_feed_paths(), synthetic_fs)
+    for day in ['2026-10-01', '2026-10-02']:
+        with open(tmp_path / ('stats_' + day + '.json')) as stats_file:
+            assert json.load(stats_file)['ProcessDate'] == day
+
+
+def test_json_document_keeps_feeds_with_the_same_name_in_different_sources(local_engine, tmp_path):
+    fs = local_engine.syntheticFileSystem(num_sources=3, feeds_per_source=2, etls_per_feed=3, files_per_etl=2, seed=0)
+    local_engine.process_feed_list(fs.get_feed_paths(), adl=fs)
+    with open(tmp_path / local_engine.STATS_FILE_NAME) as stats_file:
+        document = json.load(stats_file)
+    assert sorted(key for key in document if '/' in key) == sorted(path.split('/', 2)[2] for path in fs.get_feed_paths())
+
+
+def test_config_filters_set_after_import_apply(local_engine, monkeypatch):
+    monkeypatch.setattr(local_engine, 'CONFIG_INCLUDE_SOURCES', ['source001'])
+    monkeypatch.setattr(local_engine, 'CONFIG_EXCLUDE_FEEDS', ['feed00[01]'])
+    fs = local_engine.syntheticFileSystem(num_sources=3, feeds_per_source=3, seed=0)
+    assert local_engine.get_feed_list_from_config(fs) == ['prod/feeds/source001/feed002']
+
+
+def test_local_filesystem_uses_root_set_after_import(local_engine, monkeypatch, tmp_path):
+    (tmp_path / 'lake' / 'prod' / 'feeds' / 'source000').mkdir(parents=True)
+    monkeypatch.setattr(local_engine, 'FILESYSTEM_BACKEND', 'local')
+    monkeypatch.setattr(local_engine, 'LOCAL_FS_ROOT', str(tmp_path / 'lake'))
+    monkeypatch.setattr(local_engine, 'filesystem', None)
+    assert local_engine.get_filesystem().ls('prod/feeds') == ['prod/feeds/source000']
+
+
+def test_etl_cache_uses_path_set_after_import(local_engine, synthetic_fs, monkeypatch, tmp_path):
+    monkeypatch.setattr(local_engine, 'USE_ETL_CACHE', True)
+    monkeypatch.setattr(local_engine, 'ETL_CACHE_PATH', str(tmp_path / 'cache' / 'etl_cache.json'))
+    monkeypatch.setattr(local_engine, 'etl_listing_cache', None)
+    (tmp_path / 'cache').mkdir()
+    local_engine.process_feed_list(synthetic_fs.get_feed_paths(), adl=synthetic_fs)
+    assert (tmp_path / 'cache' / 'etl_cache.json').exists()
+
+
+def test_stats_output_format_set_after_import_applies(local_engine, synthetic_fs, monkeypatch, tmp_path):
+    monkeypatch.setattr(local_engine, 'STATS_OUTPUT_FORMAT', 'ndjson')
+    local_engine.process_feed_list(synthetic_fs.get_feed_paths(), adl=synthetic_fs)
+    with open(tmp_path / local_engine.STATS_FILE_NAME) as stats_file:
+        lines = [json.loads(line) for line in stats_file]
+    assert [line['FeedName'] for line in lines if 'FeedName' in line] == ['feed000', 'feed001']
+
+
+def test_history_root_set_after_import_applies(local_engine, synthetic_fs, monkeypatch, tmp_path):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(local_engine, 'HISTORY_ROOT', str(tmp_path / 'history'))
+    local_engine.process_feed_list(synthetic_fs.get_feed_paths(), adl=synthetic_fs)
+    assert local_engine.save_run_to_history() == 2
+    assert (tmp_path / 'history').is_dir()
+
+
+def test_profile_settings_set_after_import_apply(local_engine, synthetic_fs, monkeypatch, tmp_path):
+    monkeypatch.setattr(local_engine, 'PROFILE_SLOWEST_FEEDS', 1)
+    monkeypatch.setattr(local_engine, 'PROFILE_DIR', str(tmp_path / 'profiles'))
+    feed_timings = local_engine.process_feed_list(synthetic_fs.get_feed_paths(), adl=synthetic_fs)
+    profile_paths = local_engine.profile_slowest_feeds(feed_timings, adl=synthetic_fs)
+    assert len(profile_paths) == 1 and profile_paths[0].startswith(str(tmp_path / 'profiles'))
+
+
+def test_threaded_crawl_stops_workers_when_the_feed_list_fails(local_engine):
+    fs = local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=3, etls_per_feed=3, files_per_etl=2, seed=0)
+    def failing_feed_list():
+        yield from fs.get_feed_paths()
+        raise IOError('purge config read failed')
+    outcome = []
+    def crawl():
+        try:
+            local_engine.process_feed_list_threaded(failing_feed_list(), num_threads=4, adl=fs)
+        except IOError as e:
+            outcome.append(e)
+    crawl_thread = threading.Thread(target=crawl, daemon=True)
+    crawl_thread.start()
+    crawl_thread.join(10)
+    assert not crawl_thread.is_alive()
+    assert [str(e) for e in outcome] == ['purge config read failed']
+    assert not any(thread.name.startswith('crawler-') for thread in threading.enumerate())
+
+
+def reject_constant(constant):
+    raise ValueError('non-standard JSON constant ' + constant)
+
+
+def test_single_etl_feed_writes_strict_json(local_engine, tmp_path):
+    fs = local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=1, etls_per_feed=1, files_per_etl=2, seed=0)
+    local_engine.process_feed_list(fs.get_feed_paths(), adl=fs)
+    with open(tmp_path / local_engine.STATS_FILE_NAME) as stats_file:
+        document = json.loads(stats_file.read(), parse_constant=reject_constant)
+    summary = document['source000/feed000']['SummaryStatistics']
+    assert summary['TotalETLsProcessed'] == 1
+    assert summary['StdDevETLMB'] is None and summary['AvgETLMBLower'] is None and summary['AvgETLMBUpper'] is None
+
+
+def test_stats_writer_rejects_nan(local_engine):
+    writer = local_engine.statsWriter(recordingSink(), output_format='ndjson', flush_bytes=1024)
+    writer.open()
+    with pytest.raises(ValueError):
+        writer.write({'FeedName': 'feed000', 'SourceName': 'source000', 'SummaryStatistics': {'StdDevETLMB': float('nan')}})
+
+
+def test_throttling_is_detected_by_status_not_by_path(local_engine):
+    class responseError(IOError):
+        def __init__(self, status_code):
+            IOError.__init__(self, 'Data-lake REST exception: LISTSTATUS, prod/feeds/source000')
+            self.response = type('response', (), {'status_code': status_code})()
+    assert local_engine.is_throttling_error(responseError(429))
+    assert local_engine.is_throttling_error(local_engine.httpStatusError('throttled', 503))
+    assert not local_engine.is_throttling_error(responseError(404))
+    assert not local_engine.is_throttling_error(FileNotFoundError('prod/feeds/source503/feed001'))
+    assert not local_engine.is_throttling_error(ValueError('Throttled 429'))
+
+
+def test_transient_errors_are_classified_by_type_and_status(local_engine):
+    assert local_engine.is_transient_error(local_engine.httpStatusError('bad gateway', 502))
+    assert local_engine.is_transient_error(TimeoutError('read timed out'))
+    assert local_engine.is_transient_error(local_engine.circuitOpenError('adls circuit open'))
+    assert not local_engine.is_transient_error(ValueError('prod/feeds/source000/feed000/etldate=2026-10-01/part-00500.parquet'))
+    assert not local_engine.is_transient_error(local_engine.httpStatusError('forbidden', 403))
+    assert not local_engine.is_transient_error(FileNotFoundError('prod/feeds/Connection/feed504'))
+
+
+def test_ls_rate_set_after_import_applies(local_engine, monkeypatch):
+    monkeypatch.setattr(local_engine, 'MAX_LS_CALLS_PER_SECOND', 20)
+    fs = local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=1, etls_per_feed=3, files_per_etl=2, seed=0)
+    local_engine.process_feed_list(fs.get_feed_paths(), adl=fs)
+    assert local_engine.ls_rate_limiter.interval == pytest.approx(1/20)
+
+
+def test_each_crawl_gets_callers_with_the_current_settings(local_engine, monkeypatch):
+    monkeypatch.setattr(local_engine, 'USE_ADAPTIVE_CONCURRENCY', True)
+    monkeypatch.setattr(local_engine, 'CIRCUIT_FAILURE_THRESHOLD', 3)
+    monkeypatch.setattr(local_engine, 'ADAPTIVE_MAX_CONCURRENCY', 4)
+    caller = local_engine.new_adls_caller(16)
+    assert caller.breaker.failure_threshold == 3 and caller.limiter.limit == 4
+    assert local_engine.new_adls_caller(16).breaker is not caller.breaker
+
+
+def test_feed_deadline_bounds_retries_and_open_circuit_waits(local_engine, monkeypatch):
+    monkeypatch.setattr(local_engine, 'RETRY_BASE_SECONDS', 10)
+    class unavailableFileSystem:
+        def ls(self, path, detail=False):
+            raise local_engine.httpStatusError('HTTP 503 Service Unavailable', 503)
+    caller = local_engine.resilientCaller('adls', local_engine.circuitBreaker('adls', failure_threshold=1, reset_seconds=60))
+    start_time = local_engine.time.time()
+    with pytest.raises(local_engine.httpStatusError):
+        local_engine.compute_feed_stats('prod/feeds/source000/feed000', deadline=start_time + 0.5,
+                                        adl=unavailableFileSystem(), caller=caller)
+    assert local_engine.time.time() - start_time < 0.5
+
+
+class touchedFileSystem:
+    # Serves fs's listings with one ETL directory's modificationTime moved forward
+    def __init__(self, fs, touched_etl):
+        self.fs = fs
+        self.touched_etl = touched_etl
+        self.listed = []
+    def ls(self, path, detail=False):
+        self.listed.append(path)
+        entries = self.fs.ls(path, detail=True)
+        for entry in entries:
+            if entry['name'] == self.touched_etl: entry['modificationTime'] += 1000
+        return entries if detail else [entry['name'] for entry in entries]
+
+
+def test_etl_cache_reuses_unchanged_etls_and_relists_changed_ones(local_engine, monkeypatch, tmp_path):
+    monkeypatch.setattr(local_engine, 'SAMPLE_PERC', 1)
+    fs = local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=1, etls_per_feed=3, files_per_etl=2, seed=0)
+    feed_path = fs.get_feed_paths()[0]
+    etl_cache = local_engine.etlListingCache(str(tmp_path / 'etl_cache.json'))
+    first_run = local_engine.compute_feed_stats(feed_path, adl=fs, etl_cache=etl_cache)
+    etl_paths = fs.ls(feed_path)
+
+    unchanged = touchedFileSystem(fs, None)
+    assert local_engine.compute_feed_stats(feed_path, adl=unchanged, etl_cache=etl_cache) == first_run
+    assert unchanged.listed == [feed_path]
+
+    changed = touchedFileSystem(fs, etl_paths[1])
+    assert local_engine.compute_feed_stats(feed_path, adl=changed, etl_cache=etl_cache) == first_run
+    assert changed.listed == [feed_path, etl_paths[1]]
+
+
+def test_etl_cache_does_not_grow_the_stratified_sample(local_engine, monkeypatch, tmp_path):
+    monkeypatch.setattr(local_engine, 'SAMPLING_MODE', 'stratified')
+    monkeypatch.setattr(local_engine, 'ETL_LISTING_BUDGET', 4)
+    monkeypatch.setattr(local_engine, 'CI_RELATIVE_HALF_WIDTH', 0)
+    fs = local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=1, etls_per_feed=20, files_per_etl=2, seed=0)
+    etl_cache = local_engine.etlListingCache(str(tmp_path / 'etl_cache.json'))
+    for run in range(3):
+        feed_info = local_engine.compute_feed_stats(fs.get_feed_paths()[0], adl=fs, etl_cache=etl_cache)
+        assert feed_info['SummaryStatistics']['TotalETLsProcessed'] == 4
+    assert etl_cache.hits + etl_cache.misses == 3*4
+
+
+def test_stratified_order_reports_latest_first_and_spreads_every_prefix(local_engine):
+    fs = local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=1, etls_per_feed=20, files_per_etl=2, seed=0)
+    etl_dirs_df = local_engine.pd.DataFrame(fs.ls(fs.get_feed_paths()[0], detail=True))
+    order = local_engine.order_etls_stratified(etl_dirs_df)['name'].tolist()
+    by_age = etl_dirs_df.sort_values(by='modificationTime', ascending=False)['name'].tolist()
+    assert sorted(order) == sorted(by_age)
+    assert order[0] == by_age[0]
+    # the other 19 ETLs fall into SAMPLING_STRATA strata of 4, 4, 4, 4 and 3 by age
+    strata = local_engine.np.array_split(by_age[:0:-1], local_engine.SAMPLING_STRATA)
+    stratum_of = {etl: stratum_num for stratum_num, stratum in enumerate(strata) for etl in stratum}
+    for round_start in range(1, 16, local_engine.SAMPLING_STRATA):
+        assert sorted(stratum_of[etl] for etl in order[round_start:round_start+local_engine.SAMPLING_STRATA]) == list(range(5))
+
+
+def test_stratified_sampling_stops_early_or_at_the_listing_budget(local_engine, monkeypatch):
+    monkeypatch.setattr(local_engine, 'SAMPLING_MODE', 'stratified')
+    monkeypatch.setattr(local_engine, 'ETL_LISTING_BUDGET', 12)
+    fs = local_engine.syntheticFileSystem(num_sources=1, feeds_per_source=1, etls_per_feed=40, files_per_etl=2, seed=0)
+    feed_path = fs.get_feed_paths()[0]
+
+    monkeypatch.setattr(local_engine, 'CI_RELATIVE_HALF_WIDTH', 100)
+    summary = local_engine.compute_feed_stats(feed_path, adl=fs)['SummaryStatistics']
+    assert summary['TotalETLsProcessed'] == local_engine.MIN_ETL_SAMPLES
+    assert fs.ls_calls == 1 + local_engine.MIN_ETL_SAMPLES
+
+    fs.ls_calls = 0
+    monkeypatch.setattr(local_engine, 'CI_RELATIVE_HALF_WIDTH', 0)
+    summary = local_engine.compute_feed_stats(feed_path, adl=fs)['SummaryStatistics']
+    assert summary['TotalETLsProcessed'] == 12
+    assert summary['ETLsInFeed'] == 40
+    assert fs.ls_calls == 1 + 12
+
+
+def test_confidence_interval_uses_the_finite_population_correction(local_engine):
+    feed_stats = local_engine.feedStatsAccumulator(0)
+    for etl_num, size in enumerate([2e6, 4e6, 6e6, 8e6]):
+        feed_stats.add({'FileSize': size, 'ETL': str(etl_num), 'ModificationTime': None})
+    standard_error = feed_stats.std()/2
+    assert feed_stats.std() == pytest.approx(2581988.897, rel=1e-9)
+    assert feed_stats.mean_confidence_interval() == pytest.approx((5e6 - 1.96*standard_error, 5e6 + 1.96*standard_error))
+    lower, upper = feed_stats.mean_confidence_interval(population_size=10)
+    assert (upper - lower)/2 == pytest.approx(1.96*standard_error*(6/9)**0.5)
+    assert feed_stats.mean_confidence_interval(population_size=4) == pytest.approx((5e6, 5e6))
+    summary = feed_stats.to_summary_dict(10)
+    assert summary['AvgETLMBLower'] == pytest.approx(lower/1e6) and summary['AvgETLMBUpper'] == pytest.approx(upper/1e6)
+
+
+def test_anomaly_detector_flags_a_known_spike_and_a_missing_partition(local_engine, tmp_path):
+    detector = local_engine.feedAnomalyDetector(str(tmp_path / 'anomaly_state.json'), 0.1)
+    def observe(process_date, latest_etl_mb, last_updated):
+        return detector.observe({'SourceName': 'source000', 'FeedName': 'feed000',
+                                 'SummaryStatistics': {'LatestETLMB': latest_etl_mb, 'Last24HrsETLMB': latest_etl_mb,
+                                                       'LastUpdated': last_updated, 'ProcessDate': process_date}})
+    for day in range(1, local_engine.ANOMALY_MIN_RUNS + 2):
+        assert observe('2026-09-%02d' % day, 100.0 + day % 3, '2026-09-%02d' % day) == []
+    spike_day = '2026-09-%02d' % (local_engine.ANOMALY_MIN_RUNS + 2)
+    anomalies = observe(spike_day, 1000.0, spike_day)
+    assert sorted(anomaly['Metric'] for anomaly in anomalies) == ['Last24HrsETLMB', 'LatestETLMB']
+    assert all(anomaly['Type'] == 'SizeDeviation' and anomaly['ZScore'] > local_engine.ANOMALY_Z_THRESHOLD for anomaly in anomalies)
+    # the same day rerun without its new partition
+    anomalies = observe(spike_day, 101.0, '2026-09-%02d' % (local_engine.ANOMALY_MIN_RUNS + 1))
+    assert [anomaly['Type'] for anomaly in anomalies] == ['MissingPartition']
+
+
+class processKilled(BaseException):
+    pass
+
+
+def test_killed_run_resumes_from_its_checkpoint(local_engine, monkeypatch, tmp_path):
+    monkeypatch.setattr(local_engine, 'USE_CHECKPOINT', True)
+    monkeypatch.setattr(local_engine, 'CHECKPOINT_PATH', str(tmp_path / 'stats_checkpoint.ndjson'))
+    monkeypatch.setattr(local_engine, 'SAMPLE_PERC', 1)
+    fs = local_engine.syntheticFileSystem(num_sources=2, feeds_per_source=3, etls_per_feed=3, files_per_etl=2, seed=0)
+    feed_paths = fs.get_feed_paths()
+    class killedFileSystem:
+        # Lists like fs until the crawl reaches feed_paths[3], then kills the run
+        def ls(self, path, detail=False):
+            if path == feed_paths[3]: raise processKilled()
+            return fs.ls(path, detail)
+    with pytest.raises(processKilled):
+        local_engine.process_feed_list(feed_paths, adl=killedFileSystem())
+    with open(local_engine.CHECKPOINT_PATH) as checkpoint_file:
+        assert len([line for line in checkpoint_file.read().splitlines() if line]) == 3
+
+    # a new process starts with a new stats writer and lists only the feeds not checkpointed
+    monkeypatch.setattr(local_engine, 'stats_writer', None)
+    fs.ls_calls = 0
+    local_engine.process_feed_list(feed_paths, adl=fs)
+    assert fs.ls_calls == 3*(1 + 3)
+    # every feed key once, duplicates included
+    with open(tmp_path / local_engine.STATS_FILE_NAME) as stats_file:
+        keys = json.load(stats_file, object_pairs_hook=lambda pairs: [key for key, value in pairs])
+    assert sorted(key for key in keys if '/' in key) == sorted(path.split('/', 2)[2] for path in feed_paths)
+    assert not (tmp_path / 'stats_checkpoint.ndjson').exists()
@@ -0,0 +1,39 @@
+import datetime
+import pytest
+pytest.importorskip('pyarrow')
+from feed_stats_history import feedStatsHistory
+
+
+def feed_record(feed_name, process_date, latest_etl_mb, avg_etl_mb=None):
+    return {'SourceName': 'source000', 'FeedName': feed_name,
+            'SummaryStatistics': {'TotalETLsProcessed': 3, 'AvgETLMB': latest_etl_mb if avg_etl_mb is None else avg_etl_mb,
+                                  'LatestETLMB': latest_etl_mb, 'LastUpdated': process_date, 'ProcessDate': process_date}}
+
+
+def days(count, start='2026-09-01'):
+    first_day = datetime.date.fromisoformat(start)
+    return [(first_day + datetime.timedelta(days=day)).isoformat() for day in range(count)]
+
+
+def test_anomalies_flag_a_known_spike(tmp_path):
+    history = feedStatsHistory(str(tmp_path / 'history'))
+    for day_num, process_date in enumerate(days(11)):
+        spike = process_date == '2026-09-11'
+        history.append([feed_record('feed000', process_date, 5000.0 if spike else 100.0 + day_num % 3),
+                        feed_record('feed001', process_date, 50.0 + day_num % 3)])
+    anomalies_df = history.anomalies('2026-09-11')
+    assert anomalies_df['FeedName'].tolist() == ['feed000']
+    assert anomalies_df['Value'][0] == 5000.0 and anomalies_df['BaselineMedian'][0] == 101.0
+    assert anomalies_df['RobustZ'][0] == pytest.approx((5000.0 - 101.0)/1.4826)
+
+
+def test_growth_rates_recover_a_known_slope(tmp_path):
+    history = feedStatsHistory(str(tmp_path / 'history'))
+    for day_num, process_date in enumerate(days(10)):
+        history.append([feed_record('feed000', process_date, 0.0, avg_etl_mb=40.0 + 2.5*day_num),
+                        feed_record('feed001', process_date, 0.0, avg_etl_mb=80.0)])
+    growth_df = history.growth_rates('2026-09-01', '2026-09-10').set_index('FeedName')
+    assert growth_df.loc['feed000', 'SlopePerDay'] == pytest.approx(2.5)
+    assert growth_df.loc['feed000', 'RelativeChange'] == pytest.approx(22.5/40.0)
+    assert growth_df.loc['feed001', 'SlopePerDay'] == 0
+    assert growth_df.loc['feed000', 'Days'] == 10
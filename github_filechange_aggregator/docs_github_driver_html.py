@@ -1,6 +1,7 @@
 from docs_github_wrapper_html import *
 import calendar
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Please create a Personal Access Token in GitHub
 # https://help.github.com/en/articles/creating-a-personal-access-token-for-the-command-line
@@ -19,24 +20,31 @@ f = open("access_token.config", "r")
 access_token = f.readline().strip()
 
 digest_modes = ['bodyText']
-
-for digest_mode in digest_modes:
-
-    print("Digest mode: "+digest_mode)
-
-    for svc in svcs:
-        print("Getting PRs for svc:{} between:{} and:{}".format(svc,begin_date,end_date))
-        html_driver = docs_github_wrapper_html(access_token, begin_date, end_date, svc)
-        #html_driver.set_contributors_ignore(contributors_ignore_list)
-        svc_private_prs = html_driver.get_label_query(private_repo)
-        svc_public_prs = html_driver.get_label_query(public_repo)
-
-        pr_numbers_in_range = html_driver.extract_pr_numbers(html_driver.call_github_api_iter([svc_private_prs]))
-        public_pr_numbers_in_range = html_driver.extract_pr_numbers(html_driver.call_github_api_iter([svc_public_prs]))
-        print("{} public PRs returned, {} private PRs returned".format(len(public_pr_numbers_in_range), len(pr_numbers_in_range)))
-        all_pr_data = html_driver.get_pr_data_v4(pr_numbers_in_range, private_repo)
-        all_pr_data += html_driver.get_pr_data_v4(public_pr_numbers_in_range, public_repo)
-
-        print("Outputting to html...")
-        html_driver.aggregate_sort_pr_data(all_pr_data,description_field=digest_mode)
-        html_driver.html_table(digest_mode)
+max_parallel_fetches = 4
+
+def fetch_repo_pr_data(svc_driver, repo):
+    # only PRs merged since the PR store was last synced are fetched from GitHub
+    repo_pr_data = svc_driver.get_service_pr_data(repo)
+    print("{} {} PRs returned for svc:{}".format(len(repo_pr_data), repo, svc_driver.service))
+    return repo_pr_data
+
+def output_service_reports(svc_driver, svc_pr_data):
+    # Every digest mode is rendered from the same PR data; only the description field differs
+    for digest_mode in digest_modes:
+        print("Outputting {} to html, digest mode: {}".format(svc_driver.service, digest_mode))
+        svc_driver.aggregate_sort_pr_data(svc_pr_data,description_field=digest_mode)
+        svc_driver.html_table(digest_mode, "_"+digest_mode if len(digest_modes) > 1 else "")
+
+html_driver = docs_github_wrapper_html(access_token, begin_date, end_date, svcs[0])
+#html_driver.set_contributors_ignore(contributors_ignore_list)
+svc_drivers = {svc: html_driver.for_service(svc) for svc in svcs}
+
+# Fetch the PRs of every service from both repos at once
+print("Getting PRs for svcs:{} between:{} and:{}".format(svcs,begin_date,end_date))
+with ThreadPoolExecutor(max_workers=max_parallel_fetches) as executor:
+    pr_data_futures = {(svc, repo): executor.submit(fetch_repo_pr_data, svc_drivers[svc], repo) for svc in svcs for repo in [private_repo, public_repo]}
+    all_pr_data = {svc: pr_data_futures[(svc, private_repo)].result() + pr_data_futures[(svc, public_repo)].result() for svc in svcs}
+
+with ThreadPoolExecutor(max_workers=max_parallel_fetches) as executor:
+    for report in [executor.submit(output_service_reports, svc_drivers[svc], all_pr_data[svc]) for svc in svcs]:
+        report.result()
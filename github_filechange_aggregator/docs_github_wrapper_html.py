@@ -1,10 +1,71 @@
 import requests
 import json
-from lxml import html
+from html.parser import HTMLParser
 import datetime
 from datetime import datetime
+from datetime import timedelta
 import calendar
 import sys
+import os
+import codecs
+import copy
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http_response_cache import http_response_cache
+from pr_store import pr_store
+
+class doc_title_parser(HTMLParser):
+    # Collects the text of the first <h1>; fed the page a chunk at a time until done is set
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.in_h1 = False
+        self.done = False
+        self.title_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'h1' and not self.done:
+            self.in_h1 = True
+
+    def handle_endtag(self, tag):
+        if tag == 'h1' and self.in_h1:
+            self.in_h1 = False
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_h1:
+            self.title_parts.append(data)
+
+    def get_title(self):
+        return " ".join("".join(self.title_parts).split())
+
+class graphql_budget:
+    # The hourly GraphQL rate limit budget of a token, as last reported by GitHub. One is shared by
+    # every wrapper made with for_service, since their queries all draw on the same budget
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.remaining = None
+        self.reset_at = None
+
+    def update(self, rate_limit):
+        if not rate_limit:
+            return
+        with self.lock:
+            self.remaining = rate_limit['remaining']
+            self.reset_at = datetime.strptime(rate_limit['resetAt'],'%Y-%m-%dT%H:%M:%SZ')
+
+    def wait(self, min_remaining):
+        # Holds new queries until the budget resets once it drops below min_remaining
+        with self.lock:
+            if self.remaining is None or self.remaining >= min_remaining:
+                return
+            wait_seconds = (self.reset_at - datetime.utcnow()).total_seconds() + 1
+            if wait_seconds > 0:
+                print("GraphQL rate limit budget low ({} points left), waiting {:.0f}s for reset".format(self.remaining, wait_seconds))
+                time.sleep(wait_seconds)
+            self.remaining = None
 
 class docs_github_wrapper_html:
 
@@ -20,6 +81,29 @@ class docs_github_wrapper_html:
     sorted_update_list = []
     sorted_new_list = []
     sorted_contributor_list = []
+    graphql_url = 'https://api.github.com/graphql'
+    graphql_batch_size = 25
+    graphql_files_page_size = 100
+    graphql_max_workers = 4
+    graphql_min_remaining = 100
+    http_pool_size = 16
+    use_cache = True
+    cache_path = "github_http_cache.sqlite"
+    search_cache_ttl = 60*60
+    commits_cache_ttl = 60*60*24
+    pr_cache_ttl = 60*60*24*7
+    doc_title_cache_ttl = 60*60*24*7
+    history_batch_size = 50
+    first_commit_index_path = "first_commit_index.json"
+    doc_title_workers = 8
+    doc_title_chunk_size = 8192
+    doc_title_timeout = 30
+    doc_title_cache_path = "doc_title_cache.json"
+    use_pr_store = True
+    search_result_cap = 1000
+    search_page_size = 100
+    search_max_workers = 4
+    pr_store_path = "github_pr_store.sqlite"
 
     def __init__(self,newtoken,begindate,enddate,svc):
         self.patoken = newtoken
@@ -27,130 +111,399 @@ class docs_github_wrapper_html:
         self.end_date = enddate
         self.service = svc
         self.top_contributors = {}
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.http_pool_size, pool_maxsize=self.http_pool_size)
+        self.session.mount('https://', adapter)
+        self.graphql_budget = graphql_budget()
+        self.cache = http_response_cache(self.cache_path) if self.use_cache else None
+        self.first_commit_index = None
+        self.first_commit_lock = threading.Lock()
+        self.doc_titles = None
+        self.doc_titles_lock = threading.Lock()
+        self.pr_store = pr_store(self.pr_store_path) if self.use_pr_store else None
     
     def set_contributors_ignore(self,contrib_ignore):
         self.contributors_ignore = contrib_ignore
+
+    def for_service(self, svc):
+        # A wrapper for another service over the same dates that shares this one's session, HTTP
+        # cache, GraphQL budget, doc title cache and first-commit index, so reports can be built side by side
+        self.load_doc_titles()
+        self.load_first_commit_index()
+        svc_wrapper = copy.copy(self)
+        svc_wrapper.service = svc
+        svc_wrapper.top_contributors = {}
+        svc_wrapper.sorted_update_list = []
+        svc_wrapper.sorted_new_list = []
+        svc_wrapper.sorted_contributor_list = []
+        return svc_wrapper
     
-    def call_github_api_iter(self, api_urls):
-        
+    def http_get(self, url, headers=None, ttl=0, **kwargs):
+        if self.cache is None:
+            return self.session.get(url, headers=headers, **kwargs)
+        return self.cache.get(self.session, url, headers, ttl, **kwargs)
+
+    def graphql_post(self, query, ttl=0):
+        headers = {'Authorization': 'token ' + self.patoken}
+        if self.cache is None:
+            return self.session.post(url=self.graphql_url, json={'query': query}, headers=headers)
+        return self.cache.post_json(self.session, self.graphql_url, {'query': query}, headers, ttl)
+
+    def get_search_page(self, url):
+        # One page of search results as json, or None if it could not be fetched. The search API allows
+        # 30 requests a minute; when it is used up, waits for the reset and tries again
         headers1 = {'Authorization': 'token ' + self.patoken, 'Accept': 'application/vnd.github.symmetra-preview+json'}
-        json_data_array = []
-        
-        for api_url in api_urls:  
+        while True:
+            response = self.http_get(url, headers1, self.search_cache_ttl)
+            if response.status_code in (403, 429) and 'Retry-After' in response.headers:
+                time.sleep(int(response.headers['Retry-After']))
+                continue
+            if response.status_code in (403, 429) and response.headers.get('X-RateLimit-Remaining') == '0':
+                time.sleep(max(int(response.headers.get('X-RateLimit-Reset', time.time() + 60)) - time.time(), 0) + 1)
+                continue
+            if response.status_code != 200:
+                print("Search failed with status {}: {}".format(response.status_code, url))
+                return None
+            json_response = response.json()
+            if json_response.get('incomplete_results'):
+                print("Search timed out and returned incomplete results: {}".format(url))
+            return json_response
+
+    def search_pr_numbers(self, make_query, begin_date, end_date):
+        # GitHub search returns at most search_result_cap results per query, so the merged date range is
+        # split into sub-windows until each one's total_count is under the cap. make_query(begin, end)
+        # returns the search url for one window. Windows are searched search_max_workers at a time and
+        # the PR numbers are deduped. Returns the PR numbers and whether every result was retrieved
+        windows = [(begin_date, end_date)]
+        shards = []
+        complete = True
+        with ThreadPoolExecutor(max_workers=self.search_max_workers) as executor:
+            while len(windows) > 0:
+                first_pages = executor.map(lambda window: self.get_search_page(make_query(*window) + "&per_page=%d" % self.search_page_size), windows)
+                split_windows = []
+                for (window_begin, window_end), first_page in zip(windows, first_pages):
+                    if first_page is None:
+                        complete = False
+                        continue
+                    total_count = first_page['total_count']
+                    window_begin_date = datetime.strptime(window_begin, '%Y-%m-%d')
+                    window_days = (datetime.strptime(window_end, '%Y-%m-%d') - window_begin_date).days + 1
+                    if total_count > self.search_result_cap and window_days > 1:
+                        # split into as many windows as the count needs, at least two
+                        num_windows = min(window_days, max(2, -(-total_count//self.search_result_cap)))
+                        for i in range(num_windows):
+                            split_windows.append(((window_begin_date + timedelta(days=i*window_days//num_windows)).strftime('%Y-%m-%d'),
+                                                  (window_begin_date + timedelta(days=(i+1)*window_days//num_windows - 1)).strftime('%Y-%m-%d')))
+                        continue
+                    if total_count > self.search_result_cap:
+                        print("{} PRs merged on {} but search returns only {}, the rest are missing".format(total_count, window_begin, self.search_result_cap))
+                    shards.append(((window_begin, window_end), total_count, first_page))
+                windows = split_windows
+            
+            page_urls = []
+            for (window_begin, window_end), total_count, first_page in shards:
+                num_pages = -(-min(total_count, self.search_result_cap)//self.search_page_size)
+                for page in range(2, num_pages + 1):
+                    page_urls.append(make_query(window_begin, window_end) + "&per_page=%d&page=%d" % (self.search_page_size, page))
+            pages = [first_page for window, total_count, first_page in shards] + list(executor.map(self.get_search_page, page_urls))
         
-            current_response = requests.get(url=api_url, headers=headers1)
+        if None in pages or any(page.get('incomplete_results') for page in pages if page is not None):
+            complete = False
+        pr_numbers = self.extract_pr_numbers([page for page in pages if page is not None])
+        pr_numbers = list(dict.fromkeys(pr_numbers))
+        expected_total = sum(total_count for window, total_count, first_page in shards)
+        print("{} PRs found in {} search windows between {} and {}, total_count {}".format(len(pr_numbers), len(shards), begin_date, end_date, expected_total))
+        if len(pr_numbers) < expected_total:
+            print("{} PRs could not be retrieved from search".format(expected_total - len(pr_numbers)))
+            complete = False
+        return pr_numbers, complete
 
-            json_data_array.append(current_response.json())
+    def fetch_doc_title(self, url):
+        # Streams the page and stops reading at the end of the first <h1>. Returns None when the
+        # page could not be fetched, so the failure is not cached and the next report tries again
+        try:
+            page = self.session.get(url, allow_redirects=False, stream=True, timeout=self.doc_title_timeout)
+            try:
+                if page.status_code == requests.codes.ok:
+                    parser = doc_title_parser()
+                    decoder = codecs.getincrementaldecoder(page.encoding or 'utf-8')(errors='replace')
+                    for chunk in page.iter_content(chunk_size=self.doc_title_chunk_size):
+                        parser.feed(decoder.decode(chunk))
+                        if parser.done:
+                            break
+                    return parser.get_title().replace("'","")
+                elif page.status_code == requests.codes.moved_permanently:
+                    doc_title = "[PERMANENTLY REDIRECTING] " + url
+                    return doc_title
+                elif page.status_code == requests.codes.not_found:
+                    doc_title = "[PERMANENTLY REDIRECTING] " + url
+                    return doc_title
+                print("Could not get the doc title of {}: status {}".format(url, page.status_code))
+                return None
+            finally:
+                page.close()
+        except requests.exceptions.RequestException as e:
+            print("Could not get the doc title of {}: {}".format(url, e))
+            return None
 
-            if len(json_data_array) > 10:
-                return (json_data_array)
+    def load_doc_titles(self):
+        # url -> [title, fetched time], persisted in doc_title_cache_path between runs
+        with self.doc_titles_lock:
+            if self.doc_titles is None:
+                self.doc_titles = {}
+                if os.path.exists(self.doc_title_cache_path):
+                    with open(self.doc_title_cache_path, "r") as title_file:
+                        self.doc_titles = json.load(title_file)
+            return self.doc_titles
 
-            while 'next' in current_response.links.keys():
-                current_response = requests.get(url=current_response.links['next']['url'], headers=headers1)
-                json_data_array.append(current_response.json())
-        
-        return (json_data_array)
+    def save_doc_titles(self):
+        with self.doc_titles_lock:
+            temp_path = self.doc_title_cache_path + ".tmp"
+            with open(temp_path, "w") as title_file:
+                json.dump(self.doc_titles, title_file)
+            os.replace(temp_path, self.doc_title_cache_path)
+
+    def resolve_doc_titles(self, urls):
+        # Returns url -> doc title for every url, fetching each distinct url not resolved within
+        # doc_title_cache_ttl once, doc_title_workers at a time. Only fetched titles are cached; a url
+        # whose fetch failed keeps its expired title, or shows as unavailable if it has none
+        doc_titles = self.load_doc_titles()
+        now = time.time()
+        urls_to_fetch = [url for url in set(urls) if url not in doc_titles or doc_titles[url][0] is None or now - doc_titles[url][1] > self.doc_title_cache_ttl]
+        if len(urls_to_fetch) > 0:
+            with ThreadPoolExecutor(max_workers=self.doc_title_workers) as executor:
+                for url, doc_title in zip(urls_to_fetch, executor.map(self.fetch_doc_title, urls_to_fetch)):
+                    if doc_title is None:
+                        continue
+                    with self.doc_titles_lock:
+                        doc_titles[url] = [doc_title, now]
+            self.save_doc_titles()
+        return {url: doc_titles[url][0] if doc_titles.get(url, [None])[0] is not None else "[TITLE UNAVAILABLE] " + url for url in urls}
 
-    def get_doc_title_path(self, file_path):
-        shortened_path = file_path[file_path.find("articles/")+9:file_path.find(".md")]
-        url = "https://docs.microsoft.com/en-us/azure/"+shortened_path
-        page = requests.get(url, allow_redirects=False)
-        if page.status_code == requests.codes.ok:
-            tree = html.fromstring(page.content)
-            doc_title = tree.xpath('//h1/text()')
-            return doc_title[0].replace("'","")
-        elif page.status_code == requests.codes.moved_permanently:
-            doc_title = "[PERMANENTLY REDIRECTING] " + url
-            return doc_title
-        elif page.status_code == requests.codes.not_found:
-            doc_title = "[PERMANENTLY REDIRECTING] " + url
-            return doc_title   
-
-    def get_doc_title_url(self, url):
-        page = requests.get(url, allow_redirects=False)
-        if page.status_code == requests.codes.ok:
-            tree = html.fromstring(page.content)
-            doc_title = tree.xpath('//h1/text()')
-            return doc_title[0].replace("'","")
-        elif page.status_code == requests.codes.moved_permanently:
-            doc_title = "[PERMANENTLY REDIRECTING] " + url
-            return doc_title
-        elif page.status_code == requests.codes.not_found:
-            doc_title = "[PERMANENTLY REDIRECTING] " + url
-            return doc_title   
-
-    def output_docs_link(self, file_path):
-        shortened_path = file_path[file_path.find("articles/")+9:file_path.find(".md")]
-        url = "https://docs.microsoft.com/en-us/azure/"+shortened_path
-        return('<a href="{}">{}</a>'.format(url, self.get_doc_title_url(url)))
-        
     def output_docs_url(self, file_path):
         shortened_path = file_path[file_path.find("articles/")+9:file_path.find(".md")]
         return "https://docs.microsoft.com/en-us/azure/"+shortened_path
             
-    def get_author_query(self, repo, author):
-        author_prs = 'https://api.github.com/search/issues?q=repo:MicrosoftDocs/{} type:pr author:{} is:merged merged:{}..{}'.format(repo, author, self.begin_date, self.end_date)
+    def get_author_query(self, repo, author, begin_date=None, end_date=None):
+        author_prs = 'https://api.github.com/search/issues?q=repo:MicrosoftDocs/{} type:pr author:{} is:merged merged:{}..{}'.format(repo, author, begin_date or self.begin_date, end_date or self.end_date)
         return author_prs
         
-    def get_label_query(self, repo):
-        svc_prs = 'https://api.github.com/search/issues?q=repo:MicrosoftDocs/{} type:pr label:{}/svc is:merged merged:{}..{}'.format(repo, self.service, self.begin_date, self.end_date)
+    def get_label_query(self, repo, begin_date=None, end_date=None, updated_since=None, labelled=True):
+        # with labelled False, the PRs without the service label; with updated_since, only PRs updated since then
+        svc_prs = 'https://api.github.com/search/issues?q=repo:MicrosoftDocs/{} type:pr {}label:{}/svc is:merged merged:{}..{}'.format(repo, '' if labelled else '-', self.service, begin_date or self.begin_date, end_date or self.end_date)
+        if updated_since is not None:
+            svc_prs += ' updated:>={}'.format(updated_since)
         return svc_prs
 
-    def detect_newly_added(self, file_path):
-        headers1 = {'Authorization': 'token ' + self.patoken, 'Accept': 'application/vnd.github.symmetra-preview+json'}
-        json_data_array = []
+    def get_service_pr_data(self, repo):
+        # PR data for this service's PRs in repo merged in the report range. With the PR store, only
+        # merged dates it has not synced are fetched from GitHub and the range is read from the store
+        if self.pr_store is None:
+            pr_numbers, complete = self.search_pr_numbers(lambda begin_date, end_date: self.get_label_query(repo, begin_date, end_date), self.begin_date, self.end_date)
+            return self.get_pr_data_v4(pr_numbers, repo)
+        self.sync_pr_store(repo)
+        return self.pr_store.get_pr_data(repo, self.service, self.begin_date, self.end_date)
 
-        file_commits_query = 'https://api.github.com/repos/MicrosoftDocs/azure-docs-pr/commits?path={}'.format(file_path)
-        current_response = requests.get(url=file_commits_query, headers=headers1)
+    def sync_pr_store(self, repo):
+        # The store keeps one contiguous synced range per service and repo; this extends it to cover
+        # the report range. Today is never marked synced since more PRs can still merge, and a range
+        # in which some PR could not be fetched is left unsynced so the next report retries it
+        one_day = timedelta(days=1)
+        today = datetime.utcnow().strftime('%Y-%m-%d')
+        sync_until = min(self.end_date, today)
+        self.refresh_pr_labels(repo)
+        synced = self.pr_store.get_synced_range(repo, self.service)
+        if synced is None:
+            ranges_to_fetch = [(self.begin_date, sync_until)] if self.begin_date <= sync_until else []
+            synced_from, synced_until = None, None
+        else:
+            synced_from, synced_until = synced
+            ranges_to_fetch = []
+            if self.begin_date < synced_from:
+                ranges_to_fetch.append((self.begin_date, (datetime.strptime(synced_from, '%Y-%m-%d') - one_day).strftime('%Y-%m-%d')))
+            if sync_until > synced_until:
+                ranges_to_fetch.append(((datetime.strptime(synced_until, '%Y-%m-%d') + one_day).strftime('%Y-%m-%d'), sync_until))
+        
+        for range_begin, range_end in ranges_to_fetch:
+            print("Syncing {} PRs for svc:{} merged between:{} and:{}".format(repo, self.service, range_begin, range_end))
+            pr_numbers, complete = self.search_pr_numbers(lambda begin_date, end_date: self.get_label_query(repo, begin_date, end_date), range_begin, range_end)
+            for pr in self.get_pr_data_v4(pr_numbers, repo):
+                pull_request = pr['data']['repository']['pullRequest']
+                if pull_request is None:
+                    complete = False
+                    continue
+                try:
+                    # file pages go into the store as they are fetched
+                    self.pr_store.store_pr(repo, self.service, pull_request, self.iter_pr_files(pull_request, raise_on_error=True))
+                except IOError as e:
+                    # a PR with some of its files missing is not stored
+                    print(e)
+                    complete = False
+            if not complete:
+                print("Not all {} PRs merged between {} and {} could be fetched, the range will be synced again".format(repo, range_begin, range_end))
+                continue
+            if range_end == today:
+                range_end = (datetime.strptime(today, '%Y-%m-%d') - one_day).strftime('%Y-%m-%d')
+            # each range adjoins the synced one, so the union stays contiguous
+            if synced_from is None or range_begin < synced_from:
+                synced_from = range_begin
+            if synced_until is None or range_end > synced_until:
+                synced_until = range_end
+            if synced_from <= synced_until:
+                self.pr_store.set_synced_range(repo, self.service, synced_from, synced_until)
 
-        json_data_array.append(current_response.json())
+    def refresh_pr_labels(self, repo):
+        # A label can be added to or removed from a PR after its merged date was synced. PRs in the synced
+        # range updated since the last refresh are searched with and without the service label and the
+        # store is brought in line; newly labelled PRs it does not have yet are fetched. A store synced
+        # before labels were refreshed takes the service's whole labelled range as its PRs instead
+        refresh_started_at = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+        synced = self.pr_store.get_synced_range(repo, self.service)
+        if synced is None:
+            self.pr_store.set_labels_synced_at(repo, self.service, refresh_started_at)
+            return
+        synced_from, synced_until = synced
+        labels_synced_at = self.pr_store.get_labels_synced_at(repo, self.service)
+        labelled, complete = self.search_pr_numbers(lambda begin_date, end_date: self.get_label_query(repo, begin_date, end_date, labels_synced_at), synced_from, synced_until)
+        labelled = set(int(pr_number) for pr_number in labelled)
+        if labels_synced_at is None:
+            unlabelled = self.pr_store.get_service_numbers(repo, self.service, synced_from, synced_until) - labelled if complete else set()
+        else:
+            unlabelled, unlabelled_complete = self.search_pr_numbers(lambda begin_date, end_date: self.get_label_query(repo, begin_date, end_date, labels_synced_at, False), synced_from, synced_until)
+            unlabelled = set(int(pr_number) for pr_number in unlabelled)
+            complete = complete and unlabelled_complete
+        self.pr_store.remove_pr_services(repo, self.service, sorted(unlabelled))
+        stored = self.pr_store.get_stored_numbers(repo, labelled)
+        self.pr_store.add_pr_services(repo, self.service, sorted(stored))
+        for pr in self.get_pr_data_v4(sorted(labelled - stored), repo):
+            pull_request = pr['data']['repository']['pullRequest']
+            if pull_request is None:
+                complete = False
+                continue
+            try:
+                self.pr_store.store_pr(repo, self.service, pull_request, self.iter_pr_files(pull_request, raise_on_error=True))
+            except IOError as e:
+                print(e)
+                complete = False
+        if len(labelled) + len(unlabelled) > 0:
+            print("Refreshed the svc:{} label on {} {} PRs".format(self.service, len(labelled) + len(unlabelled), repo))
+        if complete:
+            self.pr_store.set_labels_synced_at(repo, self.service, refresh_started_at)
+        else:
+            print("Not all {} PRs whose labels changed could be fetched, their labels will be refreshed again".format(repo))
 
-        if len(json_data_array) > 10:
-            print("json array larger than 10")
-            return (json_data_array)
+    def load_first_commit_index(self):
+        # "repo/path" -> [date, exact]: exact dates come from the PR that ADDED the file, inexact ones
+        # are a commit known to predate the first report that looked the file up
+        with self.first_commit_lock:
+            if self.first_commit_index is None:
+                self.first_commit_index = {}
+                if os.path.exists(self.first_commit_index_path):
+                    with open(self.first_commit_index_path, "r") as index_file:
+                        self.first_commit_index = json.load(index_file)
+            return self.first_commit_index
 
-        while 'next' in current_response.links.keys():
-            current_response = requests.get(url=current_response.links['next']['url'], headers=headers1)
-            json_data_array.append(current_response.json())
+    def save_first_commit_index(self):
+        with self.first_commit_lock:
+            temp_path = self.first_commit_index_path + ".tmp"
+            with open(temp_path, "w") as index_file:
+                json.dump(self.first_commit_index, index_file)
+            os.replace(temp_path, self.first_commit_index_path)
 
-        try:
-            #print("Size of json array: "+str(len(json_data_array)))
-            if len(json_data_array)>0:
-                #print("Size of last json array: "+str(len(json_data_array[-1])))
-                if len(json_data_array[-1]) > 0:
-                    #print("Size of last last json array: "+str(len(json_data_array[-1][-1])))
-                    if len(json_data_array[-1][-1]) > 0:
-                        earliest_commit = json_data_array[-1][-1]                 
-                    elif len(json_data_array[-1][-2]) > 0:
-                        earliest_commit = json_data_array[-1][-2]
-                    else:
-                        print("Couldn't get last commit")
-                        return 0
-                    json_obj = json.loads(json.dumps(earliest_commit))
-                    earliest_date = json_obj['commit']['committer']['date']
-                    earliest_date_obj = datetime.strptime(earliest_date,'%Y-%m-%dT%H:%M:%SZ') 
-                    if(earliest_date_obj>=datetime.strptime(self.begin_date,'%Y-%m-%d') and earliest_date_obj<=datetime.strptime(self.end_date,'%Y-%m-%d')):
-                        #print("File: "+file_path+" - Newly Added")
-                        return 1
-                    else:
-                        #print("File: "+file_path+" - Updated")
-                        return 0      
-                else:
-                    print("File: "+file_path)
-                    print("Size of last json array is zero")
-                    #print(json_data_array)
-            else:
-                print("File: "+file_path)
-                print("Size of json response is zero")
-                #print(json_data_array)
-            return 0
-        except Exception as e:
-            print("File: "+file_path+" - Could not get earliest commit")
-            print(e)
+    def record_first_commit(self, repo, file_path, commit_date, exact):
+        index = self.load_first_commit_index()
+        with self.first_commit_lock:
+            known = index.get(repo + "/" + file_path)
+            if known is None or (exact and not known[1]) or (exact == known[1] and commit_date < known[0]):
+                index[repo + "/" + file_path] = [commit_date, exact]
+
+    def lookup_newly_added(self, repo, file_path):
+        # 1 or 0 when the index settles whether the file was first committed in the report range, else None
+        known = self.load_first_commit_index().get(repo + "/" + file_path)
+        if known is None:
+            return None
+        first_day = known[0][:10]
+        if known[1]:
+            return 1 if self.begin_date <= first_day <= self.end_date else 0
+        if first_day < self.begin_date:
             return 0
+        return None
+
+    def get_history_batch_query(self, file_paths, repo):
+        history_selections = ""
+        for i, file_path in enumerate(file_paths):
+            history_selections += "f%d: history(first: 1, path: %s, until: \"%sT00:00:00Z\"){ nodes { committedDate } }\n" % (i, json.dumps(file_path), self.begin_date)
+        history_query = """query {
+            rateLimit { cost remaining resetAt }
+            repository(owner:"MicrosoftDocs", name: "%s") {
+                defaultBranchRef { target { ... on Commit {
+                    %s
+                } } }
+            }
+        }
+        """ % (repo, history_selections)
+        return history_query
 
+    def get_commit_before_range_batch(self, file_paths, repo):
+        # For each path, the date of its newest commit before begin_date on the default branch, or None
+        self.wait_for_graphql_budget()
+        r = self.graphql_post(self.get_history_batch_query(file_paths, repo), self.commits_cache_ttl)
+        json_string = self.graphql_json(r)
+        if json_string is None:
+            print("GraphQL history query in {} failed with HTTP {}".format(repo, r.status_code))
+            return {}
+        if 'errors' in json_string:
+            print("GraphQL errors getting history in {}: {}".format(repo, json_string['errors']))
+        data = json_string.get('data') or {}
+        if not getattr(r, 'from_cache', False):
+            self.update_graphql_budget(data.get('rateLimit'))
+        target = ((data.get('repository') or {}).get('defaultBranchRef') or {}).get('target') or {}
+        commit_dates = {}
+        for i, file_path in enumerate(file_paths):
+            history = target.get('f%d' % i)
+            if history is None:
+                continue
+            commit_dates[file_path] = history['nodes'][0]['committedDate'] if len(history['nodes']) > 0 else None
+        return commit_dates
 
+    def detect_newly_added_bulk(self, file_info):
+        # Classifies every file in file_info as newly added (1) or updated (0) in the report range:
+        # files ADDED by one of the PRs are new, files the index settles cost nothing, and the rest are
+        # checked with batched history(first: 1, until: begin_date) queries against the file's own repo
+        newly_added = {}
+        paths_to_query = {}
+        for file_path in file_info.keys():
+            repo = file_info[file_path].get("repo", self.private_repo)
+            if file_info[file_path].get("added_in_pr"):
+                newly_added[file_path] = 1
+                continue
+            known = self.lookup_newly_added(repo, file_path)
+            if known is not None:
+                newly_added[file_path] = known
+                continue
+            paths_to_query.setdefault(repo, []).append(file_path)
+        
+        batches = []
+        for repo in paths_to_query.keys():
+            file_paths = paths_to_query[repo]
+            for i in range(0, len(file_paths), self.history_batch_size):
+                batches.append((file_paths[i:i+self.history_batch_size], repo))
         
+        with ThreadPoolExecutor(max_workers=self.graphql_max_workers) as executor:
+            for (file_paths, repo), commit_dates in zip(batches, executor.map(lambda batch: self.get_commit_before_range_batch(*batch), batches)):
+                for file_path in file_paths:
+                    if file_path not in commit_dates:
+                        # the lookup failed, count the file as updated
+                        newly_added[file_path] = 0
+                    elif commit_dates[file_path] is None:
+                        newly_added[file_path] = 1
+                    else:
+                        newly_added[file_path] = 0
+                        self.record_first_commit(repo, file_path, commit_dates[file_path], False)
+        
+        self.save_first_commit_index()
+        return newly_added
+
     def extract_pr_numbers(self, json_response_array):
         pr_list = []
         try:
@@ -174,50 +527,182 @@ class docs_github_wrapper_html:
             return 0
             
     def get_pr_data_v4(self, pr_number_array, repo):
-
-        url = 'https://api.github.com/graphql' 
-        headers = {'Authorization': 'token ' + self.patoken}
+        # Fetches graphql_batch_size PRs per aliased query, graphql_max_workers queries at a time.
+        # Returns one {'data': {'repository': {'pullRequest': ...}}} dict per PR, in input order
+        pr_numbers = [int(pr_number) for pr_number in pr_number_array]
+        batches = [pr_numbers[i:i+self.graphql_batch_size] for i in range(0, len(pr_numbers), self.graphql_batch_size)]
         
         all_pr_data = []
         
-        for pr_number in pr_number_array:
-            pr_files_query = """{repository(owner:"MicrosoftDocs", name: "%s") {
-                pullRequest(number: %d){
-                    author{login}
-                    url
-                    title
-                    bodyText
-                    createdAt
-                    additions
-                    changedFiles
-                    state
-                    publishedAt
-                    number
-                    files(first: 20){
-                    edges{
-                      node{
-                        path
-                        additions
-                        deletions
-                      }
-                    }
-                    }
-                }
-              }
-            }
-            """ % (repo, int(pr_number))
-            json1 = {'query' : '%s' % pr_files_query}
-            r = requests.post(url=url, json=json1, headers=headers)
-            json_string = r.json()        
-            all_pr_data.append(json_string)
+        with ThreadPoolExecutor(max_workers=self.graphql_max_workers) as executor:
+            for batch_pr_data in executor.map(lambda batch: self.get_pr_batch_v4(batch, repo), batches):
+                all_pr_data += batch_pr_data
         
         return(all_pr_data)
+
+    def get_pr_batch_query(self, pr_numbers, repo):
+        pr_selections = ""
+        for i, pr_number in enumerate(pr_numbers):
+            pr_selections += "pr%d: pullRequest(number: %d){ ...prFields }\n" % (i, pr_number)
+        pr_batch_query = """query {
+            rateLimit { cost remaining resetAt }
+            repository(owner:"MicrosoftDocs", name: "%s") {
+                %s
+            }
+        }
+        fragment prFields on PullRequest {
+            author{login}
+            url
+            title
+            bodyText
+            createdAt
+            additions
+            changedFiles
+            state
+            publishedAt
+            mergedAt
+            number
+            files(first: %d){ ...fileFields }
+        }
+        %s
+        """ % (repo, pr_selections, self.graphql_files_page_size, self.files_fragment)
+        return pr_batch_query
+
+    files_fragment = """fragment fileFields on PullRequestChangedFileConnection {
+            pageInfo { hasNextPage endCursor }
+            edges{
+              node{
+                path
+                additions
+                deletions
+                changeType
+              }
+            }
+        }"""
+
+    def get_pr_files_page_query(self, pr_number, repo, cursor):
+        pr_files_query = """query {
+            rateLimit { cost remaining resetAt }
+            repository(owner:"MicrosoftDocs", name: "%s") {
+                pr0: pullRequest(number: %d) { files(first: %d, after: "%s"){ ...fileFields } }
+            }
+        }
+        %s
+        """ % (repo, pr_number, self.graphql_files_page_size, cursor, self.files_fragment)
+        return pr_files_query
+
+    def iter_pr_files(self, pull_request, raise_on_error=False):
+        # Yields the file edges of a PR: the first page from get_pr_data_v4, then, only for PRs
+        # with more changed files than that, each further page as it is fetched. When a page cannot
+        # be fetched the files so far are kept, or with raise_on_error an IOError is raised
+        files = pull_request['files']
+        for file in files['edges']:
+            yield file
+        repo = pull_request['url'].split('/')[-3]
+        while files.get('pageInfo', {}).get('hasNextPage'):
+            self.wait_for_graphql_budget()
+            query = self.get_pr_files_page_query(int(pull_request['number']), repo, files['pageInfo']['endCursor'])
+            r = self.graphql_post(query, self.pr_cache_ttl)
+            json_string = self.graphql_json(r)
+            if json_string is None or 'errors' in json_string or not json_string.get('data'):
+                reason = "HTTP {}".format(r.status_code) if json_string is None else json_string.get('errors', json_string)
+                message = "Could not get all files for PR {}: {}".format(pull_request['number'], reason)
+                if raise_on_error:
+                    raise IOError(message)
+                print(message)
+                return
+            if not getattr(r, 'from_cache', False):
+                self.update_graphql_budget(json_string['data'].get('rateLimit'))
+            files = json_string['data']['repository']['pr0']['files']
+            for file in files['edges']:
+                yield file
+
+    def graphql_json(self, r):
+        # The json body of a GraphQL response, or None when GitHub answered with an error page instead;
+        # a query that takes too long to resolve comes back as a 502 or 504 with an HTML body
+        if r.status_code != 200 or 'json' not in r.headers.get('Content-Type', ''):
+            return None
+        try:
+            return r.json()
+        except ValueError:
+            return None
+
+    def get_pr_batch_v4(self, pr_numbers, repo):
+        self.wait_for_graphql_budget()
+        r = self.graphql_post(self.get_pr_batch_query(pr_numbers, repo), self.pr_cache_ttl)
+        if r.status_code == 403 and 'Retry-After' in r.headers:
+            # secondary rate limit for too many concurrent requests
+            time.sleep(int(r.headers['Retry-After']))
+            return self.get_pr_batch_v4(pr_numbers, repo)
+        json_string = self.graphql_json(r)
+        if json_string is None and (r.status_code >= 500 or r.status_code == 200):
+            # retry as two smaller queries, down to single PRs, which are then fetched over REST
+            print("GraphQL query for PRs {} in {} failed with HTTP {}".format(pr_numbers, repo, r.status_code))
+            if len(pr_numbers) > 1:
+                middle = len(pr_numbers)//2
+                return self.get_pr_batch_v4(pr_numbers[:middle], repo) + self.get_pr_batch_v4(pr_numbers[middle:], repo)
+            return [self.get_pr_rest(pr_numbers[0], repo)]
+        if json_string is None:
+            print("GraphQL query for PRs {} in {} failed with HTTP {}".format(pr_numbers, repo, r.status_code))
+            return [{'data': {'repository': {'pullRequest': None}}} for pr_number in pr_numbers]
+        if 'errors' in json_string:
+            print("GraphQL errors for PRs {} in {}: {}".format(pr_numbers, repo, json_string['errors']))
+        data = json_string.get('data') or {}
+        if not getattr(r, 'from_cache', False):
+            self.update_graphql_budget(data.get('rateLimit'))
+        repository = data.get('repository') or {}
+        return [{'data': {'repository': {'pullRequest': repository.get('pr%d' % i)}}} for i in range(len(pr_numbers))]
+
+    rest_change_types = {'added': 'ADDED', 'removed': 'DELETED', 'modified': 'MODIFIED', 'renamed': 'RENAMED',
+                         'copied': 'COPIED', 'changed': 'CHANGED'}
+
+    def get_pr_rest(self, pr_number, repo):
+        # One PR and all its files from the REST API, in the shape get_pr_data_v4 returns, for PRs
+        # whose GraphQL query keeps failing. The pullRequest is None if it could not be fetched
+        headers1 = {'Authorization': 'token ' + self.patoken}
+        pr_url = 'https://api.github.com/repos/MicrosoftDocs/{}/pulls/{}'.format(repo, pr_number)
+        r = self.http_get(pr_url, headers1, self.pr_cache_ttl)
+        if r.status_code != 200:
+            print("REST fallback for PR {} in {} failed with HTTP {}".format(pr_number, repo, r.status_code))
+            return {'data': {'repository': {'pullRequest': None}}}
+        pr = r.json()
+        edges = []
+        files_url = pr_url + '/files?per_page=100'
+        while files_url is not None:
+            r = self.http_get(files_url, headers1, self.pr_cache_ttl)
+            if r.status_code != 200:
+                print("REST fallback for the files of PR {} in {} failed with HTTP {}".format(pr_number, repo, r.status_code))
+                return {'data': {'repository': {'pullRequest': None}}}
+            for file in r.json():
+                edges.append({'node': {'path': file['filename'], 'additions': file['additions'], 'deletions': file['deletions'],
+                                       'changeType': self.rest_change_types.get(file['status'], file['status'].upper())}})
+            files_url = r.links.get('next', {}).get('url')
+        pull_request = {'author': {'login': pr['user']['login']} if pr.get('user') else None,
+                        'url': pr['html_url'],
+                        'title': pr['title'],
+                        'bodyText': pr.get('body') or '',
+                        'createdAt': pr['created_at'],
+                        'additions': pr['additions'],
+                        'changedFiles': pr['changed_files'],
+                        'state': 'MERGED' if pr.get('merged_at') else pr['state'].upper(),
+                        'publishedAt': pr['created_at'],
+                        'mergedAt': pr.get('merged_at'),
+                        'number': pr['number'],
+                        'files': {'pageInfo': {'hasNextPage': False, 'endCursor': None}, 'edges': edges}}
+        return {'data': {'repository': {'pullRequest': pull_request}}}
+
+    def update_graphql_budget(self, rate_limit):
+        self.graphql_budget.update(rate_limit)
+
+    def wait_for_graphql_budget(self):
+        self.graphql_budget.wait(self.graphql_min_remaining)
         
     def aggregate_sort_pr_data(self, pr_data_array,description_field='title'):
         file_info = {}
         updated_file_info_list = []
         new_file_info_list = []
         contributor_info_list = []
+        self.top_contributors = {}
         
         for pr in pr_data_array:
             try:
@@ -225,13 +710,15 @@ class docs_github_wrapper_html:
                 number = json.dumps(pr['data']['repository']['pullRequest']['number'])
                 author = json.dumps(pr['data']['repository']['pullRequest']['author']['login']).replace("\"","")
                 published_date = json.dumps(pr['data']['repository']['pullRequest']['publishedAt'])
+                merged_date = pr['data']['repository']['pullRequest'].get('mergedAt') or pr['data']['repository']['pullRequest']['publishedAt']
+                pr_repo = pr['data']['repository']['pullRequest']['url'].split('/')[-3]
                 title = json.dumps(pr['data']['repository']['pullRequest']['title'])
                 bodyText = json.dumps(pr['data']['repository']['pullRequest']['bodyText'])
             except:
                 print("Error processing pr: "+str(pr))
                 continue
                    
-            for file in pr['data']['repository']['pullRequest']['files']['edges']:
+            for file in self.iter_pr_files(pr['data']['repository']['pullRequest']):
                 file_name = json.dumps(file['node']['path']).replace("\"","")
                 
                 if ".md" not in file_name:
@@ -245,6 +732,10 @@ class docs_github_wrapper_html:
                 current_file_info = file_info.get(file_name,{})
                 current_file_info["total_modifications"] = current_file_info.get("total_modifications",0) + int(pr_additions) + int(pr_deletions)
                 current_file_info["times_modified"] = current_file_info.get("times_modified",0) + 1
+                current_file_info.setdefault("repo", pr_repo)
+                if file['node'].get('changeType') == 'ADDED':
+                    current_file_info["added_in_pr"] = True
+                    self.record_first_commit(pr_repo, file_name, merged_date, True)
                 
                 if author not in self.contributors_ignore:
                     if author not in self.top_contributors:
@@ -252,9 +743,6 @@ class docs_github_wrapper_html:
                     else:
                         self.top_contributors[author] = self.top_contributors.get(author) + 1
 
-                if 'doc_title' not in current_file_info:
-                    current_file_info["doc_title"] = self.get_doc_title_path(file_name)
-                
                 if description_field == "title":
                     if len(title) > 2:
                             if 'description' in current_file_info:
@@ -274,13 +762,18 @@ class docs_github_wrapper_html:
                 
                 file_info[file_name] = current_file_info
         
+        newly_added = self.detect_newly_added_bulk(file_info)
+        doc_titles = self.resolve_doc_titles([self.output_docs_url(key) for key in file_info.keys()])
+        for key in file_info.keys():
+            file_info[key]["doc_title"] = doc_titles[self.output_docs_url(key)]
+        
         for key in file_info.keys():
             
             if "description" not in file_info[key]:
                 file_info[key]["description"] = "None"
                 file_info[key]["description_html"] = "None"
             
-            new_article = self.detect_newly_added(key)
+            new_article = newly_added[key]
             
             if new_article:
                 new_file_info_list.append({"file_name": key,
@@ -314,7 +807,7 @@ class docs_github_wrapper_html:
         sorted_list3 = sorted(contributor_info_list, key=lambda k: k['total_prs'], reverse=True) 
         self.sorted_contributor_list = sorted_list3  
            
-    def html_table(self, digest_mode):
+    def html_table(self, digest_mode, file_suffix=""):
         final_string = '''
         <html>
             <head>
@@ -371,14 +864,14 @@ class docs_github_wrapper_html:
         final_string += '<tr><th>Doc Title</th><th>Added</th><th>Total Lines Modified</th><th>Number of Pull Requests</th><th>Description of Changes</th></tr>'
         for file_dict in self.sorted_new_list:
             if len(file_dict)>0:
-                final_string += '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>'.format(self.output_docs_link(file_dict["file_name"]),
+                final_string += '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>'.format('<a href="{}">{}</a>'.format(self.output_docs_url(file_dict["file_name"]), file_dict["doc_title"]),
                                                                                                             "A" if file_dict["newly_added"] == 1 else "U",
                                                                                                             file_dict["total_modifications"],
                                                                                                             file_dict["times_modified"],
                                                                                                             file_dict["description_html"])
         for file_dict in self.sorted_update_list:
             if len(file_dict)>0:
-                final_string += '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>'.format(self.output_docs_link(file_dict["file_name"]),
+                final_string += '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>'.format('<a href="{}">{}</a>'.format(self.output_docs_url(file_dict["file_name"]), file_dict["doc_title"]),
                                                                                                             "A" if file_dict["newly_added"] == 1 else "U",
                                                                                                             file_dict["total_modifications"],
                                                                                                             file_dict["times_modified"],
@@ -387,6 +880,6 @@ class docs_github_wrapper_html:
         #"""
         #cur_dt1 = datetime.datetime.today()
         #dt_str = '{:%m_%d_%y_%H_%M}'.format(cur_dt1)
-        file_name = "GitHub_PR_Query_Data_"+self.service+"_"+self.begin_date.replace("-","")+"_"+self.end_date.replace("-","")+".html"
+        file_name = "GitHub_PR_Query_Data_"+self.service+"_"+self.begin_date.replace("-","")+"_"+self.end_date.replace("-","")+file_suffix+".html"
         with open(file_name, "w") as text_file:
             print(final_string, file=text_file)
\ No newline at end of file
@@ -0,0 +1,132 @@
+import requests
+import sqlite3
+import hashlib
+import json
+import threading
+import time
+
+class http_response_cache:
+    # On-disk cache of HTTP responses in a SQLite file, shared by every report run.
+    # GET responses are keyed by URL and revalidated with If-None-Match once their TTL has passed,
+    # so an unchanged resource costs a 304 (which GitHub does not count against the rate limit).
+    # POST responses (GraphQL) are keyed by URL and request body and are only reused within their TTL.
+    # Both keys also carry a fingerprint of the Authorization header, so a response fetched with one
+    # token (say, from a private repo) is never served to a run with another.
+    # Least recently used entries are evicted once the bodies exceed max_bytes
+
+    cacheable_statuses = (200, 301, 404)
+
+    def __init__(self, cache_path, max_bytes=512*1024*1024):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            url TEXT,
+            etag TEXT,
+            status INTEGER,
+            headers TEXT,
+            body BLOB,
+            fetched_at REAL,
+            last_used REAL,
+            size INTEGER)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.connection.commit()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def get(self, session, url, headers=None, ttl=3600, **kwargs):
+        key = 'GET ' + url + self.credential_key(headers)
+        entry = self.lookup(key)
+        now = time.time()
+        if entry is not None and now - entry['fetched_at'] < ttl:
+            self.touch(key, now, refreshed=False)
+            self.hits += 1
+            return self.to_response(url, entry)
+        request_headers = dict(headers or {})
+        if entry is not None and entry['etag']:
+            request_headers['If-None-Match'] = entry['etag']
+        response = session.get(url, headers=request_headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.touch(key, now, refreshed=True)
+            self.revalidated += 1
+            return self.to_response(url, entry)
+        self.misses += 1
+        if response.status_code in self.cacheable_statuses:
+            self.store(key, url, response)
+        return response
+
+    def post_json(self, session, url, payload, headers=None, ttl=3600, **kwargs):
+        body = json.dumps(payload, sort_keys=True)
+        key = 'POST ' + url + ' ' + hashlib.sha256(body.encode()).hexdigest() + self.credential_key(headers)
+        entry = self.lookup(key)
+        now = time.time()
+        if entry is not None and now - entry['fetched_at'] < ttl:
+            self.touch(key, now, refreshed=False)
+            self.hits += 1
+            return self.to_response(url, entry)
+        response = session.post(url, json=payload, headers=headers, **kwargs)
+        self.misses += 1
+        if response.status_code == 200 and 'json' in response.headers.get('Content-Type', '') and 'errors' not in response.json():
+            self.store(key, url, response)
+        return response
+
+    def credential_key(self, headers):
+        # A hash of the Authorization header rather than the token itself, which never reaches the cache file
+        authorization = {name.lower(): value for name, value in (headers or {}).items()}.get('authorization')
+        if authorization is None:
+            return ''
+        return ' auth:' + hashlib.sha256(authorization.encode()).hexdigest()[:16]
+
+    def lookup(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT etag, status, headers, body, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'status': row[1], 'headers': json.loads(row[2]), 'body': row[3], 'fetched_at': row[4]}
+
+    def touch(self, key, now, refreshed):
+        with self.lock:
+            if refreshed:
+                self.connection.execute("UPDATE responses SET fetched_at = ?, last_used = ? WHERE key = ?", (now, now, key))
+            else:
+                self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+
+    def store(self, key, url, response):
+        now = time.time()
+        kept_headers = {name: value for name, value in response.headers.items() if name.lower() in ('etag', 'link', 'content-type', 'location')}
+        body = response.content
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (key, url, response.headers.get('ETag'), response.status_code, json.dumps(kept_headers), body, now, now, len(body)))
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        while total_bytes > self.max_bytes:
+            oldest = self.connection.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 100").fetchall()
+            if len(oldest) == 0:
+                return
+            for key, size in oldest:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total_bytes -= size
+                if total_bytes <= self.max_bytes:
+                    break
+
+    def to_response(self, url, entry):
+        response = requests.Response()
+        response.url = url
+        response.status_code = entry['status']
+        response._content = entry['body']
+        response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        response.encoding = 'utf-8'
+        response.from_cache = True
+        return response
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,182 @@
+import sqlite3
+import threading
+
+class pr_store:
+    # Local SQLite copy of the merged PRs of each service and the files they changed, kept in the
+    # normalized rows aggregate_sort_pr_data reads. synced_ranges records which merged dates of a
+    # service/repo have been fetched from GitHub, so reports over any date window inside that range
+    # are answered by a query and overlapping reports only fetch the days not synced yet.
+    # label_syncs records when the service labels of the synced PRs were last brought up to date
+
+    file_batch_size = 100
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(store_path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS prs (
+                repo TEXT,
+                number INTEGER,
+                url TEXT,
+                author TEXT,
+                title TEXT,
+                body_text TEXT,
+                created_at TEXT,
+                published_at TEXT,
+                merged_at TEXT,
+                additions INTEGER,
+                changed_files INTEGER,
+                state TEXT,
+                PRIMARY KEY (repo, number));
+            CREATE TABLE IF NOT EXISTS pr_files (
+                repo TEXT,
+                number INTEGER,
+                position INTEGER,
+                path TEXT,
+                additions INTEGER,
+                deletions INTEGER,
+                change_type TEXT,
+                PRIMARY KEY (repo, number, position));
+            CREATE TABLE IF NOT EXISTS pr_services (
+                repo TEXT,
+                service TEXT,
+                number INTEGER,
+                PRIMARY KEY (repo, service, number));
+            CREATE TABLE IF NOT EXISTS synced_ranges (
+                repo TEXT,
+                service TEXT,
+                synced_from TEXT,
+                synced_until TEXT,
+                PRIMARY KEY (repo, service));
+            CREATE TABLE IF NOT EXISTS label_syncs (
+                repo TEXT,
+                service TEXT,
+                synced_at TEXT,
+                PRIMARY KEY (repo, service));
+            CREATE INDEX IF NOT EXISTS prs_merged_at ON prs (repo, merged_at);""")
+        self.connection.commit()
+
+    def get_synced_range(self, repo, service):
+        # (first, last) merged date synced for the service in repo, or None before its first sync
+        with self.lock:
+            row = self.connection.execute("SELECT synced_from, synced_until FROM synced_ranges WHERE repo = ? AND service = ?", (repo, service)).fetchone()
+        return row
+
+    def set_synced_range(self, repo, service, synced_from, synced_until):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO synced_ranges VALUES (?, ?, ?, ?)", (repo, service, synced_from, synced_until))
+            self.connection.commit()
+
+    def get_labels_synced_at(self, repo, service):
+        # UTC time the service's labels were last refreshed, as 'YYYY-MM-DDTHH:MM:SSZ', or None if never
+        with self.lock:
+            row = self.connection.execute("SELECT synced_at FROM label_syncs WHERE repo = ? AND service = ?", (repo, service)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_labels_synced_at(self, repo, service, synced_at):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO label_syncs VALUES (?, ?, ?)", (repo, service, synced_at))
+            self.connection.commit()
+
+    def get_stored_numbers(self, repo, numbers):
+        # The PR numbers among numbers that are stored for any service
+        with self.lock:
+            return set(row[0] for number in numbers for row in
+                       self.connection.execute("SELECT number FROM prs WHERE repo = ? AND number = ?", (repo, number)))
+
+    def add_pr_services(self, repo, service, numbers):
+        with self.lock:
+            self.connection.executemany("INSERT OR IGNORE INTO pr_services VALUES (?, ?, ?)", [(repo, service, number) for number in numbers])
+            self.connection.commit()
+
+    def remove_pr_services(self, repo, service, numbers):
+        with self.lock:
+            self.connection.executemany("DELETE FROM pr_services WHERE repo = ? AND service = ? AND number = ?", [(repo, service, number) for number in numbers])
+            self.connection.commit()
+
+    def get_service_numbers(self, repo, service, begin_date, end_date):
+        # The numbers of the service's PRs in repo merged between begin_date and end_date (inclusive)
+        with self.lock:
+            return set(row[0] for row in self.connection.execute("""SELECT p.number
+                FROM prs p JOIN pr_services s ON s.repo = p.repo AND s.number = p.number
+                WHERE s.repo = ? AND s.service = ? AND substr(p.merged_at, 1, 10) BETWEEN ? AND ?""", (repo, service, begin_date, end_date)))
+
+    def store_pr(self, repo, service, pull_request, files):
+        # Stores a PR (pullRequest dict as returned by get_pr_data_v4) with the file edges files yields,
+        # written file_batch_size at a time as they arrive so a PR's files are never all held in memory.
+        # Its prs row goes in last, so a PR is only read back once all its files are stored; if files
+        # raises, the files written so far are removed again and the error is passed on
+        number = int(pull_request['number'])
+        with self.lock:
+            self.connection.execute("DELETE FROM prs WHERE repo = ? AND number = ?", (repo, number))
+            self.connection.execute("DELETE FROM pr_files WHERE repo = ? AND number = ?", (repo, number))
+            self.connection.commit()
+        try:
+            batch = []
+            for position, file in enumerate(files):
+                batch.append((repo, number, position, file['node']['path'], file['node']['additions'],
+                              file['node']['deletions'], file['node'].get('changeType')))
+                if len(batch) >= self.file_batch_size:
+                    self.insert_files(batch)
+                    batch = []
+            self.insert_files(batch)
+        except Exception:
+            with self.lock:
+                self.connection.execute("DELETE FROM pr_files WHERE repo = ? AND number = ?", (repo, number))
+                self.connection.commit()
+            raise
+        author = pull_request['author']['login'] if pull_request.get('author') else None
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO prs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (repo, number, pull_request['url'], author, pull_request['title'], pull_request['bodyText'],
+                                     pull_request['createdAt'], pull_request['publishedAt'],
+                                     pull_request.get('mergedAt') or pull_request['publishedAt'],
+                                     pull_request['additions'], pull_request['changedFiles'], pull_request['state']))
+            self.connection.execute("INSERT OR IGNORE INTO pr_services VALUES (?, ?, ?)", (repo, service, number))
+            self.connection.commit()
+
+    def insert_files(self, rows):
+        with self.lock:
+            self.connection.executemany("INSERT INTO pr_files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+
+    def get_pr_data(self, repo, service, begin_date, end_date):
+        # The service's PRs in repo merged between begin_date and end_date (inclusive), in the
+        # {'data': {'repository': {'pullRequest': ...}}} form get_pr_data_v4 returns, with every file
+        with self.lock:
+            pr_rows = self.connection.execute("""SELECT p.number, p.url, p.author, p.title, p.body_text, p.created_at, p.published_at,
+                    p.merged_at, p.additions, p.changed_files, p.state
+                FROM prs p JOIN pr_services s ON s.repo = p.repo AND s.number = p.number
+                WHERE s.repo = ? AND s.service = ? AND substr(p.merged_at, 1, 10) BETWEEN ? AND ?
+                ORDER BY p.merged_at""", (repo, service, begin_date, end_date)).fetchall()
+            file_rows = self.connection.execute("""SELECT f.number, f.path, f.additions, f.deletions, f.change_type
+                FROM pr_files f JOIN prs p ON p.repo = f.repo AND p.number = f.number
+                JOIN pr_services s ON s.repo = p.repo AND s.number = p.number
+                WHERE s.repo = ? AND s.service = ? AND substr(p.merged_at, 1, 10) BETWEEN ? AND ?
+                ORDER BY f.number, f.position""", (repo, service, begin_date, end_date)).fetchall()
+
+        file_edges = {}
+        for number, path, additions, deletions, change_type in file_rows:
+            file_edges.setdefault(number, []).append({'node': {'path': path, 'additions': additions, 'deletions': deletions, 'changeType': change_type}})
+
+        pr_data = []
+        for number, url, author, title, body_text, created_at, published_at, merged_at, additions, changed_files, state in pr_rows:
+            pull_request = {'author': {'login': author} if author is not None else None,
+                            'url': url,
+                            'title': title,
+                            'bodyText': body_text,
+                            'createdAt': created_at,
+                            'additions': additions,
+                            'changedFiles': changed_files,
+                            'state': state,
+                            'publishedAt': published_at,
+                            'mergedAt': merged_at,
+                            'number': number,
+                            'files': {'pageInfo': {'hasNextPage': False, 'endCursor': None}, 'edges': file_edges.get(number, [])}}
+            pr_data.append({'data': {'repository': {'pullRequest': pull_request}}})
+        return pr_data
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,285 @@
+import docs_github_wrapper_html as wrapper_module
+import pytest
+
+
+class fake_response:
+    def __init__(self, json_data, status_code=200, next_url=None):
+        self.json_data = json_data
+        self.status_code = status_code
+        self.headers = {'Content-Type': 'application/json' if json_data is not None else 'text/html'}
+        self.links = {'next': {'url': next_url}} if next_url else {}
+        self.from_cache = True
+    def json(self):
+        if self.json_data is None:
+            raise ValueError('No JSON object could be decoded')
+        return self.json_data
+
+
+@pytest.fixture
+def wrapper(tmp_path, monkeypatch):
+    # A wrapper with no HTTP cache and its PR store under tmp_path
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(wrapper_module.docs_github_wrapper_html, 'use_cache', False)
+    github_wrapper = wrapper_module.docs_github_wrapper_html("token", "2020-01-01", "2020-01-31", "storage")
+    yield github_wrapper
+    github_wrapper.pr_store.close()
+
+
+def search_page(pr_numbers, total_count=None):
+    return {'total_count': len(pr_numbers) if total_count is None else total_count, 'incomplete_results': False,
+            'items': [{'number': number} for number in pr_numbers]}
+
+
+def pull_request(number, paths, has_next_page):
+    return {'author': {'login': 'writer'}, 'url': 'https://github.com/MicrosoftDocs/azure-docs/pull/%d' % number,
+            'title': 'PR %d' % number, 'bodyText': '', 'createdAt': '2020-01-10T00:00:00Z', 'additions': 1,
+            'changedFiles': 2, 'state': 'MERGED', 'publishedAt': '2020-01-10T00:00:00Z', 'mergedAt': '2020-01-10T00:00:00Z',
+            'number': number,
+            'files': {'pageInfo': {'hasNextPage': has_next_page, 'endCursor': 'cursor1'},
+                      'edges': [{'node': {'path': path, 'additions': 1, 'deletions': 0, 'changeType': 'MODIFIED'}} for path in paths]}}
+
+
+def test_sync_pr_store_leaves_range_unsynced_when_files_page_fails(wrapper, monkeypatch):
+    monkeypatch.setattr(wrapper, 'get_search_page', lambda url: search_page([7]))
+    monkeypatch.setattr(wrapper, 'get_pr_data_v4', lambda pr_numbers, repo: [{'data': {'repository': {'pullRequest': pull_request(7, ['articles/a.md'], True)}}}])
+    files_page = {'data': {'repository': {'pr0': {'files': pull_request(7, ['articles/b.md'], False)['files']}}}}
+    responses = [fake_response({'errors': [{'message': 'timeout'}]}), fake_response(files_page)]
+    monkeypatch.setattr(wrapper, 'graphql_post', lambda query, ttl=0: responses.pop(0))
+
+    wrapper.sync_pr_store("azure-docs")
+    assert wrapper.pr_store.get_synced_range("azure-docs", "storage") is None
+    assert wrapper.pr_store.get_pr_data("azure-docs", "storage", "2020-01-01", "2020-01-31") == []
+
+    wrapper.sync_pr_store("azure-docs")
+    assert wrapper.pr_store.get_synced_range("azure-docs", "storage") == ("2020-01-01", "2020-01-31")
+    pr_data = wrapper.pr_store.get_pr_data("azure-docs", "storage", "2020-01-01", "2020-01-31")
+    assert [edge['node']['path'] for edge in pr_data[0]['data']['repository']['pullRequest']['files']['edges']] == ['articles/a.md', 'articles/b.md']
+
+
+def stub_search(wrapper, monkeypatch, prs_by_day):
+    # Answers search urls from prs_by_day (merged date -> PR numbers), paginated like the search API
+    searched = []
+    def get_search_page(url):
+        searched.append(url)
+        window = url.split('merged:')[1].split('&')[0]
+        begin_date, end_date = window.split('..')
+        page = int(url.split('&page=')[1]) if '&page=' in url else 1
+        pr_numbers = [number for day in sorted(prs_by_day) if begin_date <= day <= end_date for number in prs_by_day[day]]
+        page_numbers = pr_numbers[:wrapper.search_result_cap][(page - 1)*wrapper.search_page_size:page*wrapper.search_page_size]
+        return search_page(page_numbers, total_count=len(pr_numbers))
+    monkeypatch.setattr(wrapper, 'get_search_page', get_search_page)
+    monkeypatch.setattr(wrapper, 'search_result_cap', 10)
+    monkeypatch.setattr(wrapper, 'search_page_size', 4)
+    return searched
+
+
+def test_search_pr_numbers_splits_windows_over_the_cap(wrapper, monkeypatch):
+    prs_by_day = {'2020-01-%02d' % day: [day*10 + i for i in range(3)] for day in range(1, 11)}
+    searched = stub_search(wrapper, monkeypatch, prs_by_day)
+    pr_numbers, complete = wrapper.search_pr_numbers(lambda begin_date, end_date: wrapper.get_label_query("azure-docs", begin_date, end_date), "2020-01-01", "2020-01-10")
+    assert complete
+    assert sorted(int(number) for number in pr_numbers) == sorted(number for numbers in prs_by_day.values() for number in numbers)
+    assert len(searched) > 1
+
+
+def test_search_pr_numbers_dedupes_prs_found_in_several_windows(wrapper, monkeypatch):
+    stub_search(wrapper, monkeypatch, {'2020-01-01': [1, 2, 3], '2020-01-02': [3, 4]})
+    pr_numbers, complete = wrapper.search_pr_numbers(lambda begin_date, end_date: wrapper.get_label_query("azure-docs", begin_date, end_date), "2020-01-01", "2020-01-02")
+    assert sorted(int(number) for number in pr_numbers) == [1, 2, 3, 4]
+
+
+def test_search_pr_numbers_reports_a_single_day_over_the_cap_incomplete(wrapper, monkeypatch):
+    stub_search(wrapper, monkeypatch, {'2020-01-01': list(range(1, 13)), '2020-01-02': [20]})
+    pr_numbers, complete = wrapper.search_pr_numbers(lambda begin_date, end_date: wrapper.get_label_query("azure-docs", begin_date, end_date), "2020-01-01", "2020-01-02")
+    assert not complete
+    assert len(pr_numbers) == 11
+
+
+class fake_page:
+    def __init__(self, status_code, content=b''):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = 'utf-8'
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+    def close(self):
+        pass
+
+
+def test_failed_doc_titles_are_not_cached(wrapper, monkeypatch):
+    ok_url, error_url, down_url = ["https://docs.microsoft.com/en-us/azure/storage/" + name for name in ['ok', 'error', 'down']]
+    timeouts = []
+    def get(url, allow_redirects=True, stream=False, timeout=None):
+        timeouts.append(timeout)
+        if url == down_url:
+            raise wrapper_module.requests.exceptions.ConnectionError('connection reset')
+        if url == error_url:
+            return fake_page(503)
+        return fake_page(200, b'<html><h1>Blob storage</h1></html>')
+    monkeypatch.setattr(wrapper.session, 'get', get)
+
+    doc_titles = wrapper.resolve_doc_titles([ok_url, error_url, down_url])
+    assert doc_titles == {ok_url: 'Blob storage', error_url: '[TITLE UNAVAILABLE] ' + error_url, down_url: '[TITLE UNAVAILABLE] ' + down_url}
+    assert set(timeouts) == {wrapper.doc_title_timeout}
+    assert sorted(wrapper.load_doc_titles()) == [ok_url]
+
+    del timeouts[:]
+    wrapper.resolve_doc_titles([ok_url, error_url])
+    assert len(timeouts) == 1
+
+
+def batch_response(pr_numbers):
+    return fake_response({'data': {'repository': {'pr%d' % i: pull_request(number, ['articles/%d.md' % number], False) for i, number in enumerate(pr_numbers)}}})
+
+
+def test_pr_batches_that_time_out_are_split_down_to_a_rest_fallback(wrapper, monkeypatch):
+    queried = []
+    def graphql_post(query, ttl=0):
+        pr_numbers = [int(line.split('number: ')[1].split(')')[0]) for line in query.splitlines() if 'pullRequest(number:' in line]
+        queried.append(pr_numbers)
+        if 3 in pr_numbers:
+            return fake_response(None, 502)
+        if len(pr_numbers) > 2:
+            return fake_response(None, 504)
+        return batch_response(pr_numbers)
+    rest_urls = []
+    def http_get(url, headers=None, ttl=0, **kwargs):
+        rest_urls.append(url)
+        if url.endswith('/pulls/3'):
+            return fake_response({'user': {'login': 'writer'}, 'html_url': 'https://github.com/MicrosoftDocs/azure-docs/pull/3',
+                                  'title': 'PR 3', 'body': None, 'created_at': '2020-01-10T00:00:00Z', 'additions': 2,
+                                  'changed_files': 2, 'state': 'closed', 'merged_at': '2020-01-11T00:00:00Z', 'number': 3})
+        if url.endswith('/pulls/3/files?per_page=100'):
+            return fake_response([{'filename': 'articles/new.md', 'additions': 1, 'deletions': 0, 'status': 'added'}], next_url=url + '&page=2')
+        return fake_response([{'filename': 'articles/old.md', 'additions': 1, 'deletions': 1, 'status': 'removed'}])
+    monkeypatch.setattr(wrapper, 'graphql_post', graphql_post)
+    monkeypatch.setattr(wrapper, 'http_get', http_get)
+
+    pr_data = wrapper.get_pr_batch_v4([1, 2, 3, 4], "azure-docs")
+    assert [pr['data']['repository']['pullRequest']['number'] for pr in pr_data] == [1, 2, 3, 4]
+    assert queried == [[1, 2, 3, 4], [1, 2], [3, 4], [3], [4]]
+    rest_pr = pr_data[2]['data']['repository']['pullRequest']
+    assert (rest_pr['state'], rest_pr['mergedAt'], rest_pr['bodyText']) == ('MERGED', '2020-01-11T00:00:00Z', '')
+    assert [(edge['node']['path'], edge['node']['changeType']) for edge in rest_pr['files']['edges']] == [('articles/new.md', 'ADDED'), ('articles/old.md', 'DELETED')]
+    assert len(rest_urls) == 3
+
+
+def test_pr_batch_with_a_client_error_is_not_retried(wrapper, monkeypatch):
+    queried = []
+    monkeypatch.setattr(wrapper, 'graphql_post', lambda query, ttl=0: queried.append(query) or fake_response({'message': 'Bad credentials'}, 401))
+    pr_data = wrapper.get_pr_batch_v4([1, 2], "azure-docs")
+    assert [pr['data']['repository']['pullRequest'] for pr in pr_data] == [None, None]
+    assert len(queried) == 1
+
+
+def test_wrappers_for_other_services_share_the_graphql_budget(wrapper, monkeypatch):
+    compute_wrapper = wrapper.for_service("compute")
+    compute_wrapper.update_graphql_budget({'remaining': 10, 'resetAt': '2020-01-01T00:00:00Z'})
+    assert wrapper.graphql_budget.remaining == 10
+    slept = []
+    monkeypatch.setattr(wrapper_module.time, 'sleep', slept.append)
+    wrapper.graphql_budget.reset_at = wrapper_module.datetime.utcnow() + wrapper_module.timedelta(seconds=30)
+    wrapper.wait_for_graphql_budget()
+    assert len(slept) == 1 and slept[0] > 29
+    compute_wrapper.wait_for_graphql_budget()
+    assert len(slept) == 1
+
+
+def serve_file_pages(wrapper, monkeypatch, num_files):
+    # Answers PR files queries from a PR with num_files changed files, graphql_files_page_size per page
+    page_size = wrapper.graphql_files_page_size
+    def files_page(start):
+        paths = ['articles/%d.md' % position for position in range(start, min(start + page_size, num_files))]
+        page = pull_request(7, paths, start + page_size < num_files)['files']
+        page['pageInfo']['endCursor'] = str(start + page_size)
+        return page
+    queried_cursors = []
+    def graphql_post(query, ttl=0):
+        cursor = query.split('after: "')[1].split('"')[0]
+        queried_cursors.append(cursor)
+        return fake_response({'data': {'repository': {'pr0': {'files': files_page(int(cursor))}}}})
+    monkeypatch.setattr(wrapper, 'graphql_post', graphql_post)
+    first_page = dict(pull_request(7, [], False), changedFiles=num_files, files=files_page(0))
+    return first_page, queried_cursors
+
+
+@pytest.mark.parametrize('num_files, extra_pages', [(30, 0), (100, 0), (101, 1), (250, 2)])
+def test_pr_files_are_paged_only_past_the_first_page(wrapper, monkeypatch, num_files, extra_pages):
+    first_page, queried_cursors = serve_file_pages(wrapper, monkeypatch, num_files)
+    paths = [edge['node']['path'] for edge in wrapper.iter_pr_files(first_page, raise_on_error=True)]
+    assert paths == ['articles/%d.md' % position for position in range(num_files)]
+    assert queried_cursors == [str(page*100) for page in range(1, extra_pages + 1)]
+
+
+def test_pr_data_is_fetched_in_batches_and_kept_in_order(wrapper, monkeypatch):
+    batches = []
+    def get_pr_batch_v4(pr_numbers, repo):
+        batches.append(pr_numbers)
+        return [{'data': {'repository': {'pullRequest': pull_request(number, [], False)}}} for number in pr_numbers]
+    monkeypatch.setattr(wrapper, 'get_pr_batch_v4', get_pr_batch_v4)
+    pr_data = wrapper.get_pr_data_v4([str(number) for number in range(1, 61)], "azure-docs")
+    assert sorted(len(batch) for batch in batches) == [10, 25, 25]
+    assert [pr['data']['repository']['pullRequest']['number'] for pr in pr_data] == list(range(1, 61))
+
+
+def test_files_are_classified_as_newly_added_or_updated(wrapper, monkeypatch):
+    pr = pull_request(7, ['articles/added.md', 'articles/brand-new.md', 'articles/old.md'], False)
+    pr['files']['edges'][0]['node']['changeType'] = 'ADDED'
+    history = {'articles/brand-new.md': [], 'articles/old.md': [{'committedDate': '2019-06-01T00:00:00Z'}]}
+    queried_paths = []
+    def graphql_post(query, ttl=0):
+        paths = [line.split('path: "')[1].split('"')[0] for line in query.splitlines() if 'history(' in line]
+        queried_paths.append(paths)
+        return fake_response({'data': {'repository': {'defaultBranchRef': {'target': {'f%d' % i: {'nodes': history[path]} for i, path in enumerate(paths)}}}}})
+    monkeypatch.setattr(wrapper, 'graphql_post', graphql_post)
+    monkeypatch.setattr(wrapper, 'resolve_doc_titles', lambda urls: {url: url for url in urls})
+
+    for run in range(2):
+        wrapper.aggregate_sort_pr_data([{'data': {'repository': {'pullRequest': pr}}}])
+        assert sorted(file_dict['file_name'] for file_dict in wrapper.sorted_new_list) == ['articles/added.md', 'articles/brand-new.md']
+        assert [file_dict['file_name'] for file_dict in wrapper.sorted_update_list] == ['articles/old.md']
+    # the first run settled old.md in the first-commit index, so only brand-new.md is looked up again
+    assert queried_paths == [['articles/brand-new.md', 'articles/old.md'], ['articles/brand-new.md']]
+
+    monkeypatch.setattr(wrapper, 'graphql_post', lambda query, ttl=0: fake_response(None, 502))
+    wrapper.aggregate_sort_pr_data([{'data': {'repository': {'pullRequest': pr}}}])
+    assert [file_dict['file_name'] for file_dict in wrapper.sorted_new_list] == ['articles/added.md']
+
+
+def test_sync_pr_store_refreshes_labels_changed_since_the_last_sync(wrapper, monkeypatch):
+    labelled = {7, 8}
+    updated = set()
+    searches = []
+    def search_pr_numbers(make_query, begin_date, end_date):
+        query = make_query(begin_date, end_date)
+        searches.append(query)
+        with_label = ' label:storage/svc' in query
+        numbers = [number for number in sorted(labelled if with_label else {7, 8, 9} - labelled)
+                   if 'updated:>=' not in query or number in updated]
+        return [str(number) for number in numbers], True
+    monkeypatch.setattr(wrapper, 'search_pr_numbers', search_pr_numbers)
+    fetched = []
+    def get_pr_data_v4(pr_numbers, repo):
+        fetched.extend(int(number) for number in pr_numbers)
+        return [{'data': {'repository': {'pullRequest': pull_request(int(number), ['articles/%s.md' % number], False)}}} for number in pr_numbers]
+    monkeypatch.setattr(wrapper, 'get_pr_data_v4', get_pr_data_v4)
+    stored_prs = lambda: [pr['data']['repository']['pullRequest']['number'] for pr in wrapper.pr_store.get_pr_data("azure-docs", "storage", "2020-01-01", "2020-01-31")]
+
+    wrapper.sync_pr_store("azure-docs")
+    assert stored_prs() == [7, 8] and fetched == [7, 8]
+    labels_synced_at = wrapper.pr_store.get_labels_synced_at("azure-docs", "storage")
+    assert labels_synced_at is not None
+
+    # the label is moved from PR 8 to PR 9 after the range was synced
+    labelled, updated = {7, 9}, {8, 9}
+    del searches[:]
+    wrapper.sync_pr_store("azure-docs")
+    assert sorted(stored_prs()) == [7, 9] and fetched == [7, 8, 9]
+    assert all('updated:>=' + labels_synced_at in query for query in searches) and len(searches) == 2
+
+    # a store synced before labels were refreshed takes the whole labelled range
+    wrapper.pr_store.connection.execute("DELETE FROM label_syncs")
+    labelled, updated = {7}, set()
+    wrapper.sync_pr_store("azure-docs")
+    assert stored_prs() == [7]
@@ -0,0 +1,119 @@
+import requests
+import time
+from http_response_cache import http_response_cache
+
+
+class fake_session:
+    # Answers every request with a 200 whose body names the token it was made with
+    def __init__(self):
+        self.requests = 0
+    def respond(self, headers):
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = 200
+        response._content = ('{"token": "%s"}' % headers.get('Authorization')).encode()
+        response.headers = requests.structures.CaseInsensitiveDict({'Content-Type': 'application/json'})
+        return response
+    def get(self, url, headers=None, **kwargs):
+        return self.respond(headers)
+    def post(self, url, json=None, headers=None, **kwargs):
+        return self.respond(headers)
+
+
+def test_responses_are_not_shared_between_tokens(tmp_path):
+    cache = http_response_cache(str(tmp_path / 'cache.sqlite'))
+    session = fake_session()
+    url = 'https://api.github.com/repos/MicrosoftDocs/azure-docs-pr/commits'
+    for token in ['token first', 'token second', 'token first']:
+        assert cache.get(session, url, {'Authorization': token}).json() == {'token': token}
+        assert cache.post_json(session, url, {'query': 'query'}, {'Authorization': token}).json() == {'token': token}
+    assert session.requests == 4
+    keys = [row[0] for row in cache.connection.execute("SELECT key FROM responses")]
+    assert not any('token' in key for key in keys)
+    cache.close()
+
+
+class error_page_session(fake_session):
+    # Answers every request with the HTML error page GitHub sends when a query times out
+    def respond(self, headers):
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'<html><body>Something went wrong</body></html>'
+        response.headers = requests.structures.CaseInsensitiveDict({'Content-Type': 'text/html'})
+        return response
+
+
+def test_graphql_error_pages_are_returned_but_not_cached(tmp_path):
+    cache = http_response_cache(str(tmp_path / 'cache.sqlite'))
+    session = error_page_session()
+    for attempt in range(2):
+        assert cache.post_json(session, 'https://api.github.com/graphql', {'query': 'query'}).status_code == 200
+    assert session.requests == 2
+    cache.close()
+
+
+class etag_session:
+    # Serves one versioned resource with an ETag and answers 304 to If-None-Match for the current version
+    def __init__(self):
+        self.version = 1
+        self.requests = []
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(dict(headers or {}))
+        response = requests.Response()
+        etag = '"v%d"' % self.version
+        if (headers or {}).get('If-None-Match') == etag:
+            response.status_code = 304
+            response._content = b''
+        else:
+            response.status_code = 200
+            response._content = ('{"version": %d, "path": "%s"}' % (self.version, url)).encode()
+        response.headers = requests.structures.CaseInsensitiveDict({'ETag': etag, 'Content-Type': 'application/json'})
+        return response
+
+
+def test_expired_entries_are_revalidated_with_their_etag(tmp_path, monkeypatch):
+    cache = http_response_cache(str(tmp_path / 'cache.sqlite'))
+    session = etag_session()
+    url = 'https://api.github.com/repos/MicrosoftDocs/azure-docs/commits'
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    assert cache.get(session, url, ttl=60).json()['version'] == 1
+    now[0] += 30
+    assert cache.get(session, url, ttl=60).json()['version'] == 1
+    assert len(session.requests) == 1
+
+    now[0] += 60
+    response = cache.get(session, url, ttl=60)
+    assert response.status_code == 200 and response.json()['version'] == 1
+    assert session.requests[-1]['If-None-Match'] == '"v1"'
+    assert (cache.hits, cache.revalidated, cache.misses) == (1, 1, 1)
+    # the 304 restarted the entry's ttl
+    now[0] += 30
+    cache.get(session, url, ttl=60)
+    assert len(session.requests) == 2
+
+    session.version = 2
+    now[0] += 60
+    assert cache.get(session, url, ttl=60).json()['version'] == 2
+    assert cache.misses == 2
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_past_max_bytes(tmp_path, monkeypatch):
+    session = etag_session()
+    body_size = len(session.get('https://api.github.com/0').content)
+    cache = http_response_cache(str(tmp_path / 'cache.sqlite'), max_bytes=3*body_size)
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    urls = ['https://api.github.com/%d' % number for number in range(4)]
+    for url in urls[:3]:
+        now[0] += 1
+        cache.get(session, url)
+    now[0] += 1
+    cache.get(session, urls[0])
+    now[0] += 1
+    cache.get(session, urls[3])
+    cached_urls = sorted(row[0] for row in cache.connection.execute("SELECT url FROM responses"))
+    assert cached_urls == [urls[0], urls[2], urls[3]]
+    cache.close()
@@ -0,0 +1,42 @@
+import pytest
+from pr_store import pr_store
+
+
+def pull_request(number):
+    return {'author': {'login': 'writer'}, 'url': 'https://github.com/MicrosoftDocs/azure-docs/pull/%d' % number,
+            'title': 'PR %d' % number, 'bodyText': '', 'createdAt': '2020-01-10T00:00:00Z', 'additions': 1,
+            'changedFiles': 250, 'state': 'MERGED', 'publishedAt': '2020-01-10T00:00:00Z', 'mergedAt': '2020-01-10T00:00:00Z',
+            'number': number}
+
+
+def file_edge(path):
+    return {'node': {'path': path, 'additions': 1, 'deletions': 0, 'changeType': 'MODIFIED'}}
+
+
+def test_pr_files_are_written_as_they_arrive(tmp_path):
+    store = pr_store(str(tmp_path / 'prs.sqlite'))
+    stored_counts = []
+    def files():
+        for position in range(250):
+            if position % 100 == 0:
+                stored_counts.append(store.connection.execute("SELECT COUNT(*) FROM pr_files").fetchone()[0])
+            yield file_edge('articles/%d.md' % position)
+    store.store_pr('azure-docs', 'storage', pull_request(7), files())
+    assert stored_counts == [0, 100, 200]
+    pr_data = store.get_pr_data('azure-docs', 'storage', '2020-01-01', '2020-01-31')
+    assert len(pr_data[0]['data']['repository']['pullRequest']['files']['edges']) == 250
+    store.close()
+
+
+def test_pr_whose_files_fail_midway_is_not_stored(tmp_path):
+    store = pr_store(str(tmp_path / 'prs.sqlite'))
+    store.store_pr('azure-docs', 'storage', pull_request(7), [file_edge('articles/a.md')])
+    def files():
+        for position in range(150):
+            yield file_edge('articles/%d.md' % position)
+        raise IOError('Could not get all files for PR 7')
+    with pytest.raises(IOError):
+        store.store_pr('azure-docs', 'storage', pull_request(7), files())
+    assert store.get_pr_data('azure-docs', 'storage', '2020-01-01', '2020-01-31') == []
+    assert store.connection.execute("SELECT COUNT(*) FROM pr_files").fetchone()[0] == 0
+    store.close()